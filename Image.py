@@ -1,36 +1,79 @@
+from collections import OrderedDict
 from tkinter import Canvas
 from PIL import Image, ImageTk
 
 class TkImage(Canvas):
+    """
+    Canvas showing an image scaled to fit it
+    Resizes are only drawn once the size stops changing, and scaled images of a keyed content are kept in a small
+    LRU, so showing them again is instant.
+    """
+    # milliseconds without <Configure> event before drawing
+    RESIZE_DELAY = 100
 
     def __init__(self, *args, **kwargs):
         self.image_base = kwargs.pop('image', None)
+        self.image_key = None
+        self.cache_size = kwargs.pop('cache_size', 8)
+        self.cache = OrderedDict()
         self.image = None
+        self.resize_job = None
 
         Canvas.__init__(self, *args, **kwargs)
         self.bind("<Configure>", self.__resize__)
         self.__display__()
 
     def __display__(self):
+        self.resize_job = None
         if not self.image_base:
             return
-        self.delete('all')
 
-        width_img, height_img = self.image_base.size
         width_cv, height_cv = self.winfo_width(), self.winfo_height()
-        ratio = min(width_cv / width_img, height_cv / height_img)
+        # not mapped yet, a <Configure> event follows
+        if width_cv <= 1 or height_cv <= 1:
+            return
+
+        cache_key = (self.image_key, width_cv, height_cv)
+        if self.image_key is not None and cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+            self.image = self.cache[cache_key]
+        else:
+            # a function draws the image directly at the canvas resolution
+            image = self.image_base((width_cv, height_cv)) if callable(self.image_base) else self.image_base
+
+            width_img, height_img = image.size
+            ratio = min(width_cv / width_img, height_cv / height_img)
+            size = (max(1, int(width_img * ratio)), max(1, int(height_img * ratio)))
+            if size != image.size:
+                image = image.resize(size, resample=Image.NEAREST)
 
-        size = (int(width_img * ratio), int(height_img * ratio))
+            self.image = ImageTk.PhotoImage(image)
+            if self.image_key is not None:
+                self.cache[cache_key] = self.image
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
 
-        self.image = ImageTk.PhotoImage(self.image_base.resize(size, resample=Image.NEAREST))
+        self.delete('all')
         self.create_image(width_cv / 2, height_cv / 2, anchor='center', image=self.image)
 
-    def set_image(self, image):
+    def set_image(self, image, key=None):
+        """
+        Show an image
+        Args:
+            image (): PIL image, or function giving the image to show in a (width, height) area
+            key (): identifies the content, its scaled images are cached; None to never reuse them
+        """
         self.image_base = image
+        self.image_key = key
         self.__display__()
 
+    def clear_cache(self):
+        self.cache.clear()
+
     def __resize__(self, event):
-        self.__display__()
+        if self.resize_job is not None:
+            self.after_cancel(self.resize_job)
+        self.resize_job = self.after(self.RESIZE_DELAY, self.__display__)
 
     def refresh(self):
         self.__display__()
@@ -0,0 +1,248 @@
+# -------------------------------------------------------------------------------
+# Name:        asset_index
+# Purpose:     prebuilt index of the texture files, with an optional bundle of every texture already decoded,
+#              so looking up textures does not touch the file system
+# -------------------------------------------------------------------------------
+
+import argparse
+import hashlib
+import json
+import mmap
+import sys
+from os import path, listdir, stat, chdir, replace, getpid
+
+from PIL import Image
+
+# both are build outputs, written by main below
+PATH_INDEX = 'assets/index.json'
+PATH_BUNDLE = 'assets/textures.bin'
+# folders of the files read by the exporter
+INDEXED_DIRECTORIES = ('assets/blocks', 'assets/properties')
+VERSION = 1
+
+
+def get_key(filepath: str) -> str:
+    """
+    Name of a file in the index, the same on every system
+    Args:
+        filepath (): path relative to the working directory, as used by the exporter
+
+    Returns:
+        normalized path with '/' separators
+    """
+    return path.normpath(filepath).replace(path.sep, '/')
+
+
+def list_assets(directories=INDEXED_DIRECTORIES) -> list[str]:
+    """
+    List the texture files to index
+    Args:
+        directories (): folders of the textures, not searched recursively
+
+    Returns:
+        sorted keys, see get_key
+    """
+    keys = []
+    for directory in directories:
+        if path.isdir(directory):
+            keys += [get_key(path.join(directory, filename)) for filename in listdir(directory)
+                     if filename.lower().endswith('.png')]
+    return sorted(keys)
+
+
+def build_index(directories=INDEXED_DIRECTORIES, bundle_path: str = None) -> dict:
+    """
+    Read every texture file once to describe it
+    Args:
+        directories (): folders of the textures
+        bundle_path (): file receiving every texture decoded to RGBA one after the other, no bundle if None
+
+    Returns:
+        dict with
+            'version': VERSION
+            'directories': indexed folders
+            'files': {key: {'hash', 'length', 'mtime', 'size'}, with 'offset' in the bundle}
+            'bundle': {'file': bundle name next to the index, 'length': bytes}, None without bundle
+    """
+    index = {'version': VERSION, 'directories': [get_key(directory) for directory in directories],
+             'files': {}, 'bundle': None}
+
+    bundle = None
+    if bundle_path is not None:
+        temp_path = f'{bundle_path}.{getpid()}.tmp'
+        bundle = open(temp_path, 'wb')
+
+    try:
+        offset = 0
+        for key in list_assets(directories):
+            with open(key, 'rb') as file:
+                content = file.read()
+            file_stat = stat(key)
+            with Image.open(key) as img:
+                img = img.convert('RGBA')
+
+            entry = {'hash': hashlib.sha1(content).hexdigest(), 'length': file_stat.st_size,
+                     'mtime': file_stat.st_mtime_ns, 'size': list(img.size)}
+            if bundle is not None:
+                pixels = img.tobytes()
+                bundle.write(pixels)
+                entry['offset'] = offset
+                offset += len(pixels)
+            index['files'][key] = entry
+    finally:
+        if bundle is not None:
+            bundle.close()
+
+    if bundle is not None:
+        replace(temp_path, bundle_path)
+        index['bundle'] = {'file': path.basename(bundle_path), 'length': offset}
+    return index
+
+
+def write_index(index: dict, index_path: str = PATH_INDEX):
+    temp_path = f'{index_path}.{getpid()}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(index, file, indent=1)
+    replace(temp_path, index_path)
+
+
+def check_index(index: dict) -> bool:
+    """
+    Check that the indexed files are still the ones in the folders, by name, length and modification date
+    Args:
+        index (): dict given by build_index
+
+    Returns:
+        True if the index can be used
+    """
+    if index.get('version') != VERSION:
+        return False
+    if list_assets(index['directories']) != sorted(index['files']):
+        return False
+
+    for key, entry in index['files'].items():
+        file_stat = stat(key)
+        if file_stat.st_size != entry['length'] or file_stat.st_mtime_ns != entry['mtime']:
+            return False
+    return True
+
+
+class AssetIndex:
+    """
+    Texture lookup through the prebuilt index, or through the file system when there is no usable index
+    Textures of the bundle are read from a memory map, no file is opened for them.
+    """
+
+    def __init__(self, index_path: str = PATH_INDEX, verify: bool = True):
+        """
+        Args:
+            index_path (): path of the index, missing when it was not built
+            verify (): compare the index with the folders, PyInstaller builds do not keep modification dates
+        """
+        self.files = None
+        self.directories = ()
+        self.bundle = None
+
+        try:
+            with open(index_path, 'r') as file:
+                index = json.load(file)
+            if index.get('version') != VERSION or (verify and not check_index(index)):
+                return
+        except (OSError, ValueError, KeyError):
+            return
+
+        self.files = index['files']
+        self.directories = tuple(index['directories'])
+        if index['bundle'] is not None:
+            self.bundle = self._open_bundle_(path.join(path.dirname(index_path), index['bundle']['file']),
+                                             index['bundle']['length'])
+
+    @staticmethod
+    def _open_bundle_(bundle_path: str, length: int) -> memoryview | None:
+        try:
+            with open(bundle_path, 'rb') as file:
+                if stat(bundle_path).st_size != length:
+                    return None
+                if length == 0:
+                    return memoryview(b'')
+                # the map stays valid once the file is closed
+                return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        except OSError:
+            return None
+
+    def has_bundle(self) -> bool:
+        return self.bundle is not None
+
+    def _get_entry_(self, filepath: str) -> dict | None:
+        if self.files is None:
+            return None
+        return self.files.get(get_key(filepath))
+
+    def _is_indexed_(self, filepath: str) -> bool:
+        return self.files is not None and path.dirname(get_key(filepath)) in self.directories
+
+    def exists(self, filepath: str) -> bool:
+        """
+        Check if a texture file exists
+        Args:
+            filepath (): path relative to the working directory
+        """
+        if self._is_indexed_(filepath):
+            return self._get_entry_(filepath) is not None
+        return path.exists(filepath)
+
+    def open(self, filepath: str) -> Image.Image:
+        """
+        Read a texture
+        Args:
+            filepath (): path relative to the working directory
+
+        Returns:
+            RGBA image, free to modify
+        """
+        entry = self._get_entry_(filepath)
+        if entry is not None and self.bundle is not None:
+            size = tuple(entry['size'])
+            data = self.bundle[entry['offset']:entry['offset'] + size[0] * size[1] * 4]
+            return Image.frombuffer('RGBA', size, data, 'raw', 'RGBA', 0, 1).copy()
+
+        with Image.open(filepath) as img:
+            return img.convert('RGBA')
+
+    def get_hash(self, filepath: str) -> str | None:
+        """
+        Get the content hash of a texture file, the one TextureCache computes
+        Args:
+            filepath (): path relative to the working directory
+
+        Returns:
+            sha1 hex digest, None if the file is not indexed
+        """
+        entry = self._get_entry_(filepath)
+        return entry['hash'] if entry is not None else None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Build the texture index, to run before packaging the application '
+                                                 'and after editing textures')
+    parser.add_argument('-b', '--bundle', action='store_true', help='also pack every decoded texture in one file')
+    parser.add_argument('-c', '--check', action='store_true', help='only check that the index is up to date')
+    args = parser.parse_args(argv)
+
+    # assets are relative to the repository
+    chdir(path.dirname(path.abspath(__file__)))
+
+    if args.check:
+        up_to_date = AssetIndex(verify=True).files is not None
+        print('up to date' if up_to_date else 'missing or stale')
+        return 0 if up_to_date else 1
+
+    index = build_index(bundle_path=PATH_BUNDLE if args.bundle else None)
+    write_index(index)
+    bundle = index['bundle']
+    print(f'{len(index["files"])} files indexed' + (f', {bundle["length"]} bytes bundled' if bundle else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
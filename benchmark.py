@@ -0,0 +1,325 @@
+# -------------------------------------------------------------------------------
+# Name:        benchmark
+# Purpose:     measure the export throughput on example and synthetic structures
+# -------------------------------------------------------------------------------
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+from multiprocessing import get_context, freeze_support
+from os import path, walk, chdir, listdir
+from time import perf_counter
+
+import numpy as np
+import PIL
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from encoding import IMAGE_FORMATS, STRATEGIES
+from containers import CONTAINER_FORMATS
+from export import Exporter, ExportSettings
+from nbt_reader import read_structure
+from profiler import get_max_rss
+from texture_cache import TextureCache
+
+VERSION = 1
+BLOCK_SIZES = (16, 32, 64, 128)
+EXAMPLES = ('cod', 'pufferfish', 'salmon_0', 'salmon_1')
+SYNTHETICS = ('dense', 'sparse', 'palette', 'large')
+
+# blocks drawn from a single texture, for synthetic structures
+FULL_BLOCKS = ('stone', 'dirt', 'oak_planks', 'cobblestone', 'andesite', 'bricks', 'bookshelf', 'calcite',
+               'amethyst_block', 'white_wool', 'black_wool', 'blue_ice', 'bedrock', 'barrel', 'acacia_planks',
+               'birch_planks')
+
+
+# region synthetic structures
+
+def _get_block_names_(blocks_path: str) -> list[str]:
+    return sorted(path.splitext(f)[0] for f in listdir(blocks_path) if f.endswith('.png') and f != 'air.png')
+
+
+def make_structure(name: str, blocks_path: str = Exporter.PATH_BLOCKS, seed: int = 0) -> dict:
+    """
+    Generate a structure, always the same for a name and a seed
+    Args:
+        name (): 'dense' (32³, no air), 'sparse' (64³, 3% of blocks), 'palette' (48³, thousands of
+                 block states) or 'large' (256³ terrain)
+        blocks_path (): folder of the block textures, names of the 'palette' structure come from it
+        seed (): random seed
+
+    Returns:
+        dict like structure_formats.load_structure
+    """
+    rng = np.random.default_rng(seed)
+    palette = [{'Name': 'minecraft:air'}] + [{'Name': 'minecraft:' + block} for block in FULL_BLOCKS]
+
+    if name == 'dense':
+        indices = rng.integers(1, len(palette), size=(32, 32, 32))
+    elif name == 'sparse':
+        indices = rng.integers(1, len(palette), size=(64, 64, 64))
+        indices[rng.random(indices.shape) >= 0.03] = 0
+    elif name == 'palette':
+        palette = [{'Name': 'minecraft:air'}]
+        for block in _get_block_names_(blocks_path):
+            for facing in ('north', 'east', 'south', 'west'):
+                for half in ('bottom', 'top'):
+                    for is_open in ('false', 'true'):
+                        palette.append({'Name': 'minecraft:' + block,
+                                        'Properties': {'facing': facing, 'half': half, 'open': is_open}})
+        indices = rng.integers(1, len(palette), size=(48, 48, 48))
+    elif name == 'large':
+        # rough terrain: layers of blocks under a random height map
+        size = 256
+        height = 96 + (np.cumsum(rng.integers(-1, 2, size=(size, size)), axis=0) // 4).clip(-64, 64)
+        y = np.arange(size)[None, :, None]
+        layers = np.clip((height[:, None, :] - y) // 16, 0, len(palette) - 2) + 1
+        indices = np.where(y < height[:, None, :], layers, 0)
+    else:
+        raise ValueError(f'Unknown synthetic structure: {name}')
+
+    return {'size': indices.shape, 'indices': indices, 'palette': palette, 'block_entities': [], 'entities': []}
+
+# endregion synthetic structures
+
+
+# region runs
+
+def get_children_max_rss() -> int | None:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _get_directory_size_(directory: str) -> int:
+    size = 0
+    for root, _, files in walk(directory):
+        size += sum(path.getsize(path.join(root, f)) for f in files)
+    return size
+
+
+def run_case(case: str, block_size: int, directory: str, settings: dict, font_path: str = None) -> dict:
+    """
+    Export one case and measure it, meant to run in its own process so the peak memory is its own
+    Args:
+        case (): example or synthetic structure name
+        block_size (): size of a block in pixel
+        directory (): where the layers are written, emptied afterward
+        settings (): ExportSettings values
+        font_path (): legend font, the one of the exporter if None
+
+    Returns:
+        measures of the run
+    """
+    exporter = Exporter(ExportSettings(block_size=block_size, create_profile=False, incremental=False,
+                                       **settings), TextureCache(path.join(directory, 'cache')))
+    if font_path is not None:
+        exporter.PATH_FONTS = font_path
+
+    output = path.join(directory, 'output')
+    start = perf_counter()
+    if case in SYNTHETICS:
+        result = exporter.export_structure(make_structure(case), case, output)
+    else:
+        result = exporter.export(path.join('examples', case + '.nbt'), case, output)
+    total_time = perf_counter() - start
+
+    layers = len(result['paths'])
+    blocks = sum(result['count'].values())
+    written = _get_directory_size_(output)
+    shutil.rmtree(output, ignore_errors=True)
+
+    peak_rss = [rss for rss in (get_max_rss(), get_children_max_rss()) if rss is not None]
+    return {
+        'case': case,
+        'block_size': block_size,
+        'layers': layers,
+        'blocks': blocks,
+        'total_time': total_time,
+        'blocks_per_s': blocks / total_time,
+        'layers_per_s': layers / total_time,
+        'mb_written': written / 2 ** 20,
+        'peak_rss_mb': max(peak_rss) / 2 ** 20 if peak_rss else None,
+        'stages': {name: stage['time'] for name, stage in result['profiler'].stages.items()}
+    }
+
+
+def _run_case_process_(connection, *args):
+    try:
+        connection.send(run_case(*args))
+    except Exception as e:
+        connection.send({'error': f'{type(e).__name__}: {e}'})
+    finally:
+        connection.close()
+
+
+def run_isolated(*args) -> dict:
+    """
+    Call run_case in a new process, not a daemon so the exporter can start its own workers
+    """
+    context = get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case_process_, args=(sender, *args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': f'process exited with code {process.exitcode}'}
+    process.join()
+    return result
+
+
+def get_layer_pixels(case: str, block_size: int, grid_size: int, layout_dir: str) -> int:
+    """
+    Approximate pixels of a layer image, to skip runs that cannot fit in memory
+    """
+    if case in SYNTHETICS:
+        size = {'dense': 32, 'sparse': 64, 'palette': 48, 'large': 256}[case]
+        width = height = size
+    else:
+        size = read_structure(path.join('examples', case + '.nbt'))['size']
+        axis_order = {'x': (0, 2, 1), 'y': (1, 2, 0), 'z': (2, 0, 1)}[layout_dir]
+        width, height = size[axis_order[1]], size[axis_order[2]]
+    return (width * (block_size + grid_size)) * (height * (block_size + grid_size))
+
+
+def run_benchmark(cases, block_sizes, settings: dict, repeat: int = 1, max_pixels: int = 64 * 10 ** 6,
+                  font_path: str = None, keep: str = None, log=print) -> dict:
+    """
+    Run every case at every block size, the fastest of the repeated runs is kept
+    Returns:
+        json serializable report
+    """
+    report = {
+        'version': VERSION,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'settings': settings,
+        'repeat': repeat,
+        'results': {},
+        'skipped': []
+    }
+
+    root = keep if keep is not None else tempfile.mkdtemp(prefix='m2l_benchmark_')
+    try:
+        for case in cases:
+            for block_size in block_sizes:
+                key = f'{case}@{block_size}'
+                pixels = get_layer_pixels(case, block_size, settings.get('grid_size', 2), settings.get('layout_dir', 'y'))
+                if pixels > max_pixels:
+                    report['skipped'].append(key)
+                    log(f'{key:<20} skipped, {pixels / 10 ** 6:.0f} Mpx by layer')
+                    continue
+
+                best = None
+                for _ in range(repeat):
+                    result = run_isolated(case, block_size, root, settings, font_path)
+                    if 'error' in result:
+                        raise RuntimeError(f'{key}: {result["error"]}')
+                    if best is None or result['total_time'] < best['total_time']:
+                        best = result
+
+                report['results'][key] = best
+                log(f"{key:<20} {best['total_time']:8.3f} s {best['blocks_per_s']:12.0f} blocks/s "
+                    f"{best['layers_per_s']:8.2f} layers/s {best['mb_written']:9.1f} MB "
+                    f"{best['peak_rss_mb'] or 0:8.0f} MB RSS")
+    finally:
+        if keep is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return report
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1) -> list[str]:
+    """
+    Find total and stage times slower than in a previous report
+    Args:
+        old (): reference report
+        new (): report to check
+        threshold (): relative slowdown to report, 0.1 for 10%
+
+    Returns:
+        one line by slowdown
+    """
+    slowdowns = []
+    for key, result in new['results'].items():
+        if key not in old['results']:
+            continue
+        reference = old['results'][key]
+
+        times = [('total', reference['total_time'], result['total_time'])]
+        times += [(name, reference['stages'][name], time) for name, time in result['stages'].items()
+                  if name in reference['stages']]
+        for name, before, after in times:
+            # very short stages are mostly noise
+            if before > 0.01 and after > before * (1 + threshold):
+                slowdowns.append(f'{key:<20} {name:<12} {before:8.3f} s -> {after:8.3f} s (+{after / before - 1:.0%})')
+    return slowdowns
+
+# endregion runs
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measure the export throughput of Minecraft2Layout')
+    parser.add_argument('cases', nargs='*', default=list(EXAMPLES + SYNTHETICS),
+                        help=f'examples {", ".join(EXAMPLES)} or synthetic {", ".join(SYNTHETICS)}')
+    parser.add_argument('-s', '--block-sizes', type=int, nargs='+', default=list(BLOCK_SIZES))
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='runs by case, the fastest is kept')
+    parser.add_argument('--layout', choices=('x', 'y', 'z'), default='y')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the texture cache')
+    parser.add_argument('-f', '--format', choices=IMAGE_FORMATS, default='png')
+    parser.add_argument('--indexed', action='store_true', help='indexed PNG with a palette shared by the layers')
+    parser.add_argument('-l', '--compress-level', type=int, default=6)
+    parser.add_argument('--strategy', choices=tuple(STRATEGIES.keys()), default='default')
+    parser.add_argument('-e', '--encode-threads', type=int, default=2)
+    parser.add_argument('--container', choices=tuple(CONTAINER_FORMATS.keys()), default='',
+                        help='write every layer in a single file')
+    parser.add_argument('--max-pixels', type=float, default=64e6, help='skip runs with bigger layer images')
+    parser.add_argument('--font', help='legend font, for checkouts without the bundled one')
+    parser.add_argument('--keep', help='directory kept with the texture cache, instead of a temporary one')
+    parser.add_argument('-o', '--output', help='save the report as JSON')
+    parser.add_argument('-c', '--compare', help='previous JSON report, slower stages are listed')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1, help='relative slowdown to report')
+    args = parser.parse_args(argv)
+
+    for case in args.cases:
+        if case not in EXAMPLES + SYNTHETICS:
+            parser.error(f'unknown case {case}')
+
+    # assets and examples are relative to the repository
+    args.output, args.compare, args.font, args.keep = (path.abspath(p) if p else p for p in
+                                                       (args.output, args.compare, args.font, args.keep))
+    chdir(path.dirname(path.abspath(__file__)))
+
+    settings = {'layout_dir': args.layout, 'workers': args.workers, 'use_cache': not args.no_cache,
+                'image_format': args.format, 'indexed': args.indexed, 'compress_level': args.compress_level,
+                'compress_strategy': args.strategy, 'encode_threads': args.encode_threads, 'container': args.container}
+    report = run_benchmark(args.cases, args.block_sizes, settings, args.repeat, int(args.max_pixels),
+                           args.font, args.keep)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            slowdowns = compare(json.load(file), report, args.threshold)
+        print('\n'.join(slowdowns) if slowdowns else 'No slowdown')
+        return 1 if slowdowns else 0
+    return 0
+
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(main())
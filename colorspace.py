@@ -0,0 +1,80 @@
+# -------------------------------------------------------------------------------
+# Name:        colorspace
+# Purpose:     HSV conversions and texture tinting on whole pixel arrays
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+
+def rgb_to_hsv(rgb: np.ndarray) -> np.ndarray:
+    """
+    Convert colors from RGB to HSV
+    Args:
+        rgb (): array of shape (..., 3)
+
+    Returns:
+        float array of shape (..., 3): hue between 0 and 360, saturation between 0 and 1, value in the scale of rgb
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maximum = rgb.max(axis=-1)
+    minimum = rgb.min(axis=-1)
+    delta = maximum - minimum
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hue = np.select([delta == 0, maximum == r, maximum == g],
+                        [0., (60 * ((g - b) / delta) + 360) % 360, 60 * ((b - r) / delta) + 120],
+                        60 * ((r - g) / delta) + 240)
+        saturation = np.where(maximum == 0, 0., 1 - minimum / maximum)
+    return np.stack((hue, saturation, maximum), axis=-1)
+
+
+def hsv_to_rgb(hsv: np.ndarray) -> np.ndarray:
+    """
+    Convert colors from HSV to RGB
+    Args:
+        hsv (): array of shape (..., 3), as given by rgb_to_hsv
+
+    Returns:
+        float array of shape (..., 3), in the scale of the value
+    """
+    hsv = np.asarray(hsv, dtype=np.float64)
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+
+    sector = np.floor((hue / 60) % 6).astype(np.intp)
+    f = (hue / 60) - sector
+    low = value * (1 - saturation)
+    falling = value * (1 - f * saturation)
+    rising = value * (1 - (1 - f) * saturation)
+
+    # components of each sector of the hue circle
+    r = np.choose(sector, [value, falling, low, low, rising, value])
+    g = np.choose(sector, [rising, value, value, falling, low, low])
+    b = np.choose(sector, [low, low, rising, value, value, falling])
+    return np.stack((r, g, b), axis=-1)
+
+
+def tint(pixels: np.ndarray, colors) -> np.ndarray:
+    """
+    Color grayscale textures, several colors at once
+    Each pixel takes the hue and saturation of the color, and the mean of both brightness. Alpha is kept.
+    Args:
+        pixels (): RGBA textures, uint8 array of shape (..., height, width, 4)
+        colors (): RGB colors between 0 and 255, shape (n, 3)
+
+    Returns:
+        uint8 array of shape (n, ..., height, width, 4), one tinted copy of the textures by color
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    colors = rgb_to_hsv(np.asarray(colors).reshape(-1, 3))
+    # colors along the first axis, broadcast over the pixels
+    colors = colors.reshape((-1,) + (1,) * (pixels.ndim - 1) + (3,))
+
+    value = (colors[..., 2] + pixels[..., :3].max(axis=-1)) / 2
+    hsv = np.stack(np.broadcast_arrays(colors[..., 0], colors[..., 1], value), axis=-1)
+
+    tinted = np.empty(hsv.shape[:-1] + (4,), dtype=np.uint8)
+    # values stay between 0 and 255, truncated like int()
+    tinted[..., :3] = hsv_to_rgb(hsv)
+    tinted[..., 3] = pixels[..., 3]
+    return tinted
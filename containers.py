@@ -0,0 +1,340 @@
+# -------------------------------------------------------------------------------
+# Name:        containers
+# Purpose:     stream every layer of an export in a single file: PDF, TIFF, animated WebP or ZIP
+# -------------------------------------------------------------------------------
+
+import struct
+import zipfile
+from io import BytesIO
+from math import ceil
+from os import path, remove, replace, getpid
+from threading import get_ident
+
+from PIL import Image, TiffImagePlugin
+
+from encoding import LayerEncoder
+
+# file name ending of each container, after the export base name
+CONTAINER_FORMATS = {
+    'pdf': '_layers.pdf',
+    'tiff': '_layers.tiff',
+    'webp': '_layers.webp',
+    'zip': '.zip'
+}
+# largest page side of a PDF at 1 user unit (1/72 inch), bigger pages are scaled with /UserUnit
+PDF_MAX_PAGE = 14400
+
+
+def get_container_path(directory: str, basename: str, container: str) -> str:
+    """
+    Get the path of the file holding every layer
+    Args:
+        directory (): folder of the export
+        basename (): prefix of the created files
+        container (): key of CONTAINER_FORMATS
+
+    Returns:
+        file path
+    """
+    return path.join(directory, basename + CONTAINER_FORMATS[container])
+
+
+def iter_chunks(data: bytes, start: int):
+    """
+    Read the chunks of a PNG (after its signature) or RIFF (after its header) file
+    Args:
+        data (): file content
+        start (): offset of the first chunk
+
+    Returns:
+        iterator of (offset, type, content)
+    """
+    riff = data[:4] == b'RIFF'
+    offset = start
+    while offset + 8 <= len(data):
+        if riff:
+            kind, length = data[offset:offset + 4], struct.unpack('<I', data[offset + 4:offset + 8])[0]
+            end = offset + 8 + length + (length & 1)
+        else:
+            length, kind = struct.unpack('>I', data[offset:offset + 4])[0], data[offset + 4:offset + 8]
+            # length, type, content and crc
+            end = offset + 12 + length
+        yield offset, kind, data[offset + 8:offset + 8 + length]
+        offset = end
+
+
+class PageEncoder:
+    """
+    Encode layer images into the pages of a container, only holds picklable data so it can be sent to worker
+    processes. Pages are encoded independently, the container writer only appends them.
+    """
+
+    def __init__(self, container: str, encoder: LayerEncoder = None):
+        """
+        Args:
+            container (): key of CONTAINER_FORMATS
+            encoder (): settings of the layer images, their compression level is used by every container
+        """
+        if container not in CONTAINER_FORMATS:
+            raise ValueError(f'Unknown container: {container}')
+        self.container = container
+        self.encoder = encoder if encoder is not None else LayerEncoder()
+
+    def encode(self, img: Image.Image) -> tuple[tuple[int, int], bytes | tuple[bytes, bytes | None]]:
+        """
+        Encode an image as a page
+        Args:
+            img (): RGBA image
+
+        Returns:
+            image size
+            page content
+                pdf: zlib streams of the RGB pixels and of the alpha (None if opaque), with PNG row filters
+                tiff: single page deflate TIFF file
+                webp: lossless bitstream chunk of an animation frame
+                zip: image file, as saved without container
+        """
+        if self.container == 'zip':
+            return img.size, bytes(self.encoder.encode(img))
+
+        img = img.convert('RGBA')
+        if self.container == 'pdf':
+            alpha = img.getchannel('A')
+            data = (self._get_flate_stream_(img.convert('RGB')),
+                    None if alpha.getextrema()[0] == 255 else self._get_flate_stream_(alpha))
+        elif self.container == 'tiff':
+            buffer = BytesIO()
+            img.save(buffer, format='TIFF', compression='tiff_adobe_deflate')
+            data = buffer.getvalue()
+        else:
+            riff = bytes(LayerEncoder('webp', self.encoder.compress_level).encode(img))
+            data = b''.join(riff[offset:offset + 8 + len(content) + (len(content) & 1)]
+                            for offset, kind, content in iter_chunks(riff, 12) if kind in (b'ALPH', b'VP8 ', b'VP8L'))
+        return img.size, data
+
+    def _get_flate_stream_(self, img: Image.Image) -> bytes:
+        # the IDAT stream of a PNG is what PDF decodes with /Predictor 15
+        buffer = BytesIO()
+        img.save(buffer, format='PNG', compress_level=self.encoder.compress_level)
+        return b''.join(content for _, kind, content in iter_chunks(buffer.getvalue(), 8) if kind == b'IDAT')
+
+
+class ContainerWriter:
+    """
+    Append pages to a single file as they come, nothing but their offsets is kept in memory
+    The file is written next to its final path and only replaces it once closed, an interrupted export does
+    not leave a truncated container.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.temp_path = f'{filepath}.{getpid()}.{get_ident()}.tmp'
+        self.pages = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, page: tuple, name: str):
+        """
+        Append a page
+        Args:
+            page (): result of PageEncoder.encode
+            name (): file name of the layer, for containers of files
+        """
+        self._add_(*page, name)
+        self.pages += 1
+
+    def _add_(self, size: tuple[int, int], data, name: str):
+        raise NotImplementedError
+
+    def add_file(self, name: str, data: bytes):
+        """
+        Add another file, like the material list, only kept by containers of files
+        """
+
+    def _finish_(self):
+        pass
+
+    def close(self):
+        self._finish_()
+        replace(self.temp_path, self.filepath)
+
+    def abort(self):
+        try:
+            self._finish_()
+        finally:
+            if path.exists(self.temp_path):
+                remove(self.temp_path)
+
+
+class ZipWriter(ContainerWriter):
+    """
+    ZIP archive of the layer images, stored as they are since they are already compressed
+    """
+
+    def __init__(self, filepath: str):
+        super().__init__(filepath)
+        self.file = zipfile.ZipFile(self.temp_path, 'w')
+
+    def _add_(self, size, data, name):
+        self.file.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+
+    def add_file(self, name, data):
+        self.file.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED)
+
+    def _finish_(self):
+        self.file.close()
+
+
+class TiffWriter(ContainerWriter):
+    """
+    Multi-page TIFF, each page is appended by Pillow and its offsets moved to the end of the file
+    """
+
+    def __init__(self, filepath: str):
+        super().__init__(filepath)
+        self.file = TiffImagePlugin.AppendingTiffWriter(self.temp_path, True)
+
+    def _add_(self, size, data, name):
+        self.file.write(data)
+        self.file.newFrame()
+
+    def _finish_(self):
+        self.file.close()
+
+
+class PdfWriter(ContainerWriter):
+    """
+    PDF with one image by page at 72 dpi, objects are written as they come and the page tree at the end
+    """
+
+    def __init__(self, filepath: str):
+        super().__init__(filepath)
+        self.file = open(self.temp_path, 'wb')
+        # offset of each object, 1 is the catalog and 2 the page tree, both written last
+        self.offsets = [None, None]
+        self.kids = []
+        self.file.write(b'%PDF-1.6\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write_object_(self, content: bytes, stream: bytes = None) -> int:
+        self.offsets.append(self.file.tell())
+        self._write_at_(len(self.offsets), content, stream)
+        return len(self.offsets)
+
+    def _write_at_(self, number: int, content: bytes, stream: bytes = None):
+        self.file.write(b'%d 0 obj\n' % number + content)
+        if stream is not None:
+            self.file.write(b'\nstream\n' + stream + b'\nendstream')
+        self.file.write(b'\nendobj\n')
+
+    def _write_image_(self, size: tuple[int, int], data: bytes, colors: int, extra: bytes = b'') -> int:
+        return self._write_object_(
+            b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 %s'
+            b'/Filter /FlateDecode /DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >> '
+            b'/Length %d >>' % (*size, b'/DeviceRGB' if colors == 3 else b'/DeviceGray', extra, colors, size[0],
+                                len(data)), data)
+
+    def _add_(self, size, data, name):
+        width, height = size
+        # readers refuse pages bigger than 200 inches
+        unit = max(1, ceil(max(width, height) / PDF_MAX_PAGE))
+        page_width, page_height = width / unit, height / unit
+
+        color, alpha = data
+        mask = b''
+        if alpha is not None:
+            mask = b'/SMask %d 0 R ' % self._write_image_(size, alpha, 1)
+        image = self._write_image_(size, color, 3, mask)
+        drawing = b'q %.4f 0 0 %.4f 0 0 cm /Im0 Do Q' % (page_width, page_height)
+        contents = self._write_object_(b'<< /Length %d >>' % len(drawing), drawing)
+        self.kids.append(self._write_object_(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] %s/Resources << /XObject << /Im0 %d 0 R >> >> '
+            b'/Contents %d 0 R >>' % (page_width, page_height, b'/UserUnit %d ' % unit if unit > 1 else b'',
+                                      image, contents)))
+
+    def _finish_(self):
+        if self.file.closed:
+            return
+
+        self.offsets[0] = self.file.tell()
+        self._write_at_(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        self.offsets[1] = self.file.tell()
+        self._write_at_(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % kid for kid in self.kids), len(self.kids)))
+
+        xref = self.file.tell()
+        self.file.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets) + 1))
+        for offset in self.offsets:
+            self.file.write(b'%010d 00000 n \n' % offset)
+        self.file.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(self.offsets) + 1, xref))
+        self.file.close()
+
+
+class AnimatedWebPWriter(ContainerWriter):
+    """
+    Animated WebP, each lossless frame is appended to the RIFF file whose size is written when closed
+    """
+
+    def __init__(self, filepath: str, size: tuple[int, int], frame_duration: int = 500):
+        """
+        Args:
+            filepath (): path of the .webp file
+            size (): size of the layers, every frame has it
+            frame_duration (): time each layer is shown, in milliseconds
+        """
+        super().__init__(filepath)
+        self.frame_duration = frame_duration
+        self.file = open(self.temp_path, 'wb')
+
+        width, height = size
+        # animation and alpha flags, canvas size
+        vp8x = struct.pack('<B3x', 0x12) + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little')
+        # transparent background, infinite loop
+        anim = struct.pack('<IH', 0, 0)
+        self.file.write(b'RIFF\0\0\0\0WEBP' + b'VP8X' + struct.pack('<I', len(vp8x)) + vp8x
+                        + b'ANIM' + struct.pack('<I', len(anim)) + anim)
+
+    def _add_(self, size, data, name):
+        width, height = size
+        # frame at (0, 0), shown for frame_duration, replacing the previous one
+        header = bytes(6) + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little') \
+            + self.frame_duration.to_bytes(3, 'little') + b'\x02'
+        self.file.write(b'ANMF' + struct.pack('<I', len(header) + len(data)) + header + data)
+
+    def _finish_(self):
+        if self.file.closed:
+            return
+
+        size = self.file.tell()
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', size - 8))
+        self.file.close()
+
+
+def open_container(container: str, filepath: str, size: tuple[int, int], frame_duration: int = 500) -> ContainerWriter:
+    """
+    Start a container file
+    Args:
+        container (): key of CONTAINER_FORMATS
+        filepath (): path of the file
+        size (): size of the layer images
+        frame_duration (): time each layer is shown in an animated WebP, in milliseconds
+
+    Returns:
+        writer to add the pages to
+    """
+    if container == 'zip':
+        return ZipWriter(filepath)
+    if container == 'tiff':
+        return TiffWriter(filepath)
+    if container == 'pdf':
+        return PdfWriter(filepath)
+    if container == 'webp':
+        return AnimatedWebPWriter(filepath, size, frame_duration)
+    raise ValueError(f'Unknown container: {container}')
@@ -0,0 +1,299 @@
+# -------------------------------------------------------------------------------
+# Name:        derived_textures
+# Purpose:     generate block variants (slab, stairs, fence, sign...) from a base texture and a mask, and tinted
+#              textures from a grayscale one, in batch
+# -------------------------------------------------------------------------------
+
+import argparse
+import json
+import sys
+from os import path, stat, chdir
+
+import numpy as np
+from PIL import Image
+
+from colorspace import tint
+
+PATH_BLOCKS = 'assets/blocks'
+PATH_MASKS = 'assets/masks'
+PATH_BLEND = 'assets/blend'
+# groups of base textures, each one cut with the same masks
+PATH_VARIANTS = path.join(PATH_MASKS, 'variants.json')
+# colors of each grayscale texture
+PATH_TINTS = path.join(PATH_BLEND, 'tints.json')
+
+
+def load_variants(filepath: str = PATH_VARIANTS) -> dict[str, tuple[str, str]]:
+    """
+    Read the variants to generate
+    The file holds groups of {"masks": [mask names], "blocks": {prefix: base texture}}, each variant is named
+    prefix_mask, as Minecraft does: "oak": "oak_planks" with the "slab" mask gives oak_slab.
+    Args:
+        filepath (): path of the JSON file
+
+    Returns:
+        dict of variant name: (base texture name, mask name)
+    """
+    with open(filepath, 'r') as file:
+        groups = json.load(file)
+
+    variants = {}
+    for group in groups.values():
+        for prefix, base in group['blocks'].items():
+            for mask in group['masks']:
+                variants[f'{prefix}_{mask}'] = (base, mask)
+    return variants
+
+
+def load_tints(filepath: str = PATH_TINTS) -> dict[str, tuple[str, tuple[int, int, int]]]:
+    """
+    Read the tinted textures to generate
+    The file holds {grayscale texture: {texture name: [r, g, b]}}, like redstone wire power levels or biome colors
+    of water.
+    Args:
+        filepath (): path of the JSON file
+
+    Returns:
+        dict of texture name: (grayscale texture name, color)
+    """
+    with open(filepath, 'r') as file:
+        sources = json.load(file)
+
+    return {name: (source, tuple(color)) for source, colors in sources.items() for name, color in colors.items()}
+
+
+def get_mask_path(mask: str, masks_dir: str = PATH_MASKS) -> str:
+    return path.join(masks_dir, f'mask_{mask}.png')
+
+
+def apply_masks(bases: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    """
+    Keep the pixels of textures covered by masks, the others become transparent
+    Args:
+        bases (): RGBA textures, shape (n, height, width, 4)
+        masks (): boolean masks, shape (n, height, width), one by texture
+
+    Returns:
+        RGBA textures, shape (n, height, width, 4)
+    """
+    return np.where(masks[..., None], bases, np.uint8(0))
+
+
+def read_mask(img: Image.Image) -> np.ndarray:
+    """
+    Get the pixels kept by a mask image, the fully opaque ones
+    Args:
+        img (): mask image
+
+    Returns:
+        boolean array, shape (height, width)
+    """
+    return np.asarray(img.convert('RGBA').getchannel('A')) == 255
+
+
+def make_variant(base: Image.Image, mask: Image.Image) -> Image.Image:
+    """
+    Cut a texture with a mask
+    Args:
+        base (): base texture, only its part under the mask is used, like the first frame of an animation
+        mask (): mask image
+
+    Returns:
+        RGBA texture of the mask size
+    """
+    mask = read_mask(mask)
+    return Image.fromarray(apply_masks(_fit_(np.asarray(base.convert('RGBA')), mask.shape)[None], mask[None])[0],
+                           'RGBA')
+
+
+def _fit_(pixels: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+    # crop or pad with transparent pixels, from the top left corner
+    height, width = shape
+    fitted = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels = pixels[:height, :width]
+    fitted[:pixels.shape[0], :pixels.shape[1]] = pixels
+    return fitted
+
+
+def get_stale_variants(variants: dict[str, tuple[str, str]], blocks_dir: str = PATH_BLOCKS,
+                       masks_dir: str = PATH_MASKS, output_dir: str = None) -> dict[str, list[str]]:
+    """
+    Compare the variants with their sources, like make does
+    Args:
+        variants (): dict given by load_variants
+        blocks_dir (): folder of the base textures
+        masks_dir (): folder of the masks
+        output_dir (): folder of the variants, blocks_dir if None
+
+    Returns:
+        dict of variant names by state
+            stale: missing, or older than its base texture or mask
+            up_to_date: newer than its sources
+            missing_source: its base texture or mask does not exist
+    """
+    if output_dir is None:
+        output_dir = blocks_dir
+
+    return _get_stale_report_({name: [path.join(blocks_dir, base + '.png'), get_mask_path(mask, masks_dir)]
+                               for name, (base, mask) in variants.items()}, output_dir)
+
+
+def get_stale_tints(tints: dict[str, tuple[str, tuple[int, int, int]]], blend_dir: str = PATH_BLEND,
+                    output_dir: str = PATH_BLOCKS, tints_path: str = PATH_TINTS) -> dict[str, list[str]]:
+    """
+    Compare the tinted textures with their sources, like get_stale_variants
+    Args:
+        tints (): dict given by load_tints
+        blend_dir (): folder of the grayscale textures
+        output_dir (): folder of the tinted textures
+        tints_path (): file the colors were read from, editing it makes every texture stale; None to ignore it
+
+    Returns:
+        dict of texture names by state, see get_stale_variants
+    """
+    extra = [tints_path] if tints_path is not None else []
+    return _get_stale_report_({name: [path.join(blend_dir, source + '.png')] + extra
+                               for name, (source, _) in tints.items()}, output_dir)
+
+
+def _get_stale_report_(sources: dict[str, list[str]], output_dir: str) -> dict[str, list[str]]:
+    report = {'stale': [], 'up_to_date': [], 'missing_source': []}
+    mtimes = {}
+
+    def get_mtime(filepath):
+        if filepath not in mtimes:
+            mtimes[filepath] = stat(filepath).st_mtime_ns if path.exists(filepath) else None
+        return mtimes[filepath]
+
+    for name, paths in sources.items():
+        times = [get_mtime(filepath) for filepath in paths]
+        if None in times:
+            report['missing_source'].append(name)
+            continue
+
+        output = get_mtime(path.join(output_dir, name + '.png'))
+        if output is None or output < max(times):
+            report['stale'].append(name)
+        else:
+            report['up_to_date'].append(name)
+    return report
+
+
+def generate_variants(variants: dict[str, tuple[str, str]], blocks_dir: str = PATH_BLOCKS,
+                      masks_dir: str = PATH_MASKS, output_dir: str = None, only_stale: bool = True) -> dict[str, list[str]]:
+    """
+    Write variant textures, every variant of a mask size is cut in a single array operation
+    Args:
+        variants (): dict given by load_variants
+        blocks_dir (): folder of the base textures
+        masks_dir (): folder of the masks
+        output_dir (): folder of the variants, blocks_dir if None
+        only_stale (): keep the up-to-date variants, see get_stale_variants
+
+    Returns:
+        report of get_stale_variants, with the written variants in 'written'
+    """
+    if output_dir is None:
+        output_dir = blocks_dir
+
+    report = get_stale_variants(variants, blocks_dir, masks_dir, output_dir)
+    names = report['stale'] if only_stale else report['stale'] + report['up_to_date']
+
+    masks = {}
+    bases = {}
+    # variants grouped by mask size, bases are cropped or padded to it
+    groups = {}
+    for name in names:
+        base, mask = variants[name]
+        if mask not in masks:
+            masks[mask] = read_mask(Image.open(get_mask_path(mask, masks_dir)))
+        if base not in bases:
+            with Image.open(path.join(blocks_dir, base + '.png')) as img:
+                bases[base] = np.asarray(img.convert('RGBA'))
+        groups.setdefault(masks[mask].shape, []).append(name)
+
+    report['written'] = []
+    for (height, width), group in groups.items():
+        group_bases = np.empty((len(group), height, width, 4), dtype=np.uint8)
+        group_masks = np.empty((len(group), height, width), dtype=bool)
+        for i, name in enumerate(group):
+            base, mask = variants[name]
+            group_bases[i] = _fit_(bases[base], (height, width))
+            group_masks[i] = masks[mask]
+
+        for name, pixels in zip(group, apply_masks(group_bases, group_masks)):
+            Image.fromarray(pixels, 'RGBA').save(path.join(output_dir, name + '.png'))
+            report['written'].append(name)
+    return report
+
+
+def generate_tints(tints: dict[str, tuple[str, tuple[int, int, int]]], blend_dir: str = PATH_BLEND,
+                   output_dir: str = PATH_BLOCKS, only_stale: bool = True,
+                   tints_path: str = PATH_TINTS) -> dict[str, list[str]]:
+    """
+    Write tinted textures, every color of a grayscale texture is applied in a single array operation
+    Args:
+        tints (): dict given by load_tints
+        blend_dir (): folder of the grayscale textures
+        output_dir (): folder of the tinted textures
+        only_stale (): keep the up-to-date textures, see get_stale_tints
+        tints_path (): file the colors were read from, see get_stale_tints
+
+    Returns:
+        report of get_stale_tints, with the written textures in 'written'
+    """
+    report = get_stale_tints(tints, blend_dir, output_dir, tints_path)
+    names = report['stale'] if only_stale else report['stale'] + report['up_to_date']
+
+    groups = {}
+    for name in names:
+        groups.setdefault(tints[name][0], []).append(name)
+
+    report['written'] = []
+    for source, group in groups.items():
+        with Image.open(path.join(blend_dir, source + '.png')) as img:
+            pixels = np.asarray(img.convert('RGBA'))
+
+        for name, tinted in zip(group, tint(pixels, [tints[name][1] for name in group])):
+            Image.fromarray(tinted, 'RGBA').save(path.join(output_dir, name + '.png'))
+            report['written'].append(name)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Generate block variant and tinted textures')
+    parser.add_argument('variants', nargs='?', default=PATH_VARIANTS, help='JSON file of the variants')
+    parser.add_argument('-t', '--tints', default=PATH_TINTS, help='JSON file of the tinted textures')
+    parser.add_argument('-b', '--blocks', default=PATH_BLOCKS, help='folder of the base textures')
+    parser.add_argument('-m', '--masks', default=PATH_MASKS, help='folder of the masks')
+    parser.add_argument('--blend', default=PATH_BLEND, help='folder of the grayscale textures')
+    parser.add_argument('-o', '--output', help='folder of the generated textures, the blocks folder by default')
+    parser.add_argument('-a', '--all', action='store_true', help='write up-to-date textures too')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only report stale textures')
+    args = parser.parse_args(argv)
+
+    # assets are relative to the repository
+    args.variants, args.tints, args.blocks, args.masks, args.blend, args.output = (
+        path.abspath(p) if p else p for p in (args.variants, args.tints, args.blocks, args.masks, args.blend,
+                                              args.output))
+    chdir(path.dirname(path.abspath(__file__)))
+    output = args.output if args.output else args.blocks
+
+    variants = load_variants(args.variants)
+    tints = load_tints(args.tints)
+    if args.dry_run:
+        reports = {'variants': get_stale_variants(variants, args.blocks, args.masks, output),
+                   'tints': get_stale_tints(tints, args.blend, output, args.tints)}
+    else:
+        reports = {'variants': generate_variants(variants, args.blocks, args.masks, output, not args.all),
+                   'tints': generate_tints(tints, args.blend, output, not args.all, args.tints)}
+
+    for kind, report in reports.items():
+        print(kind)
+        for state, names in report.items():
+            print(f'  {state}: {len(names)}' + (f' ({", ".join(names)})' if names and state != 'up_to_date' else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+# -------------------------------------------------------------------------------
+# Name:        encoding
+# Purpose:     encode layer images: PNG (RGBA or indexed) or lossless WebP
+# -------------------------------------------------------------------------------
+
+import hashlib
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+IMAGE_FORMATS = ('png', 'webp')
+# zlib strategies, given to Pillow as compress_type ('default' lets Pillow choose)
+STRATEGIES = {
+    'default': -1,
+    'zlib_default': 0,
+    'filtered': 1,
+    'huffman_only': 2,
+    'rle': 3,
+    'fixed': 4
+}
+
+
+def pack_colors(colors: np.ndarray) -> np.ndarray:
+    """
+    Pack RGBA colors in one integer each, to compare them quickly
+    Args:
+        colors (): uint8 array (..., 4)
+
+    Returns:
+        flat uint32 array
+    """
+    return np.ascontiguousarray(colors, dtype=np.uint8).reshape(-1, 4).view(np.uint32).ravel()
+
+
+def get_nearest(colors: np.ndarray, palette: np.ndarray, chunk: int = 1 << 14) -> np.ndarray:
+    """
+    Find the closest palette entry of colors
+    Args:
+        colors (): (n, 4) uint8 array
+        palette (): (m, 4) uint8 array
+        chunk (): colors compared at once, bounds the memory of the distance matrix
+
+    Returns:
+        (n,) array of palette indices
+    """
+    palette = palette.astype(np.int32)
+    nearest = np.empty(len(colors), dtype=np.intp)
+    for start in range(0, len(colors), chunk):
+        part = colors[start:start + chunk].astype(np.int32)
+        nearest[start:start + chunk] = ((part[:, None] - palette[None]) ** 2).sum(axis=2).argmin(axis=1)
+    return nearest
+
+
+def _quantize_(pixels: np.ndarray, count: int) -> np.ndarray:
+    """
+    Reduce colors with Pillow, weighted by how often they appear
+    Args:
+        pixels (): (n, 4) uint8 array, colors can repeat
+        count (): number of colors to keep
+
+    Returns:
+        (<= count, 4) uint8 array
+    """
+    if count <= 0 or len(pixels) == 0:
+        return np.zeros((0, 4), dtype=np.uint8)
+
+    # median cut needs RGB, alpha is only kept by the octree
+    opaque = np.all(pixels[:, 3] == 255)
+    if opaque:
+        strip = Image.fromarray(np.ascontiguousarray(pixels[None, :, :3]), 'RGB').quantize(
+            count, method=Image.Quantize.MEDIANCUT)
+        palette = np.array(strip.getpalette('RGBA'), dtype=np.uint8).reshape(-1, 4)
+    else:
+        strip = Image.fromarray(np.ascontiguousarray(pixels[None]), 'RGBA').quantize(
+            count, method=Image.Quantize.FASTOCTREE)
+        palette = np.array(strip.getpalette('RGBA'), dtype=np.uint8).reshape(-1, 4)
+    return palette[np.unique(np.asarray(strip))]
+
+
+def build_palette(pixels: np.ndarray, exact_colors: np.ndarray = None, size: int = 256,
+                  max_samples: int = 1 << 20) -> np.ndarray:
+    """
+    Choose the colors of indexed images
+    Args:
+        pixels (): uint8 array (..., 4) of the colors images are made of, kept exactly if they fit
+        exact_colors (): colors always in the palette (background, grid...)
+        size (): maximum number of entries
+        max_samples (): pixels used to reduce the colors when there are too many
+
+    Returns:
+        (n, 4) uint8 array, n <= size
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 4)
+    exact_colors = np.zeros((0, 4), dtype=np.uint8) if exact_colors is None else \
+        np.unique(np.asarray(exact_colors, dtype=np.uint8).reshape(-1, 4), axis=0)[:size]
+
+    colors = np.unique(pixels, axis=0)
+    colors = colors[~np.isin(pack_colors(colors), pack_colors(exact_colors))]
+    free = size - len(exact_colors)
+    if len(colors) <= free:
+        return np.concatenate((exact_colors, colors))
+
+    # too many colors, images are then approximated: opaque and translucent colors are reduced apart
+    pixels = pixels[::max(1, len(pixels) // max_samples)]
+    translucent = pixels[:, 3] != 255
+    translucent_count = 0
+    if translucent.any():
+        translucent_count = max(1, round(free * translucent.mean()))
+    return np.concatenate((exact_colors, _quantize_(pixels[~translucent], free - translucent_count),
+                           _quantize_(pixels[translucent], translucent_count)))
+
+
+class LayerEncoder:
+    """
+    Settings of the layer image files, only holds picklable data so it can be sent to worker processes
+    """
+
+    def __init__(self, image_format: str = 'png', compress_level: int = 6, strategy: str = 'default',
+                 palette: np.ndarray = None, colors: np.ndarray = None):
+        """
+        Args:
+            image_format (): 'png' or 'webp' (always lossless)
+            compress_level (): 0 (fastest) to 9 (smallest), also sets the WebP effort
+            strategy (): zlib strategy of PNG files, see STRATEGIES
+            palette (): (n, 4) uint8 RGBA colors shared by every image, for indexed PNG; None for RGBA
+            colors (): (m, 4) uint8 colors expected in images, their palette entry is found once
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f'Unknown image format: {image_format}')
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown compression strategy: {strategy}')
+
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.strategy = strategy
+        self.palette = palette if image_format == 'png' else None
+
+        # sorted colors and their palette entry
+        self.color_keys = None
+        self.color_indices = None
+        if self.palette is not None:
+            known = self.palette if colors is None else np.concatenate((self.palette, colors))
+            keys, first = np.unique(pack_colors(known), return_index=True)
+            indices = np.where(first < len(self.palette), first, 0)
+            others = first >= len(self.palette)
+            indices[others] = get_nearest(known[first[others]], self.palette)
+            self.color_keys = keys
+            self.color_indices = indices
+
+    @property
+    def extension(self) -> str:
+        return '.' + self.image_format
+
+    def get_settings(self) -> dict:
+        """
+        Everything that changes the encoded files
+        Returns:
+            json serializable dict
+        """
+        palette = None
+        if self.palette is not None:
+            palette = hashlib.sha1(np.ascontiguousarray(self.palette).tobytes()).hexdigest()
+        return {'format': self.image_format, 'level': self.compress_level, 'strategy': self.strategy,
+                'palette': palette}
+
+    def to_indexed(self, img: Image.Image) -> Image.Image:
+        """
+        Convert an image to the shared palette, colors out of the palette take the closest entry
+        Args:
+            img (): RGBA image
+
+        Returns:
+            P mode image
+        """
+        pixels = np.asarray(img.convert('RGBA'))
+        keys = pack_colors(pixels)
+
+        positions = np.searchsorted(self.color_keys, keys).clip(0, len(self.color_keys) - 1)
+        found = self.color_keys[positions] == keys
+        indices = self.color_indices[positions]
+
+        # unexpected colors, like antialiasing of the text
+        if not found.all():
+            missing, inverse = np.unique(keys[~found], return_inverse=True)
+            indices[~found] = get_nearest(missing.view(np.uint8).reshape(-1, 4), self.palette)[inverse.ravel()]
+
+        indexed = Image.fromarray(indices.astype(np.uint8).reshape(pixels.shape[:2]), 'P')
+        indexed.putpalette(self.palette.tobytes(), rawmode='RGBA')
+        return indexed
+
+    def encode(self, img: Image.Image) -> memoryview:
+        """
+        Encode an image
+        Args:
+            img (): RGBA image
+
+        Returns:
+            file content
+        """
+        buffer = BytesIO()
+        if self.image_format == 'webp':
+            img.save(buffer, format='WEBP', lossless=True, method=round(self.compress_level * 6 / 9),
+                     quality=round(self.compress_level * 100 / 9))
+        else:
+            if self.palette is not None:
+                img = self.to_indexed(img)
+            img.save(buffer, format='PNG', compress_level=self.compress_level, compress_type=STRATEGIES[self.strategy])
+        return buffer.getbuffer()
@@ -0,0 +1,787 @@
+# -------------------------------------------------------------------------------
+# Name:        export
+# Purpose:     headless export pipeline, from a structure file to layer images
+# -------------------------------------------------------------------------------
+
+import sys
+import hashlib
+from collections import Counter
+from multiprocessing import Event
+from os import path, makedirs
+
+import numpy as np
+from PIL import Image
+
+from structure_formats import AIR_BLOCKS, load_structure, minecraft_clean_base, get_air_states, get_fill_state
+from volume import AXIS_ORDERS, get_layout, count_layer
+from render import LayerRenderer, render_parallel, render_pages, render_pages_parallel, copy_layer, get_runs, \
+    get_legend_margin
+from encoding import LayerEncoder, build_palette
+from containers import PageEncoder, open_container, get_container_path
+from texture_cache import TextureCache
+from asset_index import AssetIndex
+from manifest import ExportManifest
+from profiler import Profiler
+from materials import find_structures, get_bill_of_materials, get_totals, write_bill_of_materials
+from resources import resource_path
+
+# region utils
+
+def draw_square(img, x1, y1, x2, y2, color):
+    img[y1:y2, x1:x2] = color
+
+# endregion utils
+
+
+class ExportCancelled(Exception):
+    """
+    Raised by an export stopped with Exporter.cancel, layers already saved are kept
+    """
+
+
+class ExportSettings:
+    """
+    Options of an export, defaults are the ones of the GUI
+    """
+
+    def __init__(self, **kwargs):
+        self.layout_dir = 'y'
+        self.block_size = 64
+        self.grid_size = 2
+        self.offset = 50
+        self.legend_position = 'right'
+        self.workers = 1
+        self.create_dir = True
+        self.create_data = False
+        self.create_missing = False
+        self.create_profile = False
+        self.incremental = True
+        self.duplicate_mode = 'link'
+        self.use_cache = True
+        self.tile_size = 0
+        self.image_format = 'png'
+        self.indexed = False
+        self.compress_level = 6
+        self.compress_strategy = 'default'
+        self.encode_threads = 2
+        # '' for an image by layer, else a key of containers.CONTAINER_FORMATS
+        self.container = ''
+        self.frame_duration = 500
+        # only count the blocks, of a structure file or of every structure of a folder
+        self.materials_only = False
+        # also count the items stored in chests, shulker boxes...
+        self.count_contents = False
+
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise TypeError(f'Unknown export setting: {key}')
+            setattr(self, key, value)
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class Exporter:
+    """
+    Transform structure files to layer images, without any GUI
+    Textures stay in memory between exports of the same exporter.
+    """
+    PATH_BLOCKS = 'assets/blocks'
+    PATH_FONTS = 'assets/includes/fonts/MinecraftRegular.otf'
+    PATH_PROPERTIES = 'assets/properties'
+
+    def __init__(self, settings: ExportSettings = None, texture_cache: TextureCache = None, progress=None,
+                 assets: AssetIndex = None):
+        """
+        Args:
+            settings (): options of the exports, can be replaced between exports
+            texture_cache (): disk cache of textures, the user cache directory if None
+            progress (): called with the progress of an export, from 0 to 100
+            assets (): lookup of the texture files, the prebuilt index if usable
+        """
+        self.settings = settings if settings is not None else ExportSettings()
+        self.texture_cache = texture_cache if texture_cache is not None else TextureCache()
+        self.assets = assets if assets is not None else self.load_assets()
+        self.progress = progress
+
+        self.air_state = -1
+        self.textures = {}
+        self.current_textures = []
+        self.base_current_textures = []
+        self.missing_textures = []
+        self.profiler = Profiler()
+        self.layers_done = 0
+        # shared with the worker processes
+        self.cancel_event = Event()
+
+    @staticmethod
+    def load_assets() -> AssetIndex:
+        """
+        Read the texture index, again after texture files are written
+        """
+        # a PyInstaller build is never edited, and does not keep the dates checked against the index
+        return AssetIndex(verify=not getattr(sys, 'frozen', False))
+
+    def cancel(self):
+        """
+        Stop the running export after the layers being drawn, can be called from any thread
+        """
+        self.cancel_event.set()
+
+    def check_cancel(self):
+        if self.cancel_event.is_set():
+            # the next export starts normally
+            self.cancel_event.clear()
+            raise ExportCancelled()
+
+    def _get_debug_texture_path_(self):
+        return path.join(self.PATH_BLOCKS, 'debug.png')
+
+    def _get_axis_order_(self):
+        return AXIS_ORDERS.get(self.settings.layout_dir, AXIS_ORDERS['z'])
+
+    def _get_preslice_(self, structure):
+        # cells without block and every kind of air become the first air state, or the state past the palette
+        air_states = get_air_states(structure['palette'])
+        self.air_state = get_fill_state(structure['palette'], air_states)
+        return get_layout(structure, self._get_axis_order_(), self.air_state, air_states[1:])
+
+    def get_block_texture(self, block_data):
+        name = minecraft_clean_base(block_data['Name'])
+        filename = name
+        properties = None
+        keys = None
+
+        if 'Properties' in block_data.keys():
+            properties = block_data['Properties']
+            keys = list(properties.keys())
+            keys.sort()
+
+            for k in keys:
+                filename += f'.{k}_{properties[k]}'
+
+        filename += '.png'
+
+        if filename in self.textures.keys():
+            return self.textures[filename]
+
+        block_path = path.join(self.PATH_BLOCKS, name + '.png')
+        if not self.assets.exists(block_path):
+            self._add_missing_texture_('block: ' + name + '.png')
+            block_path = self._get_debug_texture_path_()
+
+        img = self.assets.open(block_path)
+        if properties is not None:
+            if 'waterlogged' in keys:
+                if properties['waterlogged']:
+                    img_2 = self.assets.open(path.join(self.PATH_PROPERTIES, 'waterlogged.png'))
+                    img_2.paste(img, (0, 0), mask=img)
+                keys.remove('waterlogged')
+
+            # for bed
+            if 'part' in keys:
+                if properties['part'] == 'head':
+                    img = img.crop((0, 0, 16, 16))
+                else:
+                    img = img.crop((0, 16, 16, 32))
+                keys.remove('part')
+
+            # for door
+            if 'half' in keys and 'door' in name:
+                if properties['half'] == 'upper':
+                    img = img.crop((0, 0, 16, 16))
+                else:
+                    img = img.crop((0, 16, 16, 32))
+                keys.remove('half')
+
+            for k in keys:
+                img_path = path.join(self.PATH_PROPERTIES, k + "_" + properties[k] + ".png")
+                if self.assets.exists(img_path):
+                    addon = self.assets.open(img_path)
+                    img.paste(addon, (0, 0), mask=addon)
+                else:
+                    self._add_missing_texture_('property: ' + k + "_" + properties[k] + '.png' + ' - block: ' + name)
+
+        self.textures[filename] = img
+        return img
+
+    def _add_missing_texture_(self, missing):
+        if missing not in self.missing_textures:
+            self.missing_textures.append(missing)
+
+    def _get_texture_sources_(self, block_data):
+        """
+        Files a block texture is built from, same resolution as get_block_texture
+        Returns:
+            texture filename (with properties)
+            paths of existing source files
+        """
+        name = minecraft_clean_base(block_data['Name'])
+        filename = name
+
+        block_path = path.join(self.PATH_BLOCKS, name + '.png')
+        if not self.assets.exists(block_path):
+            self._add_missing_texture_('block: ' + name + '.png')
+            block_path = self._get_debug_texture_path_()
+        sources = [block_path]
+
+        if 'Properties' in block_data.keys():
+            properties = block_data['Properties']
+            keys = list(properties.keys())
+            keys.sort()
+
+            for k in keys:
+                filename += f'.{k}_{properties[k]}'
+
+                if k == 'waterlogged':
+                    if properties['waterlogged']:
+                        sources.append(path.join(self.PATH_PROPERTIES, 'waterlogged.png'))
+                elif k != 'part' and not (k == 'half' and 'door' in name):
+                    img_path = path.join(self.PATH_PROPERTIES, k + "_" + properties[k] + ".png")
+                    if self.assets.exists(img_path):
+                        sources.append(img_path)
+                    else:
+                        # reported here too, get_block_texture is not called on a cache hit
+                        self._add_missing_texture_('property: ' + k + "_" + properties[k] + '.png' + ' - block: ' + name)
+
+        return filename + '.png', sources
+
+    def get_scaled_texture(self, block_data, size, resample=None):
+        """
+        Get a block texture resized to size x size, from the disk cache when possible
+        With the texture bundle, building the texture is faster than reading its cache file.
+        Args:
+            block_data (): palette entry
+            size (): size in pixel
+            resample (): resampling filter, None for Pillow default
+        """
+        dimension = (size, size)
+        if not self.settings.use_cache or self.assets.has_bundle():
+            return self.get_block_texture(block_data).resize(dimension, resample=resample)
+
+        filename, sources = self._get_texture_sources_(block_data)
+        entry_path = self.texture_cache.get_entry_path(filename, sources, size, resample, self.assets)
+
+        img = self.texture_cache.load(entry_path)
+        if img is None:
+            img = self.get_block_texture(block_data).resize(dimension, resample=resample)
+            try:
+                self.texture_cache.save(entry_path, img)
+            except OSError:
+                pass  # cache is only an optimisation
+
+        return img
+
+    def get_textures(self, palette, size):
+        self.current_textures = []
+        self.base_current_textures = []
+
+        if get_fill_state(palette) == len(palette):
+            # texture of the state past the palette, see _get_preslice_
+            palette = palette + [{'Name': 'minecraft:air'}]
+        for block_data in palette:
+            if minecraft_clean_base(block_data['Name']) in AIR_BLOCKS:
+                block_data = {'Name': 'minecraft:air'}
+            self.current_textures.append(self.get_scaled_texture(block_data, size, Image.NEAREST))
+            self.base_current_textures.append(self.get_scaled_texture({'Name': block_data['Name']}, size))
+
+    def get_texture_signature(self, palette, states) -> str:
+        """
+        Identify the content of the files the layers are drawn from, like the texture cache does
+        Args:
+            palette (): palette of the structure
+            states (): palette indices present in the layers
+
+        Returns:
+            hex digest, changed by editing any texture used by the layers or their legend
+        """
+        sources = [path.join(self.PATH_PROPERTIES, 'previous_block.png')]
+        for state in sorted(states):
+            block_data = palette[state] if state < len(palette) else {'Name': 'minecraft:air'}
+            if minecraft_clean_base(block_data['Name']) in AIR_BLOCKS:
+                block_data = {'Name': 'minecraft:air'}
+            # the layer texture, then the legend one
+            sources += self._get_texture_sources_(block_data)[1]
+            sources += self._get_texture_sources_({'Name': block_data['Name']})[1]
+
+        signature = self.texture_cache.get_signature(sources, self.assets)
+        return hashlib.sha1(''.join(signature).encode('utf-8')).hexdigest()
+
+    def retrieve_data(self, structure):
+        """
+        blocks separate by layer
+        offset top bottom right left
+        legend by layer
+        """
+        data = {
+            'size': (),
+            'layout': [],
+            'palette': [],
+            'legend': [],
+            'legend_textures': {},
+            'count': {},
+            'layer_count': [],
+            'states': set(),
+            'right': 0,
+            'left': 0,
+            'top': 0,
+            'bottom': 0
+        }
+
+        palette = structure['palette']
+        data['palette'] = palette
+
+        scale = self.settings.block_size
+        with self.profiler.stage('textures'):
+            self.get_textures(palette, scale)
+
+        with self.profiler.stage('preslice'):
+            data['layout'] = self._get_preslice_(structure)
+        grid_size = self.settings.grid_size
+
+        legend_position = self.settings.legend_position
+
+        data['size'] = tuple(data['layout'].shape)
+
+        # count by state first, names are only resolved for present states
+        # one layer at a time, only names and numbers are kept
+        # the state past the palette is air, see _get_preslice_
+        names = [minecraft_clean_base(block_data['Name']) for block_data in palette] + ['air']
+        with self.profiler.stage('count'):
+            for layer in data['layout']:
+                layer_counts, layer_states = count_layer(layer, len(palette))
+                data['states'].update(layer_states.tolist())
+                legend = []
+                layer_count = {}
+                for state in layer_states.tolist():
+                    name = names[state]
+                    if name not in AIR_BLOCKS:
+                        data['legend_textures'].setdefault(name, self.base_current_textures[state])
+
+                        number = int(layer_counts[state])
+                        layer_count[name] = layer_count.get(name, 0) + number
+                        data['count'][name] = data['count'].get(name, 0) + number
+
+                        if name not in legend:
+                            legend.append(name)
+                data['legend'].append(legend)
+                data['layer_count'].append(layer_count)
+        legend_offset = data['legend']
+
+        offset = self.settings.offset
+        data['right'] = offset
+        data['left'] = offset
+        data['top'] = offset
+        data['bottom'] = offset
+
+        # measured on the same text sprites as the drawn legend
+        legend_size = get_legend_margin(resource_path(self.PATH_FONTS), scale, grid_size, legend_position,
+                                        legend_offset)
+
+        data[legend_position] = max(offset, legend_size)
+
+        return data
+
+    @staticmethod
+    def get_grid_template(grid_dimension, scale, grid_size):
+        grid_load = np.zeros((grid_dimension[1], grid_dimension[0], 4), dtype=np.uint8)
+        for x in range(0, grid_dimension[0] + 1, scale + grid_size):  # draw x line
+            draw_square(grid_load, x, 0, x + grid_size, grid_dimension[1], (0, 0, 0, 255))
+        for y in range(0, grid_dimension[1] + 1, scale + grid_size):  # draw y line
+            draw_square(grid_load, 0, y, grid_dimension[0], y + grid_size, (0, 0, 0, 255))
+        return Image.fromarray(grid_load, 'RGBA')
+
+    def export(self, filepath: str, basename: str = None, directory: str = None) -> dict:
+        """
+        Export a structure file
+        Args:
+            filepath (): path to a .nbt, .schem or .litematic file, or a folder of them with materials_only
+            basename (): prefix of the created files, the structure file name if None
+            directory (): where files (or the new folder) are created, the structure directory if None
+
+        Returns:
+            see export_structure, or export_materials with materials_only
+        """
+        if self.settings.materials_only:
+            return self.export_materials(filepath, basename, directory)
+
+        self.cancel_event.clear()
+        profiler = Profiler(self.settings.create_profile)
+        profiler.start_tracing()
+        try:
+            with profiler.stage('parse'):
+                structure = load_structure(filepath)
+
+            if basename is None:
+                basename = path.splitext(path.basename(filepath))[0]
+            if directory is None:
+                directory = path.dirname(filepath)
+
+            return self.export_structure(structure, basename, directory, profiler)
+        finally:
+            # a failed or cancelled export must not leave memory tracing on for the next ones
+            profiler.stop_tracing()
+
+    def export_materials(self, filepath: str, basename: str = None, directory: str = None) -> dict:
+        """
+        Count the blocks of structure files without loading any texture nor drawing any layer
+        Args:
+            filepath (): path to a structure file, or a folder whose structures (sub folders included) are merged
+            basename (): prefix of the created files, the structure file or folder name if None
+            directory (): where files (or the new folder) are created, the folder holding filepath if None
+
+        Returns:
+            dict with
+                'directory': folder of the created files
+                'paths': paths of the CSV and JSON files
+                'count': number of each block, in total
+                'missing': always empty, no texture is used
+                'errors': error message of each unreadable structure
+                'profiler': Profiler of the export
+
+        Raises:
+            ExportCancelled: when cancel is called, nothing is written
+        """
+        self.cancel_event.clear()
+        self.set_progress(0)
+        self.missing_textures = []
+        self.layers_done = 0
+        self.profiler = Profiler(self.settings.create_profile)
+        self.profiler.start_tracing()
+        try:
+            filepath = path.normpath(filepath)
+            if path.isdir(filepath):
+                filepaths = find_structures(filepath)
+                root = filepath
+            else:
+                filepaths = [filepath]
+                root = path.dirname(filepath)
+            if basename is None:
+                basename = path.splitext(path.basename(filepath))[0]
+            if directory is None:
+                directory = path.dirname(filepath)
+
+            bom = get_bill_of_materials(filepaths, root, self.settings.count_contents, self.profiler,
+                                        lambda done: self.set_progress(95 * done // max(1, len(filepaths))),
+                                        self.cancel_event)
+            self.check_cancel()
+
+            directory_path = directory
+            if self.settings.create_dir:
+                directory_path = path.join(directory_path, basename)
+                if not path.exists(directory_path):
+                    makedirs(directory_path)
+
+            with self.profiler.stage('data file'):
+                paths = write_bill_of_materials(bom, directory_path, basename)
+
+            self.profiler.stop_tracing()
+            if self.settings.create_profile:
+                self.profiler.save(path.join(directory_path, basename + '_profile.json'), structure=basename,
+                                   structures=len(filepaths), materials_only=True)
+        finally:
+            self.profiler.stop_tracing()
+
+        self.set_progress(100)
+        return {
+            'directory': directory_path,
+            'paths': paths,
+            'count': dict(get_totals(bom)[0]),
+            'missing': [],
+            'errors': bom['errors'],
+            'profiler': self.profiler
+        }
+
+    def export_structure(self, structure: dict, basename: str, directory: str, profiler: Profiler = None) -> dict:
+        """
+        Export an already loaded structure
+        Args:
+            structure (): dict given by structure_formats.load_structure
+            basename (): prefix of the created files
+            directory (): where files (or the new folder) are created
+            profiler (): profiler of the export, already holding the parse stage
+
+        Returns:
+            dict with
+                'directory': folder of the created files
+                'paths': image path of each layer, the container path for each layer of a container
+                'count': number of each block
+                'missing': missing textures
+                'layers_drawn': number of layers drawn (others are unchanged or duplicated)
+                'layers_duplicated': number of layers copied from an identical one
+                'profiler': Profiler of the export
+
+        Raises:
+            ExportCancelled: when cancel is called, after the layers being drawn are saved
+        """
+        self.check_cancel()
+        self.set_progress(0)
+        self.missing_textures = []
+        self.air_state = -1
+        self.layers_done = 0
+        if profiler is None:
+            profiler = Profiler(self.settings.create_profile)
+            profiler.start_tracing()
+        self.profiler = profiler
+
+        try:
+            return self._export_structure_(structure, basename, directory)
+        finally:
+            # a failed or cancelled export must not leave memory tracing on for the next ones
+            profiler.stop_tracing()
+
+    def _export_structure_(self, structure: dict, basename: str, directory: str) -> dict:
+        container = self.settings.container
+        tile_size = self.settings.tile_size
+        if container and tile_size:
+            raise ValueError('Deep zoom layers cannot be written in a container')
+
+        data = self.retrieve_data(structure)
+        scale = self.settings.block_size
+        size = data['size']
+        grid_size = self.settings.grid_size
+
+        self.set_progress(10)
+
+        legend_position = self.settings.legend_position
+
+        # calculate image dimension
+        dimension = (
+            data['right'] + data['left'] + size[1] * scale + grid_size * (size[1] + 1),
+            data['top'] + data['bottom'] + size[2] * scale + grid_size * (size[2] + 1)
+        )
+
+        # determine main directory
+        directory_path = directory
+        if self.settings.create_dir:
+            directory_path = path.join(directory_path, basename)
+            if not path.exists(directory_path):
+                makedirs(directory_path)
+
+        self.set_progress(15)
+
+        # create grid template, tiles draw their part of the grid themselves
+        grid_img = None
+        if not tile_size:
+            grid_dimension = (dimension[0] - data['right'] - data['left'], dimension[1] - data['top'] - data['bottom'])
+            with self.profiler.stage('grid'):
+                grid_img = self.get_grid_template(grid_dimension, scale, grid_size)
+
+        self.set_progress(20)
+
+        # draw
+        previous_texture = self.assets.open(path.join(self.PATH_PROPERTIES, 'previous_block.png')
+                                            ).resize((self.settings.block_size, self.settings.block_size), resample=Image.NEAREST)
+
+        legend_textures = data['legend_textures']
+        legends = data['legend']
+        encoder = LayerEncoder(self.settings.image_format, self.settings.compress_level, self.settings.compress_strategy)
+        extension = '.dzi' if tile_size else encoder.extension
+        names = [basename + f'_layer_{i_layer + 1}{extension}' for i_layer in range(size[0])]
+        paths = [path.join(directory_path, name) for name in names]
+        if container:
+            paths = [get_container_path(directory_path, basename, container)] * size[0]
+
+        renderer = LayerRenderer(self.current_textures, legend_textures, grid_img, previous_texture,
+                                 resource_path(self.PATH_FONTS), dimension,
+                                 {k: data[k] for k in ['right', 'left', 'top', 'bottom']},
+                                 scale, grid_size, legend_position, self.air_state, tile_size,
+                                 encoder, self.settings.encode_threads)
+
+        if self.settings.indexed and encoder.image_format == 'png':
+            # one palette for every layer, exact when the export has few enough colors
+            with self.profiler.stage('palette'):
+                pixels = renderer.get_pixels()
+                renderer.encoder = LayerEncoder(encoder.image_format, encoder.compress_level, encoder.strategy,
+                                                build_palette(pixels, renderer.get_base_colors()), pixels)
+
+        # only layers whose content or settings changed since the last export are drawn
+        manifest = ExportManifest(path.join(directory_path, basename + '_manifest.json'))
+        render_settings = {
+            'scale': scale, 'grid': grid_size, 'offset': self.settings.offset, 'legend': legend_position,
+            'dimension': dimension, 'margins': renderer.margins,
+            'font': self.texture_cache.get_signature([resource_path(self.PATH_FONTS)])[0],
+            'textures': self.get_texture_signature(data['palette'], data['states']),
+            'texture_cache': TextureCache.VERSION, 'tile_size': tile_size, 'encoder': renderer.encoder.get_settings()
+        }
+        if container:
+            render_settings['container'] = {'format': container, 'frame_duration': self.settings.frame_duration,
+                                            'data': self.settings.create_data}
+        settings_hash = manifest.hash_settings(render_settings)
+        # the hash does not depend on the layer position, identical layers are drawn once
+        todo = []
+        duplicates = {}
+        first_layers = {}
+        previous_layer = None
+        for i_layer, layer in enumerate(data['layout']):
+            with self.profiler.stage('hash'):
+                layer_hash = manifest.hash_layer(settings_hash, layer, previous_layer, self.air_state, data['palette'])
+            # a container is only kept as a whole
+            unchanged = self.settings.incremental and not container and \
+                manifest.is_unchanged(i_layer, layer_hash, paths[i_layer])
+
+            if layer_hash in first_layers:
+                manifest.duplicates[i_layer] = first_layers[layer_hash]
+                if not unchanged:
+                    duplicates[i_layer] = first_layers[layer_hash]
+            else:
+                first_layers[layer_hash] = i_layer
+                if not unchanged:
+                    todo.append(i_layer)
+
+            manifest.layers.append(layer_hash)
+            previous_layer = layer
+        if container and self.settings.incremental and manifest.previous.get('layers') == manifest.layers \
+                and path.exists(paths[0]):
+            todo = []
+            duplicates = {}
+        self.advance_layers(size[0] - len(todo) - len(duplicates), size[0])
+        self.check_cancel()
+        if not container:
+            manifest.save_pending(todo + list(duplicates))
+
+        data_text = None
+        if self.settings.create_data:
+            data_text = self.get_data_text(data)
+
+        workers = self.settings.workers
+        if container:
+            if todo:
+                self.write_container(renderer, data, todo, duplicates, names, paths[0], data_text)
+        elif workers > 1 and len(todo) > 1:
+            render_parallel(renderer, data['layout'], legends, paths, workers,
+                            lambda done: self.advance_layers(done, size[0]), todo, self.profiler, self.cancel_event)
+        else:
+            layout = data['layout']
+            for start, stop in get_runs(todo):
+                previous_layer = layout[start - 1] if start > 0 else None
+                renderer.render_range((layout[i_layer] for i_layer in range(start, stop)), previous_layer,
+                                      legends[start:stop], paths[start:stop], self.profiler,
+                                      lambda done: self.advance_layers(done, size[0]), self.cancel_event)
+        self.check_cancel()
+
+        if not container:
+            with self.profiler.stage('duplicates'):
+                for i_layer, i_source in duplicates.items():
+                    copy_layer(paths[i_source], paths[i_layer], self.settings.duplicate_mode)
+            self.advance_layers(len(duplicates), size[0])
+            manifest.remove_extra_layers(lambda i_layer: path.join(directory_path, basename + f'_layer_{i_layer + 1}{extension}'))
+        self.set_progress(99)
+
+        manifest.data = manifest.previous.get('data')
+        # the data file of a ZIP is in it
+        if data_text is not None and container != 'zip':
+            text = data_text
+            data_path = path.join(directory_path, basename + '_data.csv')
+            manifest.data = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            if not (self.settings.incremental and manifest.is_data_unchanged(manifest.data, data_path)):
+                with self.profiler.stage('data file'):
+                    with open(data_path, 'w') as file:
+                        file.write(text)
+        manifest.save()
+
+        self.missing_textures.sort()
+        if len(self.missing_textures) > 0 and self.settings.create_missing:
+            with open(path.join(directory_path, basename + '_missing.txt'), 'w') as file:
+                file.write(''.join(f'{i}\n' for i in self.missing_textures))
+
+        self.profiler.stop_tracing()
+        if self.settings.create_profile:
+            self.profiler.save(path.join(directory_path, basename + '_profile.json'),
+                               structure=basename, size=size, block_size=scale, workers=workers, container=container,
+                               layers_drawn=len(todo), layers_duplicated=len(duplicates))
+
+        self.set_progress(100)
+        return {
+            'directory': directory_path,
+            'paths': paths,
+            'count': data['count'],
+            'missing': self.missing_textures,
+            'layers_drawn': len(todo),
+            'layers_duplicated': len(duplicates),
+            'profiler': self.profiler
+        }
+
+    @staticmethod
+    def get_data_text(data) -> str:
+        """
+        Build the content of the data file
+        Args:
+            data (): result of retrieve_data
+
+        Returns:
+            CSV text, the number of each block in total and by layer
+        """
+        text = 'Block; Number; Stack x64; Stack x16'
+        for i_layer in range(len(data['layer_count'])):
+            text += f'; Layer {i_layer + 1}'
+
+        for k, v in data['count'].items():
+            text += f"\n{k};{v};{str(v // 64) + ' stack and ' + str(v % 64)};{str(v // 16) + ' stack and ' + str(v % 16)}"
+            for layer_count in data['layer_count']:
+                text += f';{layer_count.get(k, 0)}'
+        return text
+
+    def write_container(self, renderer, data, todo, duplicates, names, container_path, data_text=None):
+        """
+        Draw the layers and stream them in a single file, in order
+        Pages of identical layers are encoded once, and only kept until their last duplicate is written.
+        Args:
+            renderer (): LayerRenderer of the layers
+            data (): result of retrieve_data
+            todo (): sorted indices of the layers to draw
+            duplicates (): index of the identical earlier layer, for the other layers
+            names (): file name of each layer, used inside a ZIP
+            container_path (): path of the container
+            data_text (): content of the data file, added to a ZIP
+        """
+        container = self.settings.container
+        total = len(names)
+        page_encoder = PageEncoder(container, renderer.encoder)
+        if self.settings.workers > 1 and len(todo) > 1:
+            pages = render_pages_parallel(renderer, data['layout'], data['legend'], page_encoder, todo,
+                                          self.settings.workers, self.profiler)
+        else:
+            pages = render_pages(renderer, data['layout'], data['legend'], page_encoder, todo, self.profiler)
+
+        uses = Counter(duplicates.values())
+        kept = {}
+        try:
+            with open_container(container, container_path, renderer.dimension, self.settings.frame_duration) as writer:
+                for i_layer in range(total):
+                    # an unfinished container is deleted
+                    self.check_cancel()
+                    if i_layer in duplicates:
+                        source = duplicates[i_layer]
+                        page = kept[source]
+                        uses[source] -= 1
+                        if uses[source] == 0:
+                            del kept[source]
+                    else:
+                        page = next(pages)
+                        if uses[i_layer]:
+                            kept[i_layer] = page
+
+                    with self.profiler.stage('write'):
+                        writer.add(page, names[i_layer])
+                    self.advance_layers(1, total)
+
+                # build booklets end with the material list
+                if container in ('pdf', 'tiff'):
+                    with self.profiler.stage('materials'):
+                        page = page_encoder.encode(renderer.render_materials(data['count']))
+                    writer.add(page, 'materials')
+                if data_text is not None:
+                    writer.add_file(path.splitext(path.basename(container_path))[0] + '_data.csv',
+                                    data_text.encode('utf-8'))
+        finally:
+            pages.close()
+
+    def set_progress(self, value):
+        if self.progress is not None:
+            self.progress(value)
+
+    def advance_layers(self, count, total):
+        # layers fill the progress from 20 to 99
+        self.layers_done += count
+        self.set_progress(20 + (99 - 20) * self.layers_done // max(1, total))
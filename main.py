@@ -3,86 +3,40 @@
 # Created:     23/05/2023
 # -------------------------------------------------------------------------------
 
-from tkinter import Tk, Frame, Label, Button, Entry, StringVar, BooleanVar, IntVar, Checkbutton, Canvas
+from time import perf_counter
+# origin of the startup time, once the interpreter runs
+START_TIME = perf_counter()
+
+from tkinter import Tk, Frame, Label, Button, Entry, StringVar, BooleanVar, IntVar, Checkbutton, Scale
 from tkinter.filedialog import askopenfilename, askdirectory
 from tkinter.ttk import Combobox, Progressbar
 from tkinter.messagebox import showerror, showinfo, showwarning
 
-from PIL import Image, ImageDraw, ImageFont, ImageTk
-
-import sys
-from os import path, makedirs, environ
-
-import python_nbt.nbt as nbt
-
-from Image import TkImage
-
-# region utils
-
-def resource_path(relative):
-    """ Get absolute path to resource, works for dev and for PyInstaller """
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = path.abspath(".")
-
-    return path.join(base_path, relative)
-
-def get_nbt_data(filepath: str) -> tuple[list[int, int, int], list[dict[str: list[int, int, int] | int]], list[dict[str: dict | str]]]:
-    """
-    Retrieve nbt data from a nbt file
-    Args:
-        filepath (): relative or absolut path to the .nbt file
-
-    Returns:
-        size of the structure
-        blocks data
-        palette data
-    """
-    data_brut = nbt.read_from_nbt_file(filepath)
-    data = data_brut.json_obj(full_json=False)
+from os import path, cpu_count
+from multiprocessing import freeze_support
+from queue import Queue, Empty
+from threading import Thread
 
-    size = tuple(data['size'])
-    blocks = data['blocks']
-    palette = data['palette']
+# numpy, PIL and the export pipeline are imported on first use, so the window opens before them
+from profiler import Profiler
+from resources import resource_path
 
-    return size, blocks, palette
-
-
-def minecraft_clean_base(value: str) -> str:
-    """
-    Clean a minecraft index name from the '#minecraft:' if present
-    Args:
-        value (): the string to evaluate
-
-    Returns:
-        clean string
-    """
-    index = value.find('minecraft:')
-
-    if index == 0:
-        return value[10::]
-    elif index == 1 and value[0] == '#':
-        return '#' + value[11::]
-
-    return value
-
-
-def draw_square(img, x1, y1, x2, y2, color):
-    for x in range(x1, x2):
-        for y in range(y1, y2):
-            img[x, y] = color
-
-# endregion utils
 
 class App(Tk):
     PATH_BLOCKS = 'assets/blocks'
-    PATH_FONTS = 'assets/includes/fonts/MinecraftRegular.otf'
-    PATH_PROPERTIES = 'assets/properties'
     PATH_MASKS = 'assets/masks'
+    # milliseconds between two reads of the export messages
+    POLL_DELAY = 100
+    # seconds from the start of the interpreter to the window, reported beyond it
+    STARTUP_BUDGET = 1.0
 
     def __init__(self, *args, **kwargs):
+        # time to window: imports, then widgets, then the first map of the window
+        self.startup_profiler = Profiler()
+        self.startup_profiler.start = START_TIME
+        self.startup_profiler.add('imports', perf_counter() - START_TIME)
+        widgets_start = perf_counter()
+
         Tk.__init__(self, *args, **kwargs)
 
         # title + icon
@@ -90,50 +44,149 @@ class App(Tk):
         self.iconbitmap(resource_path('assets/includes/icon.ico'))
 
         # variables
-        self.air_state = -1
-        self.textures = {}
-        self.current_textures = []
-        self.base_current_textures = []
         self.export_progress = IntVar()
-        self.missing_textures = []
+        self.export_status = StringVar()
+        # created with the first export, see _get_exporter_
+        self.exporter = None
 
         self.export_progress.set(0)
-
-        # disposition
-        self.frame_file, self.button_file = self.__set_frame_file__()
-        self.frame_settings, self.button_settings = self.__set_frame_settings__()
-        self.frame_display, self.button_display = self.__set_frame_display__()
-        self.frame_debug, self.button_debug = self.__set_frame_debug__()
+        self.export_status.set('')
+
+        # exports run in a background thread, which only talks to the GUI through export_messages
+        self.export_jobs = Queue()
+        self.export_messages = Queue()
+        self.export_thread = None
+        self.export_start = 0
+        self.export_file = ''
+        self.exported_files = []
+        self.export_cancelled = False
+
+        # disposition, each category frame is built the first time it is expanded
+        self.__set_variables__()
+        self.frame_file = self.frame_settings = self.frame_display = self.frame_debug = self.frame_preview = None
+        self.button_file = Button(self, text='\\/ File Category \\/', bg='grey70', command=self._grow_file_)
+        self.button_settings = Button(self, text='\\/ Settings Category \\/', bg='grey70', command=self._grow_settings_)
+        self.button_display = Button(self, text='\\/ Display Category \\/', bg='grey70', command=self._grow_display_)
+        self.button_debug = Button(self, text='\\/ Debug Category \\/', bg='grey70', command=self._grow_debug_)
+        self.button_preview = Button(self, text='\\/ Preview Category \\/', bg='grey70', command=self._grow_preview_)
 
         self.button_file.grid(row=0, column=0, sticky='nsew')
         self.button_settings.grid(row=1, column=0, sticky='nsew')
         self.button_display.grid(row=2, column=0, sticky='nsew')
         self.button_debug.grid(row=3, column=0, sticky='nsew')
+        self.button_preview.grid(row=4, column=0, sticky='nsew')
 
-        # Start Button
-        Button(self, text='Export', command=self.schematize).grid(row=4, column=0, sticky='nsew')
+        # Start Button, queues the file when an export is running
+        Button(self, text='Export', command=self.schematize).grid(row=5, column=0, sticky='nsew')
+        Button(self, text='Cancel', command=self.cancel_export).grid(row=6, column=0, sticky='nsew')
 
         # ProgressBar
         Progressbar(self, orient='horizontal', mode='determinate',
-                    variable=self.export_progress).grid(row=5, column=0, sticky='nsew')
+                    variable=self.export_progress).grid(row=7, column=0, sticky='nsew')
+        Label(self, textvariable=self.export_status, anchor='w').grid(row=8, column=0, sticky='nsew')
 
         self.rowconfigure('all', weight=1)
         self.columnconfigure('all', weight=1)
 
+        self.startup_profiler.add('widgets', perf_counter() - widgets_start)
+        self.bind('<Map>', self._report_startup_)
 
-# region set frame
+    def _report_startup_(self, event):
+        # children send their own Map events to the window bindings
+        if event.widget is not self:
+            return
+        self.unbind('<Map>')
 
-    def __set_frame_file__(self):
-        frame = Frame(self)
-        Button(frame, text='/\\ File Category /\\', bg='grey',
-               command=self._shrink_file_).grid(row=0, column=0, columnspan=3, sticky='nsew')
+        startup_time = perf_counter() - START_TIME
+        self.startup_profiler.add('window', startup_time - sum(stage['time'] for stage in
+                                                               self.startup_profiler.stages.values()))
+        self.profile_text.set('Startup\n' + self.startup_profiler.summary())
+        if startup_time > self.STARTUP_BUDGET:
+            self.export_status.set(f'Slow startup: {startup_time:.2f} s, budget {self.STARTUP_BUDGET:.2f} s')
 
+
+# region set frame
+
+    def __set_variables__(self):
+        # values of every category, read by exports even when their frame was never built
+        # file
         self.path_struct = StringVar()
         self.path_dir = StringVar()
         self.create_dir = BooleanVar()
         self.export_name = StringVar()
+        self.incremental = BooleanVar()
+        self.duplicate_mode = StringVar()
+        self.container = StringVar()
+        self.materials_only = BooleanVar()
+        self.count_contents = BooleanVar()
 
         self.create_dir.set(True)
+        self.incremental.set(True)
+        self.duplicate_mode.set('link')
+        self.container.set('images')
+        self.materials_only.set(False)
+        self.count_contents.set(False)
+
+        # settings
+        self.layout_dir = StringVar()
+        self.render_workers = IntVar()
+        self.encode_threads = IntVar()
+
+        self.layout_dir.set('y')
+        self.render_workers.set(1)
+        self.encode_threads.set(2)
+
+        # display
+        self.block_res = IntVar()
+        self.grid_thick = IntVar()
+        self.offset_space = IntVar()
+        self.legend_pos = StringVar()
+        self.tile_size = IntVar()
+        self.image_format = StringVar()
+        self.indexed = BooleanVar()
+        self.compress_level = IntVar()
+        self.compress_strategy = StringVar()
+
+        self.block_res.set(64)
+        self.grid_thick.set(2)
+        self.offset_space.set(50)
+        self.legend_pos.set('right')
+        self.tile_size.set(0)
+        self.image_format.set('png')
+        self.indexed.set(False)
+        self.compress_level.set(6)
+        self.compress_strategy.set('default')
+
+        # debug, textures of the editor are opened with its frame
+        self.create_data = BooleanVar()
+        self.create_missing = BooleanVar()
+        self.use_cache = BooleanVar()
+        self.create_profile = BooleanVar()
+        self.profile_text = StringVar()
+        self.result_name = StringVar()
+
+        self.create_data.set(False)
+        self.create_missing.set(False)
+        self.use_cache.set(True)
+        self.create_profile.set(False)
+        self.result_name.set('new_texture')
+
+        # preview
+        self.preview = None
+        self.preview_axis = StringVar()
+        self.preview_layer = IntVar()
+        self.preview_text = StringVar()
+
+        self.preview_axis.set('y')
+        self.preview_layer.set(1)
+        self.preview_text.set('No structure loaded')
+
+    def __set_frame_file__(self):
+        from containers import CONTAINER_FORMATS
+
+        frame = Frame(self)
+        Button(frame, text='/\\ File Category /\\', bg='grey',
+               command=self._shrink_file_).grid(row=0, column=0, columnspan=3, sticky='nsew')
 
         # structure file
         Label(frame, text='Structure file: ').grid(row=1, column=0, sticky='nsew')
@@ -152,43 +205,62 @@ class App(Tk):
         # base name
         Label(frame, text='Export name: ').grid(row=4, column=0, sticky='nsew')
         Entry(frame, textvariable=self.export_name).grid(row=4, column=1, columnspan=2, sticky='nsew')
+        # incremental export
+        Label(frame, text='Skip unchanged layers: ').grid(row=5, column=0, sticky='nsew')
+        Checkbutton(frame, anchor='center', variable=self.incremental,
+                    onvalue=True, offvalue=False).grid(row=5, column=1, columnspan=2, sticky='nsew')
+        # identical layers
+        Label(frame, text='Identical layers: ').grid(row=6, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.duplicate_mode,
+                 values=('link', 'copy', 'reference'), state='readonly').grid(row=6, column=1, columnspan=2, sticky='nsew')
+        # single file with every layer
+        Label(frame, text='Layers in: ').grid(row=7, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.container, values=('images',) + tuple(CONTAINER_FORMATS.keys()),
+                 state='readonly').grid(row=7, column=1, columnspan=2, sticky='nsew')
+        # bill of materials, of a file or of every structure of a folder
+        Label(frame, text='Materials list only: ').grid(row=8, column=0, sticky='nsew')
+        Checkbutton(frame, anchor='center', variable=self.materials_only,
+                    onvalue=True, offvalue=False).grid(row=8, column=1, sticky='nsew')
+        Button(frame, text='Browse folder', command=self.__get_path_folder__).grid(row=8, column=2, sticky='nsew')
+        Label(frame, text='Count chest contents: ').grid(row=9, column=0, sticky='nsew')
+        Checkbutton(frame, anchor='center', variable=self.count_contents,
+                    onvalue=True, offvalue=False).grid(row=9, column=1, columnspan=2, sticky='nsew')
 
         frame.rowconfigure('all', weight=1)
         frame.columnconfigure('all', weight=1)
-        return frame, Button(self, text='\\/ File Category \\/', bg='grey70', command=self._grow_file_)
+        return frame
 
     def __set_frame_settings__(self):
         frame = Frame(self)
         Button(frame, text='/\\ Settings Category /\\', bg='grey',
                command=self._shrink_settings_).grid(row=0, column=0, columnspan=2, sticky='nsew')
 
-        self.layout_dir = StringVar()
-        self.layout_dir.set('y')
-
         # orientation
         Label(frame, text='Layout direction:').grid(row=1, column=0, sticky='nsew')
         Combobox(frame, textvariable=self.layout_dir,
                  values=('x', 'y', 'z'), state='readonly').grid(row=1, column=1, sticky='nsew')
 
+        # render processes
+        Label(frame, text='Render workers:').grid(row=2, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.render_workers,
+                 values=tuple(range(1, (cpu_count() or 1) + 1)), state='readonly').grid(row=2, column=1, sticky='nsew')
+
+        # encoding threads of each render process
+        Label(frame, text='Encode threads:').grid(row=3, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.encode_threads,
+                 values=tuple(range(1, 9)), state='readonly').grid(row=3, column=1, sticky='nsew')
+
         frame.rowconfigure('all', weight=1)
         frame.columnconfigure('all', weight=1)
-        return frame, Button(self, text='\\/ Settings Category \\/', bg='grey70', command=self._grow_settings_)
+        return frame
 
     def __set_frame_display__(self):
+        from encoding import IMAGE_FORMATS, STRATEGIES
+
         frame = Frame(self)
         Button(frame, text='/\\ Display Category /\\', bg='grey',
                command=self._shrink_display_).grid(row=0, column=0, columnspan=2, sticky='nsew')
 
-        self.block_res = IntVar()
-        self.grid_thick = IntVar()
-        self.offset_space = IntVar()
-        self.legend_pos = StringVar()
-
-        self.block_res.set(64)
-        self.grid_thick.set(2)
-        self.offset_space.set(50)
-        self.legend_pos.set('right')
-
         # block size
         Label(frame, text='Block size:').grid(row=1, column=0, sticky='nsew')
         Combobox(frame, textvariable=self.block_res,
@@ -209,31 +281,40 @@ class App(Tk):
         Combobox(frame, textvariable=self.legend_pos,
                  values=('right', 'left', 'top', 'bottom'), state='readonly').grid(row=4, column=1, sticky='nsew')
 
+        # deep zoom tiles
+        Label(frame, text='Tile size (0 = one image):').grid(row=5, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.tile_size,
+                 values=(0, 256, 512, 1024), state='readonly').grid(row=5, column=1, sticky='nsew')
+
+        # image files
+        Label(frame, text='Image format:').grid(row=6, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.image_format,
+                 values=IMAGE_FORMATS, state='readonly').grid(row=6, column=1, sticky='nsew')
+        Label(frame, text='Indexed colors (PNG):').grid(row=7, column=0, sticky='nsew')
+        Checkbutton(frame, anchor='center', variable=self.indexed,
+                    onvalue=True, offvalue=False).grid(row=7, column=1, sticky='nsew')
+        Label(frame, text='Compression level:').grid(row=8, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.compress_level,
+                 values=tuple(range(0, 10)), state='readonly').grid(row=8, column=1, sticky='nsew')
+        Label(frame, text='Compression strategy (PNG):').grid(row=9, column=0, sticky='nsew')
+        Combobox(frame, textvariable=self.compress_strategy,
+                 values=tuple(STRATEGIES.keys()), state='readonly').grid(row=9, column=1, sticky='nsew')
+
         frame.rowconfigure('all', weight=1)
         frame.columnconfigure('all', weight=1)
-        return frame, Button(self, text='\\/ Display Category \\/', bg='grey70', command=self._grow_display_)
+        return frame
 
     def __set_frame_debug__(self):
+        from PIL import Image
+        from Image import TkImage
+
         frame = Frame(self)
         Button(frame, text='/\\ Debug Category /\\', bg='grey',
                command=self._shrink_debug_).grid(row=0, column=0, columnspan=2, sticky='nsew')
 
-        self.create_data = BooleanVar()
-        self.create_missing = BooleanVar()
-
-        self.block_canvas = None
         self.block_img = Image.open(self._get_debug_texture_path_())
-
-        self.mask_canvas = None
         self.mask_img = Image.open(path.join(self.PATH_MASKS, 'mask_fence.png'))
-
-        self.result_canvas = None
         self.result_img = Image.new('RGBA', (16, 16))
-        self.result_name = StringVar()
-
-        self.create_data.set(False)
-        self.create_missing.set(False)
-        self.result_name.set('new_texture')
 
         # create data file
         Label(frame, text='Create Data File: ').grid(row=1, column=0, sticky='nsew')
@@ -245,10 +326,21 @@ class App(Tk):
         Checkbutton(frame, anchor='center', variable=self.create_missing,
                     onvalue=True, offvalue=False).grid(row=2, column=1, sticky='nsew')
 
+        # texture cache
+        Label(frame, text='Use Texture Cache: ').grid(row=3, column=0, sticky='nsew')
+        Checkbutton(frame, anchor='center', variable=self.use_cache,
+                    onvalue=True, offvalue=False).grid(row=3, column=1, sticky='nsew')
+
+        # export profile
+        Label(frame, text='Create Profile File: ').grid(row=4, column=0, sticky='nsew')
+        Checkbutton(frame, anchor='center', variable=self.create_profile,
+                    onvalue=True, offvalue=False).grid(row=4, column=1, sticky='nsew')
+        Label(frame, textvariable=self.profile_text, justify='left', anchor='w').grid(row=5, column=0, columnspan=2, sticky='nsew')
+
         # create new texture
-        Label(frame, text='Create new block texture').grid(row=3, column=0, columnspan=2, sticky='nsew')
+        Label(frame, text='Create new block texture').grid(row=6, column=0, columnspan=2, sticky='nsew')
         sub_frame = Frame(frame)
-        sub_frame.grid(row=4, column=0, columnspan=2, sticky='nsew')
+        sub_frame.grid(row=7, column=0, columnspan=2, sticky='nsew')
 
         self.block_canvas = TkImage(sub_frame, width=160, height=160, image=self.block_img)
         self.block_canvas.grid(row=0, column=0, sticky='nsew')
@@ -263,6 +355,10 @@ class App(Tk):
         Entry(sub_frame, textvariable=self.result_name).grid(row=1, column=2, sticky='nsew')
         Button(sub_frame, text='Save', command=self.__save_result_text__).grid(row=2, column=2, sticky='nsew')
 
+        # variants of assets/masks/variants.json and colors of assets/blend/tints.json, only stale ones are written
+        Button(frame, text='Generate derived textures', command=self.__generate_variants__
+               ).grid(row=8, column=0, columnspan=2, sticky='nsew')
+
         self.__process_result_text__()
 
         sub_frame.rowconfigure('all', weight=1)
@@ -270,7 +366,35 @@ class App(Tk):
 
         frame.rowconfigure('all', weight=1)
         frame.columnconfigure('all', weight=1)
-        return frame, Button(self, text='\\/ Debug Category \\/', bg='grey70', command=self._grow_debug_)
+        return frame
+
+    def __set_frame_preview__(self):
+        from Image import TkImage
+
+        frame = Frame(self)
+        Button(frame, text='/\\ Preview Category /\\', bg='grey',
+               command=self._shrink_preview_).grid(row=0, column=0, columnspan=3, sticky='nsew')
+
+        # structure and axis
+        Button(frame, text='Load structure', command=self.__load_preview__).grid(row=1, column=0, sticky='nsew')
+        Label(frame, text='Layout direction:').grid(row=1, column=1, sticky='nsew')
+        axis_box = Combobox(frame, textvariable=self.preview_axis, values=('x', 'y', 'z'), state='readonly')
+        axis_box.grid(row=1, column=2, sticky='nsew')
+        axis_box.bind('<<ComboboxSelected>>', self.__change_preview_axis__)
+
+        # layer
+        self.preview_slider = Scale(frame, from_=1, to=1, orient='horizontal', showvalue=False,
+                                    variable=self.preview_layer, command=self.__show_preview_layer__)
+        self.preview_slider.grid(row=2, column=0, columnspan=2, sticky='nsew')
+        Label(frame, textvariable=self.preview_text).grid(row=2, column=2, sticky='nsew')
+
+        # only the shown layer is drawn, at the canvas resolution
+        self.preview_canvas = TkImage(frame, width=480, height=360, cache_size=16)
+        self.preview_canvas.grid(row=3, column=0, columnspan=3, sticky='nsew')
+
+        frame.rowconfigure('all', weight=1)
+        frame.columnconfigure('all', weight=1)
+        return frame
 
 # endregion set frame
 
@@ -281,6 +405,8 @@ class App(Tk):
         self.button_file.grid(row=0, column=0, sticky='nsew')
 
     def _grow_file_(self):
+        if self.frame_file is None:
+            self.frame_file = self.__set_frame_file__()
         self.frame_file.grid(row=0, column=0, sticky='nsew')
         self.button_file.grid_forget()
 
@@ -289,6 +415,8 @@ class App(Tk):
         self.button_settings.grid(row=1, column=0, sticky='nsew')
 
     def _grow_settings_(self):
+        if self.frame_settings is None:
+            self.frame_settings = self.__set_frame_settings__()
         self.frame_settings.grid(row=1, column=0, sticky='nsew')
         self.button_settings.grid_forget()
 
@@ -297,6 +425,8 @@ class App(Tk):
         self.button_display.grid(row=2, column=0, sticky='nsew')
 
     def _grow_display_(self):
+        if self.frame_display is None:
+            self.frame_display = self.__set_frame_display__()
         self.frame_display.grid(row=2, column=0, sticky='nsew')
         self.button_display.grid_forget()
 
@@ -305,23 +435,57 @@ class App(Tk):
         self.button_debug.grid(row=3, column=0, sticky='nsew')
 
     def _grow_debug_(self):
+        if self.frame_debug is None:
+            self.frame_debug = self.__set_frame_debug__()
         self.frame_debug.grid(row=3, column=0, sticky='nsew')
         self.button_debug.grid_forget()
 
+    def _shrink_preview_(self):
+        self.frame_preview.grid_forget()
+        self.button_preview.grid(row=4, column=0, sticky='nsew')
+
+    def _grow_preview_(self):
+        if self.frame_preview is None:
+            self.frame_preview = self.__set_frame_preview__()
+        self.frame_preview.grid(row=4, column=0, sticky='nsew')
+        self.button_preview.grid_forget()
+
 # endregion shrink & grow
 
 # region settings function
 
     def __get_path_struct__(self):
-        filepath = askopenfilename(title='Structure File', filetypes=[("vanilla Minecraft structure (.nbt)", '*.nbt')])
+        from structure_formats import STRUCTURE_EXTENSIONS
+
+        filepath = askopenfilename(title='Structure File', filetypes=[
+            ("Minecraft structure", ' '.join('*' + extension for extension in STRUCTURE_EXTENSIONS)),
+            ("vanilla Minecraft structure (.nbt)", '*.nbt'),
+            ("Sponge schematic (.schem)", '*.schem'),
+            ("Litematica schematic (.litematic)", '*.litematic')])
 
         if filepath and filepath != '':
+            previous_name = path.splitext(path.basename(self.path_struct.get()))[0]
             self.path_struct.set(filepath)
 
             if self.path_dir.get() == '':
                 self.path_dir.set(path.dirname(filepath))
-            if self.export_name.get() == '':
-                self.export_name.set(path.basename(filepath)[0:-4])
+            # the name follows the file unless it was typed, so queued files do not overwrite each other
+            if self.export_name.get() in ('', previous_name):
+                self.export_name.set(path.splitext(path.basename(filepath))[0])
+
+    def __get_path_folder__(self):
+        dirpath = askdirectory(title='Structure Folder', mustexist=True)
+
+        if dirpath and dirpath != '':
+            previous_name = path.splitext(path.basename(path.normpath(self.path_struct.get())))[0]
+            self.path_struct.set(dirpath)
+            # a folder is only counted
+            self.materials_only.set(True)
+
+            if self.path_dir.get() == '':
+                self.path_dir.set(path.dirname(path.normpath(dirpath)))
+            if self.export_name.get() in ('', previous_name):
+                self.export_name.set(path.basename(path.normpath(dirpath)))
 
     def __get_path_dir__(self):
         dirpath = askdirectory(title='Export Folder', mustexist=True)
@@ -330,23 +494,14 @@ class App(Tk):
             self.path_dir.set(dirpath)
 
     def __process_result_text__(self):
-        self.result_img = Image.new('RGBA', self.block_img.size)
-
-        block_data = self.block_img.load()
-        mask_data = self.mask_img.load()
-        result_data = self.result_img.load()
-
-        width, height = self.mask_img.size
-        for x in range(width):
-            for y in range(height):
-                if mask_data[x, y][3] == 255:
-                    result_data[x, y] = block_data[x, y]
-                else:
-                    result_data[x, y] = (0, 0, 0, 0)
+        from derived_textures import make_variant
 
+        self.result_img = make_variant(self.block_img, self.mask_img)
         self.result_canvas.set_image(self.result_img)
 
     def __get_block_text__(self):
+        from PIL import Image
+
         filepath = askopenfilename(title='Block Texture', filetypes=[("texture (.png)", '*.png')],
                                    initialdir=self.PATH_BLOCKS)
 
@@ -356,6 +511,8 @@ class App(Tk):
             self.__process_result_text__()
 
     def __get_mask_text__(self):
+        from PIL import Image
+
         filepath = askopenfilename(title='Mask Texture', filetypes=[("texture (.png)", '*.png')],
                                    initialdir=self.PATH_MASKS)
 
@@ -367,6 +524,67 @@ class App(Tk):
     def __save_result_text__(self):
         self.result_img.save(path.join(self.PATH_BLOCKS, self.result_name.get() + '.png'))
 
+    def __generate_variants__(self):
+        from derived_textures import generate_variants, load_variants, generate_tints, load_tints
+
+        try:
+            variants = generate_variants(load_variants(), self.PATH_BLOCKS, self.PATH_MASKS)
+            tints = generate_tints(load_tints(), output_dir=self.PATH_BLOCKS)
+        except Exception as e:
+            showerror('Derived Textures', f'Textures cannot be generated: {e}')
+            return
+        # new textures are not in the index
+        if self.exporter is not None:
+            self.exporter.assets = self.exporter.load_assets()
+
+        message = ''
+        for kind, report in (('Variants', variants), ('Tinted textures', tints)):
+            message += f'{kind}: {len(report["written"])} written, {len(report["up_to_date"])} up to date\n'
+            if report['missing_source']:
+                message += f'Missing sources: {", ".join(report["missing_source"])}\n'
+        showinfo('Derived Textures', message)
+
+    def __load_preview__(self):
+        from structure_formats import load_structure
+        from export import ExportSettings
+        from preview import LayerPreview
+
+        filepath = self.path_struct.get()
+        if not path.exists(filepath):
+            self._grow_file_()
+            showerror('Incorrect File', 'File is incorrect, must be a valid path')
+            return
+
+        try:
+            structure = load_structure(filepath)
+        except Exception as e:
+            showerror('Incorrect File', f'{path.basename(filepath)} cannot be read: {e}')
+            return
+
+        self.preview = LayerPreview(structure, ExportSettings(use_cache=self.use_cache.get()))
+        self.preview_axis.set(self.layout_dir.get())
+        self.__change_preview_axis__()
+
+    def __change_preview_axis__(self, event=None):
+        if self.preview is None:
+            return
+
+        # cached images are keyed by (axis, layer) of the loaded structure
+        self.preview_canvas.clear_cache()
+        self.preview_slider.configure(to=self.preview.get_layer_count(self.preview_axis.get()))
+        self.preview_layer.set(1)
+        self.__show_preview_layer__()
+
+    def __show_preview_layer__(self, value=None):
+        if self.preview is None:
+            return
+
+        preview = self.preview
+        axis = self.preview_axis.get()
+        i_layer = self.preview_layer.get() - 1
+        self.preview_text.set(f'Layer {i_layer + 1} / {preview.get_layer_count(axis)}')
+        self.preview_canvas.set_image(lambda size: preview.render(axis, i_layer, size), key=(axis, i_layer))
+
 # endregion settings function
 
 #TEST @Mathias - sort function in regions
@@ -374,184 +592,43 @@ class App(Tk):
     def _get_debug_texture_path_(self):
         return path.join(self.PATH_BLOCKS, 'debug.png')
 
-    def _get_axis_order_(self):
-        layout_dir = self.layout_dir.get()
-
-        if layout_dir == 'x':
-            return 0, 2, 1
-        elif layout_dir == 'y':
-            return 1, 2, 0
-        return 2, 0, 1
-
-    def _get_preslice_(self, size, blocks):
-        # get direction
-        direction_x, direction_y, direction_z = self._get_axis_order_()
-
-        # create layout
-        nbt_layer = [[[0 for ___ in range(size[direction_z])] for __ in range(size[direction_y])] for _ in range(size[direction_x])]
-
-        # position blocks
-        for block in blocks:
-            position = block['pos']
-            state = block['state']
-
-            nbt_layer[position[direction_x]][position[direction_y]][position[direction_z]] = state
-
-        return nbt_layer
-
-    def get_block_texture(self, block_data):
-        name = minecraft_clean_base(block_data['Name'])
-        filename = name
-        properties = None
-        keys = None
-
-        if 'Properties' in block_data.keys():
-            properties = block_data['Properties']
-            keys = list(properties.keys())
-            keys.sort()
-
-            for k in keys:
-                filename += f'.{k}_{properties[k]}'
-
-        filename += '.png'
-
-        if filename in self.textures.keys():
-            return self.textures[filename]
-
-        block_path = path.join(self.PATH_BLOCKS, name + '.png')
-        if not path.exists(block_path):
-            self._add_missing_texture_('block: ' + name + '.png')
-            block_path = self._get_debug_texture_path_()
-
-        img = Image.open(block_path).convert('RGBA')
-        if properties is not None:
-            if 'waterlogged' in keys:
-                if properties['waterlogged']:
-                    img_2 = Image.open(path.join(self.PATH_PROPERTIES, 'waterlogged.png')).convert('RGBA')
-                    img_2.paste(img, (0, 0), mask=img)
-                keys.remove('waterlogged')
-
-            # for bed
-            if 'part' in keys:
-                if properties['part'] == 'head':
-                    img = img.crop((0, 0, 16, 16))
-                else:
-                    img = img.crop((0, 16, 16, 32))
-                keys.remove('part')
-
-            # for door
-            if 'half' in keys and 'door' in name:
-                if properties['half'] == 'upper':
-                    img = img.crop((0, 0, 16, 16))
-                else:
-                    img = img.crop((0, 16, 16, 32))
-                keys.remove('half')
-
-            for k in keys:
-                img_path = path.join(self.PATH_PROPERTIES, k + "_" + properties[k] + ".png")
-                if path.exists(img_path):
-                    addon = Image.open(img_path).convert('RGBA')
-                    img.paste(addon, (0, 0), mask=addon)
-                else:
-                    self._add_missing_texture_('property: ' + k + "_" + properties[k] + '.png' + ' - block: ' + name)
-
-        self.textures[filename] = img
-        return img
-
-    def _add_missing_texture_(self, missing):
-        if missing not in self.missing_textures:
-            self.missing_textures.append(missing)
-
-    def get_textures(self, palette, size):
-        self.current_textures = []
-        self.base_current_textures = []
-
-        dimension = (size, size)
-        for block_data in palette:
-            img = self.get_block_texture(block_data)
-            self.current_textures.append(img.resize(dimension, resample=Image.NEAREST))
-
-            img_base = self.get_block_texture({'Name': block_data['Name']})
-            self.base_current_textures.append(img_base.resize(dimension))
-
-    def retrieve_data(self, filepath):
-        """
-        blocks separate by layer
-        offset top bottom right left
-        legend by layer
-        """
-        data = {
-            'size': (),
-            'layout': [],
-            'legend': [],
-            'count': {},
-            'right': 0,
-            'left': 0,
-            'top': 0,
-            'bottom': 0
-        }
-
-        size, blocks, palette = get_nbt_data(filepath)
-
-        scale = self.block_res.get()
-        self.get_textures(palette, scale)
-
-        data['layout'] = self._get_preslice_(size, blocks)
-        grid_size = self.grid_thick.get()
-
-        legend_position = self.legend_pos.get()
-        legend_offset = []
-
-        length_x = len(data['layout'])
-        length_y = len(data['layout'][0])
-        length_z = len(data['layout'][0][0])
-        data['size'] = (length_x, length_y, length_z)
-        for x in range(length_x):
-            data['legend'].append({})
-            legend_offset.append([])
-            for y in range(length_y):
-                for z in range(length_z):
-                    state = data['layout'][x][y][z]
-
-                    name = minecraft_clean_base(palette[state]["Name"])
-                    if name != 'air':
-                        data['legend'][-1][name] = self.base_current_textures[state]
-
-                        if name not in data['count'].keys():
-                            data['count'][name] = 1
-                        else:
-                            data['count'][name] += 1
-
-                        if name not in legend_offset[-1]:
-                            legend_offset[-1].append(name)
-                    else:
-                        self.air_state = state
-
-        offset = self.offset_space.get()
-        data['right'] = offset
-        data['left'] = offset
-        data['top'] = offset
-        data['bottom'] = offset
-
-        legend_size = 0
-        if legend_position in ['top', 'bottom']:
-            for legend_layer in legend_offset:
-                legend_size = max(legend_size, len(legend_layer))
-            legend_size = scale * 2 + scale * legend_size + grid_size * legend_size
-        else:
-            for legend_layer in legend_offset:
-                for name in legend_layer:
-                    legend_size = max(legend_size, (scale // 3) * len(name))
-            legend_size += scale * 2
-
-        data[legend_position] = max(offset, legend_size)
-
-        return data
+    def _get_exporter_(self):
+        from export import Exporter
+
+        if self.exporter is None:
+            self.exporter = Exporter(progress=self._post_progress_)
+        return self.exporter
+
+    def _get_export_settings_(self):
+        from export import ExportSettings
+
+        return ExportSettings(
+            layout_dir=self.layout_dir.get(),
+            block_size=self.block_res.get(),
+            grid_size=self.grid_thick.get(),
+            offset=self.offset_space.get(),
+            legend_position=self.legend_pos.get(),
+            workers=self.render_workers.get(),
+            create_dir=self.create_dir.get(),
+            create_data=self.create_data.get(),
+            create_missing=self.create_missing.get(),
+            create_profile=self.create_profile.get(),
+            incremental=self.incremental.get(),
+            duplicate_mode=self.duplicate_mode.get(),
+            container='' if self.container.get() == 'images' else self.container.get(),
+            use_cache=self.use_cache.get(),
+            tile_size=self.tile_size.get(),
+            image_format=self.image_format.get(),
+            indexed=self.indexed.get(),
+            compress_level=self.compress_level.get(),
+            compress_strategy=self.compress_strategy.get(),
+            encode_threads=self.encode_threads.get(),
+            materials_only=self.materials_only.get(),
+            count_contents=self.count_contents.get()
+        )
 
     def schematize(self):
         self.set_progress(0)
-        self.missing_textures = []
-        self.air_state = -1
 
         # check valid filepath
         filepath = self.path_struct.get()
@@ -560,127 +637,136 @@ class App(Tk):
             showerror('Incorrect File', 'File is incorrect, must be a valid path')
             return
 
-        data = self.retrieve_data(filepath)
-        scale = self.block_res.get()
-        size = data['size']
-        grid_size = self.grid_thick.get()
-
-        self.set_progress(10)
-
-        font_path = self.PATH_FONTS
-        font = ImageFont.truetype(resource_path(font_path), scale // 2)
-        legend_position = self.legend_pos.get()
+        if path.isdir(filepath) and not self.materials_only.get():
+            self._grow_file_()
+            showerror('Incorrect File', 'Only the materials list can be made for a folder')
+            return
 
-        # calculate image dimension
-        dimension = (
-            data['right'] + data['left'] + size[1] * scale + grid_size * (size[1] + 1),
-            data['top'] + data['bottom'] + size[2] * scale + grid_size * (size[2] + 1)
-        )
+        # deep zoom layers are folders of tiles
+        if not self.materials_only.get() and self.container.get() != 'images' and self.tile_size.get():
+            self._grow_file_()
+            showerror('Incorrect Output', 'Tiled layers cannot be written in a single file')
+            return
 
-        # determine main directory
-        basename = self.export_name.get()
-        directory_path = path.dirname(filepath)
-        if self.create_dir.get():
-            directory_path = path.join(directory_path, basename)
-            if not path.exists(directory_path):
-                makedirs(directory_path)
-
-        self.set_progress(15)
-
-        # create grid template
-        grid_dimension = (dimension[0] - data['right'] - data['left'], dimension[1] - data['top'] - data['bottom'])
-        grid_img = Image.new('RGBA', grid_dimension, (0, 0, 0, 0))
-        grid_load = grid_img.load()
-        for x in range(0, grid_dimension[0] + 1, scale + grid_size):  # draw x line
-            draw_square(grid_load, x, 0, x + grid_size, grid_dimension[1], (0, 0, 0, 255))
-        for y in range(0, grid_dimension[1] + 1, scale + grid_size):  # draw y line
-            draw_square(grid_load, 0, y, grid_dimension[0], y + grid_size, (0, 0, 0, 255))
-
-        self.set_progress(20)
-        advance = size[0] // (99 - 20)
-
-        # draw
-        previous_texture = Image.open(path.join(self.PATH_PROPERTIES, 'previous_block.png')
-                                      ).resize((self.block_res.get(), self.block_res.get()), resample=Image.NEAREST)
-        previous_layer = None
-        for i_layer, layer in enumerate(data['layout']):
-            layer_img_path = path.join(directory_path, basename + f'_layer_{i_layer + 1}.png')
-            layer_img = Image.new('RGBA', dimension, (127, 127, 127, 255))
-            layer_draw = ImageDraw.Draw(layer_img)
-
-            # draw grid
-            layer_img.paste(grid_img, (data['left'], data['top']), mask=grid_img)
-
-            # draw block
-            legend = {}
-            for i in range(size[1]):
-                x = data['left'] + grid_size + (scale + grid_size) * i
-                for j in range(size[2]):
-                    y = dimension[1] - data['bottom'] - (grid_size + scale) - (scale + grid_size) * j
-
-                    texture = self.current_textures[layer[i][j]]
-                    layer_img.paste(texture, (x, y), mask=texture)
-
-                    if previous_layer and previous_layer[i][j] != self.air_state:
-                        layer_img.paste(previous_texture, (x, y), mask=previous_texture)
-            previous_layer = layer
-
-            # draw legend
-            if legend_position in ['right', 'left']:
-                x = scale // 2
-                y = data['top']
-                if legend_position == 'right':
-                    x += dimension[0] - data['right']
-
-                space = int(scale * 1.5)
-                for name, texture in data['legend'][i_layer].items():
-                    layer_img.paste(texture, (x, y), mask=texture)
-                    layer_draw.text((x + space, y), name, font=font)
-                    y += scale + grid_size
-            else:
-                sign = 1
-
-                x = data['left']
-                if legend_position == 'bottom':
-                    y = data['top'] + grid_dimension[1] + (scale // 2)
-                else:
-                    y = data['top'] - scale - (scale // 2)
-                    sign = -1
-
-                space = int(scale * 1.5)
-                for name, texture in data['legend'][i_layer].items():
-                    layer_img.paste(texture, (x, y), mask=texture)
-                    layer_draw.text((x + space, y), name, font=font)
-                    y += ((scale + grid_size) * sign)
-
-            layer_img.save(layer_img_path)
-            self.set_progress(self.export_progress.get() + advance)
-        self.set_progress(99)
-
-        if self.create_data.get():
-            with open(path.join(directory_path, basename + '_data.csv'), 'w') as file:
-                file.write('Block; Number; Stack x64; Stack x16')
-                for k, v in data['count'].items():
-                    file.write(f"\n{k};{v};{str(v // 64) + ' stack and ' + str(v % 64)};{str(v // 16) + ' stack and ' + str(v % 16)}")
-
-        self.set_progress(100)
-        showinfo('Finish', 'This File has finished to proceed !')
-        if len(self.missing_textures) > 0:
-            text = ''
-            self.missing_textures.sort()
-            for i in self.missing_textures:
-                text += f'{i}\n'
-            showwarning('Missing textures', 'Those textures are missing and cannot be drawn:\n\n' + text)
-
-            if self.create_missing.get():
-                with open(path.join(directory_path, basename + '_missing.txt'), 'w') as file:
-                    file.write(text)
+        # settings are read now, they can be changed for the next queued file
+        self.export_jobs.put((filepath, self.export_name.get(), self._get_export_settings_()))
+        if self.export_thread is None:
+            self._start_export_thread_()
+        else:
+            self._show_status_()
+
+    def cancel_export(self):
+        # queued files are dropped, the running export stops after the layers being drawn
+        while True:
+            try:
+                self.export_jobs.get_nowait()
+            except Empty:
+                break
+
+        if self.export_thread is not None:
+            self.export_cancelled = True
+            self.exporter.cancel()
+            self.export_status.set('Cancelling...')
+
+    def _start_export_thread_(self):
+        self.exported_files = []
+        self.export_cancelled = False
+        # created here, the export thread only uses it
+        self._get_exporter_()
+        self.export_thread = Thread(target=self._run_exports_, daemon=True)
+        self.export_thread.start()
+        self.after(self.POLL_DELAY, self._poll_export_)
+
+    def _run_exports_(self):
+        from export import ExportCancelled
+
+        # background thread, Tk must not be used here
+        while True:
+            try:
+                filepath, basename, settings = self.export_jobs.get_nowait()
+            except Empty:
+                break
+
+            self.export_messages.put(('start', filepath))
+            try:
+                self.exporter.settings = settings
+                self.export_messages.put(('done', filepath, self.exporter.export(filepath, basename)))
+            except ExportCancelled:
+                self.export_messages.put(('cancelled', filepath))
+            except Exception as e:
+                self.export_messages.put(('error', filepath, e))
+        self.export_messages.put(('idle',))
+
+    def _post_progress_(self, value):
+        # called by the exporter, in the background thread
+        self.export_messages.put(('progress', value, self.exporter.layers_done))
+
+    def _poll_export_(self):
+        while True:
+            try:
+                message = self.export_messages.get_nowait()
+            except Empty:
+                break
+
+            kind = message[0]
+            if kind == 'start':
+                self.export_file = message[1]
+                self.export_start = perf_counter()
+                self.set_progress(0)
+                self._show_status_()
+            elif kind == 'progress':
+                self.set_progress(message[1])
+                if not self.export_cancelled:
+                    self._show_status_(message[2])
+            elif kind == 'done':
+                result = message[2]
+                self.exported_files.append(self.export_file)
+                self.profile_text.set(result['profiler'].summary())
+                if len(result['missing']) > 0:
+                    text = ''
+                    for i in result['missing']:
+                        text += f'{i}\n'
+                    showwarning('Missing textures', f'{path.basename(message[1])}: those textures are missing '
+                                                    'and cannot be drawn:\n\n' + text)
+                if result.get('errors'):
+                    text = ''
+                    for name, error in result['errors'].items():
+                        text += f'{name}: {error}\n'
+                    showwarning('Unreadable structures', f'{path.basename(message[1])}: those structures are not '
+                                                         'counted:\n\n' + text)
+            elif kind == 'cancelled':
+                showinfo('Cancelled', f'{path.basename(message[1])}: export cancelled, saved layers are kept')
+            elif kind == 'error':
+                showerror('Export Failed', f'{path.basename(message[1])}: {message[2]}')
+            elif kind == 'idle':
+                self.export_thread = None
+                # a file queued while the thread was stopping
+                if not self.export_jobs.empty():
+                    self._start_export_thread_()
+                    return
+
+                self.export_status.set('')
+                if self.exported_files:
+                    showinfo('Finish', 'This File has finished to proceed !' if len(self.exported_files) == 1 else
+                             f'{len(self.exported_files)} files have finished to proceed !')
+                return
+
+        self.after(self.POLL_DELAY, self._poll_export_)
+
+    def _show_status_(self, layers_done=0):
+        status = path.basename(self.export_file)
+        if layers_done:
+            status += f' - {layers_done} layers, {layers_done / max(perf_counter() - self.export_start, 1e-3):.1f} layers/s'
+        queued = self.export_jobs.qsize()
+        if queued:
+            status += f' - {queued} queued'
+        self.export_status.set(status)
 
     def set_progress(self, value):
         self.export_progress.set(value)
-        self.update()
 
 
 if __name__ == "__main__":
+    freeze_support()
     app = App()
     app.mainloop()
@@ -0,0 +1,134 @@
+# -------------------------------------------------------------------------------
+# Name:        manifest
+# Purpose:     remember what an export produced so the next one only redraws changes
+# -------------------------------------------------------------------------------
+
+import hashlib
+import json
+import shutil
+from os import path, remove
+
+import numpy as np
+
+
+class ExportManifest:
+    """
+    JSON file saved next to the outputs of an export, with a content hash for each layer and for the data file
+    Layers identical to an earlier one are listed in 'duplicates' with the index of that layer.
+    """
+    VERSION = 1
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.previous = {}
+        self.layers = []
+        self.duplicates = {}
+        self.data = None
+
+        if path.exists(filepath):
+            try:
+                with open(filepath, 'r') as file:
+                    previous = json.load(file)
+                if previous.get('version') == self.VERSION:
+                    self.previous = previous
+            except (OSError, ValueError):
+                pass  # rebuilt from scratch
+
+    @staticmethod
+    def hash_settings(settings: dict) -> str:
+        """
+        Hash everything that changes the drawing of every layer
+        Args:
+            settings (): json serializable render settings
+
+        Returns:
+            hex digest
+        """
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def hash_layer(settings_hash: str, layer: np.ndarray, previous_layer: np.ndarray | None,
+                   air_state: int, palette: list[dict[str: dict | str]]) -> str:
+        """
+        Hash everything that changes the image of a layer
+        Args:
+            settings_hash (): result of hash_settings
+            layer (): 2D array of palette indices
+            previous_layer (): 2D array of the layer before, None for the first one
+            air_state (): palette index of air
+            palette (): palette of the structure
+
+        Returns:
+            hex digest
+        """
+        layer = np.ascontiguousarray(layer, dtype=np.uint32)
+
+        digest = hashlib.sha1(settings_hash.encode('utf-8'))
+        digest.update(repr(layer.shape).encode('utf-8'))
+        digest.update(layer.tobytes())
+
+        # indices only mean something with their palette entry
+        for state in np.unique(layer).tolist():
+            # the state past the palette fills structures without air
+            block_data = palette[state] if state < len(palette) else None
+            digest.update(json.dumps(block_data, sort_keys=True).encode('utf-8'))
+
+        if previous_layer is not None:
+            digest.update(np.packbits(np.asarray(previous_layer) != air_state).tobytes())
+
+        return digest.hexdigest()
+
+    def is_unchanged(self, i_layer: int, layer_hash: str, layer_path: str) -> bool:
+        """
+        Check if a layer image from the previous export can be kept
+        Args:
+            i_layer (): index of the layer
+            layer_hash (): result of hash_layer
+            layer_path (): path of the layer image
+
+        Returns:
+            True if the image exists and was made from the same content
+        """
+        layers = self.previous.get('layers', [])
+        return i_layer < len(layers) and layers[i_layer] == layer_hash and path.exists(layer_path)
+
+    def is_data_unchanged(self, data_hash: str, data_path: str) -> bool:
+        return self.previous.get('data') == data_hash and path.exists(data_path)
+
+    def remove_extra_layers(self, get_layer_path):
+        """
+        Delete images (or deep zoom tiles) of layers that existed in the previous export only
+        Args:
+            get_layer_path (): function giving the image path of a layer index
+        """
+        for i_layer in range(len(self.layers), len(self.previous.get('layers', []))):
+            layer_path = get_layer_path(i_layer)
+            if path.exists(layer_path):
+                remove(layer_path)
+
+            tiles_directory = path.splitext(layer_path)[0] + '_files'
+            if path.isdir(tiles_directory):
+                shutil.rmtree(tiles_directory)
+
+    def save_pending(self, layers):
+        """
+        Save the previous manifest with some layers marked as not drawn, before their images are replaced
+        An interrupted export then redraws them instead of trusting the old hashes.
+        Args:
+            layers (): indices of the layers about to be written
+        """
+        previous_layers = list(self.previous.get('layers', []))
+        if not any(i_layer < len(previous_layers) for i_layer in layers):
+            return
+
+        for i_layer in layers:
+            if i_layer < len(previous_layers):
+                previous_layers[i_layer] = None
+        with open(self.filepath, 'w') as file:
+            json.dump({'version': self.VERSION, 'layers': previous_layers, 'data': self.previous.get('data'),
+                       'duplicates': self.previous.get('duplicates', {})}, file, indent=1)
+
+    def save(self):
+        with open(self.filepath, 'w') as file:
+            json.dump({'version': self.VERSION, 'layers': self.layers, 'data': self.data,
+                       'duplicates': {str(k): v for k, v in self.duplicates.items()}}, file, indent=1)
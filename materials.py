@@ -0,0 +1,222 @@
+# -------------------------------------------------------------------------------
+# Name:        materials
+# Purpose:     bill of materials of structure files, counted from palette indices without any texture
+# -------------------------------------------------------------------------------
+
+import json
+from collections import Counter
+from os import path, walk
+
+import numpy as np
+
+from structure_formats import AIR_BLOCKS, STRUCTURE_EXTENSIONS, load_structure, minecraft_clean_base
+from profiler import Profiler
+
+
+def count_blocks(structure: dict) -> Counter:
+    """
+    Count the placed blocks of a structure, air excluded
+    Args:
+        structure (): dict given by structure_formats.load_structure
+
+    Returns:
+        number of each block name
+    """
+    palette = structure['palette']
+    states = structure['indices'] if 'indices' in structure else structure['states']
+    counts = np.bincount(np.ravel(states), minlength=len(palette))
+
+    blocks = Counter()
+    for state in np.flatnonzero(counts).tolist():
+        name = minecraft_clean_base(palette[state]['Name'])
+        if name not in AIR_BLOCKS:
+            blocks[name] += int(counts[state])
+    return blocks
+
+
+def count_contents(block_entities: list) -> Counter:
+    """
+    Count the items stored in block entities (chests, barrels, shulker boxes...), with the content of stored
+    shulker boxes and bundles
+    Args:
+        block_entities (): 'block_entities' of a structure, (block index, compound) tuples or compounds
+
+    Returns:
+        number of each item name
+    """
+    items = Counter()
+    for block_entity in block_entities:
+        if isinstance(block_entity, tuple):
+            block_entity = block_entity[1]
+        # Sponge schematics 3 keep the block entity content in Data
+        if isinstance(block_entity.get('Data'), dict):
+            block_entity = block_entity['Data']
+
+        for item in block_entity.get('Items', []):
+            _add_item_(items, item, 1)
+    return items
+
+
+def _add_item_(items: Counter, item: dict, multiplier: int):
+    if 'id' not in item:
+        return
+    number = int(item.get('count', item.get('Count', 1))) * multiplier
+    items[minecraft_clean_base(item['id'])] += number
+
+    # before 1.20.5, content is in the item tag
+    tag = item.get('tag', {})
+    nested = list(tag.get('BlockEntityTag', {}).get('Items', [])) + list(tag.get('Items', []))
+    components = item.get('components', {})
+    nested += [entry['item'] for entry in components.get('minecraft:container', []) if 'item' in entry]
+    nested += list(components.get('minecraft:bundle_contents', []))
+
+    for nested_item in nested:
+        _add_item_(items, nested_item, number)
+
+
+def find_structures(directory: str) -> list[str]:
+    """
+    List the structure files of a folder and its sub folders
+    Args:
+        directory (): folder to search
+
+    Returns:
+        sorted file paths
+    """
+    filepaths = []
+    for root, _, filenames in walk(directory):
+        filepaths += [path.join(root, filename) for filename in filenames
+                      if path.splitext(filename)[1].lower() in STRUCTURE_EXTENSIONS]
+    return sorted(filepaths)
+
+
+def get_bill_of_materials(filepaths: list[str], root: str = None, contents: bool = False,
+                          profiler: Profiler = None, progress=None, cancel=None) -> dict:
+    """
+    Count the materials of structure files, unreadable files are reported instead of stopping the batch
+    Args:
+        filepaths (): paths of the structure files
+        root (): folder the structures are named relative to, only their file name if None
+        contents (): count the items stored in block entities too
+        profiler (): gets the parse and count stages
+        progress (): called with the number of files done
+        cancel (): multiprocessing Event, the files left are skipped once set
+
+    Returns:
+        dict with
+            'structures': {name: {'blocks': Counter, 'contents': Counter}}, in the order of filepaths
+            'errors': {name: error message}
+            'contents': whether contents were counted
+    """
+    if profiler is None:
+        profiler = Profiler()
+
+    bom = {'structures': {}, 'errors': {}, 'contents': contents}
+    for i_file, filepath in enumerate(filepaths):
+        if cancel is not None and cancel.is_set():
+            break
+
+        name = path.relpath(filepath, root) if root is not None else path.basename(filepath)
+        try:
+            with profiler.stage('parse'):
+                structure = load_structure(filepath, block_entities=contents)
+            with profiler.stage('count'):
+                bom['structures'][name] = {
+                    'blocks': count_blocks(structure),
+                    'contents': count_contents(structure.get('block_entities', [])) if contents else Counter()
+                }
+        except Exception as e:
+            bom['errors'][name] = str(e) or type(e).__name__
+
+        if progress is not None:
+            progress(i_file + 1)
+    return bom
+
+
+def get_totals(bom: dict) -> tuple[Counter, Counter]:
+    """
+    Add up the materials of every structure
+    Args:
+        bom (): result of get_bill_of_materials
+
+    Returns:
+        number of each placed block
+        number of each stored item
+    """
+    blocks = Counter()
+    contents = Counter()
+    for counts in bom['structures'].values():
+        blocks.update(counts['blocks'])
+        contents.update(counts['contents'])
+    return blocks, contents
+
+
+def get_materials_text(bom: dict) -> str:
+    """
+    Build the aggregated CSV, like the data file of an export with a column by structure instead of by layer
+    Materials are sorted from the most used.
+    Args:
+        bom (): result of get_bill_of_materials
+
+    Returns:
+        CSV text
+    """
+    blocks, contents = get_totals(bom)
+    total = blocks + contents
+    structures = bom['structures']
+
+    text = 'Block; Number; Stack x64; Stack x16'
+    if bom['contents']:
+        text += '; Placed; In containers'
+    for name in structures:
+        text += f'; {name}'
+
+    for k, v in sorted(total.items(), key=lambda item: (-item[1], item[0])):
+        text += f"\n{k};{v};{str(v // 64) + ' stack and ' + str(v % 64)};{str(v // 16) + ' stack and ' + str(v % 16)}"
+        if bom['contents']:
+            text += f';{blocks[k]};{contents[k]}'
+        for counts in structures.values():
+            text += f";{counts['blocks'][k] + counts['contents'][k]}"
+    return text
+
+
+def get_materials_json(bom: dict) -> dict:
+    """
+    Build the aggregated JSON report
+    Args:
+        bom (): result of get_bill_of_materials
+
+    Returns:
+        dict with the totals, the materials of each structure and the unreadable files
+    """
+    blocks, contents = get_totals(bom)
+    report = {'total': {'blocks': dict(blocks.most_common())},
+              'structures': {name: {'blocks': dict(counts['blocks'].most_common())}
+                             for name, counts in bom['structures'].items()},
+              'errors': bom['errors']}
+    if bom['contents']:
+        report['total']['contents'] = dict(contents.most_common())
+        for name, counts in bom['structures'].items():
+            report['structures'][name]['contents'] = dict(counts['contents'].most_common())
+    return report
+
+
+def write_bill_of_materials(bom: dict, directory: str, basename: str) -> list[str]:
+    """
+    Save the aggregated CSV and JSON report
+    Args:
+        bom (): result of get_bill_of_materials
+        directory (): folder of the files
+        basename (): prefix of the files
+
+    Returns:
+        paths of the CSV and JSON files
+    """
+    csv_path = path.join(directory, basename + '_materials.csv')
+    json_path = path.join(directory, basename + '_materials.json')
+
+    with open(csv_path, 'w') as file:
+        file.write(get_materials_text(bom))
+    with open(json_path, 'w') as file:
+        json.dump(get_materials_json(bom), file, indent=1)
+    return [csv_path, json_path]
@@ -0,0 +1,257 @@
+# -------------------------------------------------------------------------------
+# Name:        nbt_reader
+# Purpose:     read minecraft NBT files directly from the (gzip) stream
+# -------------------------------------------------------------------------------
+
+import gzip
+import struct
+from io import BufferedReader
+
+import numpy as np
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+NUMBER_STRUCTS = {
+    TAG_BYTE: struct.Struct('>b'),
+    TAG_SHORT: struct.Struct('>h'),
+    TAG_INT: struct.Struct('>i'),
+    TAG_LONG: struct.Struct('>q'),
+    TAG_FLOAT: struct.Struct('>f'),
+    TAG_DOUBLE: struct.Struct('>d'),
+}
+ARRAY_TYPES = {
+    TAG_BYTE_ARRAY: np.dtype('>i1'),
+    TAG_INT_ARRAY: np.dtype('>i4'),
+    TAG_LONG_ARRAY: np.dtype('>i8'),
+}
+
+_USHORT = struct.Struct('>H')
+_INT = struct.Struct('>i')
+_POS_HEADER = bytes((TAG_INT,)) + _INT.pack(3)
+
+
+def open_nbt(filepath: str):
+    """
+    Open a NBT file, gzip compressed or not
+    Args:
+        filepath (): relative or absolut path to the file
+
+    Returns:
+        buffered binary stream of the uncompressed payload
+    """
+    with open(filepath, 'rb') as file:
+        magic = file.read(2)
+
+    if magic == b'\x1f\x8b':
+        # buffered again so small reads stay in C
+        return BufferedReader(gzip.open(filepath, 'rb'), buffer_size=1 << 16)
+    return open(filepath, 'rb')
+
+
+class NBTReader:
+    """
+    Decode NBT tags from a binary stream, compounds become dict, lists become list and arrays become numpy arrays
+    """
+
+    def __init__(self, stream):
+        self.read = stream.read
+
+    def read_exact(self, length: int) -> bytes:
+        data = self.read(length)
+        if len(data) != length:
+            raise ValueError('Unexpected end of NBT data')
+        return data
+
+    def read_name(self) -> bytes:
+        return self.read_exact(_USHORT.unpack(self.read_exact(2))[0])
+
+    def read_string(self) -> str:
+        return self.read_name().decode('utf-8', errors='replace')
+
+    def read_list_header(self) -> tuple[int, int]:
+        header = self.read_exact(5)
+        return header[0], _INT.unpack_from(header, 1)[0]
+
+    def read_root(self) -> tuple[str, dict]:
+        """
+        Read the root compound
+        Returns:
+            name of the root tag
+            content
+        """
+        tag = self.read_exact(1)[0]
+        if tag != TAG_COMPOUND:
+            raise ValueError('NBT root must be a compound')
+        return self.read_string(), self.read_payload(TAG_COMPOUND)
+
+    def iter_compound(self):
+        """
+        Iterate over the tags of a compound, each payload must be read or skipped before the next step
+        Returns:
+            generator of (tag type, name)
+        """
+        while True:
+            tag = self.read_exact(1)[0]
+            if tag == TAG_END:
+                return
+            yield tag, self.read_string()
+
+    def read_payload(self, tag: int):
+        if tag in NUMBER_STRUCTS:
+            number = NUMBER_STRUCTS[tag]
+            return number.unpack(self.read_exact(number.size))[0]
+        elif tag == TAG_STRING:
+            return self.read_string()
+        elif tag in ARRAY_TYPES:
+            dtype = ARRAY_TYPES[tag]
+            length = _INT.unpack(self.read_exact(4))[0]
+            return np.frombuffer(self.read_exact(length * dtype.itemsize), dtype=dtype).astype(dtype.newbyteorder('='))
+        elif tag == TAG_LIST:
+            item_tag, length = self.read_list_header()
+            if item_tag in NUMBER_STRUCTS:
+                number = NUMBER_STRUCTS[item_tag]
+                return [value for value, in number.iter_unpack(self.read_exact(length * number.size))]
+            return [self.read_payload(item_tag) for _ in range(length)]
+        elif tag == TAG_COMPOUND:
+            return {name: self.read_payload(item_tag) for item_tag, name in self.iter_compound()}
+
+        raise ValueError(f'Unknown NBT tag {tag}')
+
+    def skip_payload(self, tag: int):
+        if tag in NUMBER_STRUCTS:
+            self.read_exact(NUMBER_STRUCTS[tag].size)
+        elif tag == TAG_STRING:
+            self.read_name()
+        elif tag in ARRAY_TYPES:
+            length = _INT.unpack(self.read_exact(4))[0]
+            self.read_exact(length * ARRAY_TYPES[tag].itemsize)
+        elif tag == TAG_LIST:
+            item_tag, length = self.read_list_header()
+            if item_tag in NUMBER_STRUCTS:
+                self.read_exact(length * NUMBER_STRUCTS[item_tag].size)
+            else:
+                for _ in range(length):
+                    self.skip_payload(item_tag)
+        elif tag == TAG_COMPOUND:
+            for item_tag, _ in self.iter_compound():
+                self.skip_payload(item_tag)
+        else:
+            raise ValueError(f'Unknown NBT tag {tag}')
+
+    def read_blocks(self, block_entities: bool = False) -> tuple[np.ndarray, np.ndarray, list[tuple[int, dict]]]:
+        """
+        Read the 'blocks' list of a structure file without building a dict per block
+        Args:
+            block_entities (): keep the 'nbt' compound of blocks, skipped otherwise
+
+        Returns:
+            (n, 3) int32 array of positions
+            (n,) int32 array of states
+            list of (block index, nbt compound)
+        """
+        item_tag, length = self.read_list_header()
+        if length > 0 and item_tag != TAG_COMPOUND:
+            raise ValueError('Structure blocks must be compounds')
+
+        # raw big endian bytes, converted once at the end
+        positions = bytearray()
+        states = bytearray()
+        entities = []
+
+        read = self.read_exact
+        for index in range(length):
+            while True:
+                tag = read(1)[0]
+                if tag == TAG_END:
+                    break
+
+                name = self.read_name()
+                if name == b'pos' and tag == TAG_LIST:
+                    header = read(5)
+                    if header == _POS_HEADER:
+                        positions += read(12)
+                    else:
+                        item_tag, count = header[0], _INT.unpack_from(header, 1)[0]
+                        positions += struct.pack('>3i', *[self.read_payload(item_tag) for _ in range(count)])
+                elif name == b'state' and tag == TAG_INT:
+                    states += read(4)
+                elif name == b'nbt' and block_entities:
+                    entities.append((index, self.read_payload(tag)))
+                else:
+                    self.skip_payload(tag)
+
+            if len(positions) != 12 * (index + 1) or len(states) != 4 * (index + 1):
+                raise ValueError(f'Structure block {index} has no valid pos or state')
+
+        positions = np.frombuffer(positions, dtype='>i4').astype(np.int32).reshape(length, 3)
+        states = np.frombuffer(states, dtype='>i4').astype(np.int32)
+        return positions, states, entities
+
+
+def read_nbt(filepath: str) -> dict:
+    """
+    Read a whole NBT file
+    Args:
+        filepath (): relative or absolut path to the file
+
+    Returns:
+        content of the root compound
+    """
+    with open_nbt(filepath) as stream:
+        return NBTReader(stream).read_root()[1]
+
+
+def read_structure(filepath: str, entities: bool = False, block_entities: bool = False) -> dict:
+    """
+    Read a vanilla structure file (.nbt)
+    Args:
+        filepath (): relative or absolut path to the .nbt file
+        entities (): read the 'entities' list, skipped otherwise
+        block_entities (): read the 'nbt' compound of blocks, skipped otherwise
+
+    Returns:
+        dict with
+            'size': size of the structure (x, y, z)
+            'positions': (n, 3) int32 array of block positions
+            'states': (n,) int32 array of palette indices
+            'palette': list of {'Name': str, 'Properties': dict}
+            'block_entities': list of (block index, nbt compound)
+            'entities': list of entity compounds
+    """
+    structure = {'positions': np.zeros((0, 3), dtype=np.int32), 'states': np.zeros(0, dtype=np.int32),
+                 'block_entities': [], 'entities': []}
+
+    with open_nbt(filepath) as stream:
+        reader = NBTReader(stream)
+        if reader.read_exact(1)[0] != TAG_COMPOUND:
+            raise ValueError('NBT root must be a compound')
+        reader.read_name()
+
+        for tag, name in reader.iter_compound():
+            if name == 'blocks' and tag == TAG_LIST:
+                structure['positions'], structure['states'], structure['block_entities'] = reader.read_blocks(block_entities)
+            elif name == 'entities' and not entities:
+                reader.skip_payload(tag)
+            else:
+                structure[name] = reader.read_payload(tag)
+
+    if 'palette' not in structure and 'palettes' in structure:
+        # structures with several palettes (shipwrecks...) share the blocks list
+        structure['palette'] = structure['palettes'][0]
+    if 'size' not in structure or 'palette' not in structure:
+        raise ValueError(f'{filepath} is not a structure file')
+
+    structure['size'] = tuple(structure['size'])
+    return structure
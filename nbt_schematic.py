@@ -9,35 +9,19 @@
 
 # import
 import json
-import python_nbt.nbt as nbt
 from random import choice
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import os.path as path
 import os
 
+from nbt_reader import read_structure
+from volume import Volume
+from derived_textures import make_variant
+from colorspace import tint
 
-# region utils
-
-
-def get_nbt_data(filepath: str) -> tuple[list[int, int, int], list[dict[str: list[int, int, int] | int]], list[dict[str: dict | str]]]:
-    """
-    Retrieve nbt data from a nbt file
-    Args:
-        filepath (): relative or absolut path to the .nbt file
-
-    Returns:
-        size of the structure
-        blocks data
-        palette data
-    """
-    data_brut = nbt.read_from_nbt_file(filepath)
-    data = data_brut.json_obj(full_json=False)
-
-    size = tuple(data['size'])
-    blocks = data['blocks']
-    palette = data['palette']
 
-    return size, blocks, palette
+# region utils
 
 
 def clean_base(value: str) -> str:
@@ -185,7 +169,9 @@ def hsv_to_rgb(hsv):
 
 
 def nbt_to_png(filepath, scale=16, grid=2, offset=50, showDebug=True):
-    size, block, palette = get_nbt_data(filepath)
+    structure = read_structure(filepath)
+    size = structure['size']
+    palette = structure['palette']
 
     height = size[0]
     nbr_layer = size[1]
@@ -194,15 +180,16 @@ def nbt_to_png(filepath, scale=16, grid=2, offset=50, showDebug=True):
     scale = 16 * (scale // 16)
 
     air_state = get_air_state(palette)
+    if air_state == -1:
+        # no air in the palette, cells without block get a state past the palette and are skipped like air
+        air_state = len(palette)
 
     if showDebug:
         print("SIZE: ", size)
         print("PALETTE: ", palette)
 
-    nbt_layer = [[[air_state for __ in range(height)] for __ in range(width)] for _ in range(nbr_layer)]
-    for b in block:
-        pos = b['pos']
-        nbt_layer[pos[1]][pos[2]][pos[0]] = b['state']
+    nbt_layer = Volume.from_arrays(size, structure['positions'], structure['states'], palette,
+                                   fill=air_state).oriented((1, 2, 0))
 
     textures_base, textures = get_textures(palette, scale)
 
@@ -220,17 +207,17 @@ def nbt_to_png(filepath, scale=16, grid=2, offset=50, showDebug=True):
     font = ImageFont.truetype(path.abspath("../temp/to_schema/textures/fonts/MinecraftRegular.otf"), scale // 2)
 
     for i_layer, layer in enumerate(nbt_layer):
+        layer = layer.tolist()
         img_path = path.join(i_path, path.basename(filepath[0:-4]) + f"_layer_{i_layer+1}.png")
         img = Image.new("RGBA", img_size, (127, 127, 127, 255))
         img_draw = ImageDraw.Draw(img)
-        img_grid = img.load()
 
         # draw grid
         for x in range(offset, img_size[0] - offset * text_offset + 1, scale+grid):
-            draw_square(img_grid, x, offset, x + grid, img_size[1] - offset, (0, 0, 0, 255))
+            draw_square(img, x, offset, x + grid, img_size[1] - offset, (0, 0, 0, 255))
 
         for y in range(offset, img_size[1] - offset + 1, scale + grid):
-            draw_square(img_grid, offset, y, img_size[0] - offset * text_offset, y + grid, (0, 0, 0, 255))
+            draw_square(img, offset, y, img_size[0] - offset * text_offset, y + grid, (0, 0, 0, 255))
 
         # draw block
         legend = {}
@@ -275,9 +262,7 @@ def nbt_to_png(filepath, scale=16, grid=2, offset=50, showDebug=True):
         print("")
 
 def draw_square(img, x1, y1, x2, y2, color):
-    for x in range(x1, x2):
-        for y in range(y1, y2):
-            img[x, y] = color
+    img.paste(color, (x1, y1, x2, y2))
 
 def get_textures(palette, size):
     texture_path = "../temp/to_schema/textures/blocks"
@@ -337,40 +322,15 @@ def apply_color(img, img_modify, blend):
     img = path.join(tex_path, img)
     img_modify = path.join(tex_path, img_modify)
     # apply color to sprite
-    blend = rgb_to_hsv(blend)
-
-    img = Image.open(img).convert("RGBA")
-    img_draw = img.load()
-    img_size = img.size
-    for x in range(img_size[0]):
-        for y in range(img_size[1]):
-            color = img_draw[x, y]
-
-            alpha = color[3]
-            color = rgb_to_hsv(list(color[0:3]))
-
-            color = [int(i) for i in hsv_to_rgb((blend[0], blend[1], (blend[2] + color[2]) / 2))]
-
-            img_draw[x, y] = tuple(color + [alpha])
-
-    img.save(img_modify)
+    img = np.asarray(Image.open(img).convert("RGBA"))
+    Image.fromarray(tint(img, [blend])[0], "RGBA").save(img_modify)
 
 def make_mask(img_base_path, img_path, mask_path):
     tex_path = "../temp/to_schema/textures/blocks"
     img_base_path = path.join(tex_path, img_base_path)
     img_path = path.join(tex_path, img_path)
 
-    mask = Image.open(mask_path).load()
-    img_draw = Image.open(img_base_path).load()
-
-    img_slab = Image.new("RGBA", (16, 16), (0, 0, 0, 0))
-    img_slab_draw = img_slab.load()
-    for x in range(16):
-        for y in range(16):
-            if mask[x, y][3] == 255:
-                img_slab_draw[x, y] = img_draw[x, y]
-
-    img_slab.save(img_path)
+    make_variant(Image.open(img_base_path), Image.open(mask_path)).save(img_path)
 
 if __name__ == "__main__":
     mask_slab = "../temp/to_schema/textures/masks/mask_slab.png"
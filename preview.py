@@ -0,0 +1,105 @@
+# -------------------------------------------------------------------------------
+# Name:        preview
+# Purpose:     draw single layers at screen resolution for the layer browser of the GUI
+# -------------------------------------------------------------------------------
+
+from collections import OrderedDict
+from os import path
+
+from PIL import Image
+
+from export import Exporter, ExportSettings, resource_path
+from render import LayerRenderer
+from structure_formats import get_air_states, get_fill_state
+from volume import AXIS_ORDERS, get_layout
+
+# blocks smaller than this are drawn without grid lines
+MIN_GRID_SCALE = 8
+
+
+class LayerPreview:
+    """
+    Draw any layer of a loaded structure at the block size fitting an area, straight from its palette indices
+    Only the shown layer is drawn. Textures are loaded once by block size, for the few last sizes.
+    """
+    MAX_SCALES = 4
+
+    def __init__(self, structure: dict, settings: ExportSettings = None):
+        """
+        Args:
+            structure (): dict given by structure_formats.load_structure
+            settings (): texture cache option, a preview has its own Exporter so it can run during an export
+        """
+        self.structure = structure
+        self.exporter = Exporter(settings)
+        self.palette = structure['palette']
+
+        self.air_states = get_air_states(self.palette)
+        # cells without block, the state past the palette without air
+        self.air_state = get_fill_state(self.palette, self.air_states)
+
+        self.layouts = {}
+        # LayerRenderer of each (axis, block size)
+        self.renderers = OrderedDict()
+
+    def get_layout(self, axis: str):
+        """
+        Get the layers along an axis
+        Args:
+            axis (): 'x', 'y' or 'z'
+
+        Returns:
+            3D array or SparseLayout, see volume.get_layout
+        """
+        if axis not in self.layouts:
+            self.layouts[axis] = get_layout(self.structure, AXIS_ORDERS[axis], self.air_state,
+                                            self.air_states[1:])
+        return self.layouts[axis]
+
+    def get_layer_count(self, axis: str) -> int:
+        return self.get_layout(axis).shape[0]
+
+    def _get_renderer_(self, axis: str, scale: int, grid_size: int) -> LayerRenderer:
+        key = (axis, scale, grid_size)
+        if key in self.renderers:
+            self.renderers.move_to_end(key)
+            return self.renderers[key]
+
+        exporter = self.exporter
+        length_i, length_j = self.get_layout(axis).shape[1:]
+        dimension = (length_i * (scale + grid_size) + grid_size, length_j * (scale + grid_size) + grid_size)
+        palette = self.palette
+        if self.air_state == len(palette):
+            palette = palette + [{'Name': 'minecraft:air'}]
+        textures = [exporter.get_scaled_texture(block_data, scale, Image.NEAREST) for block_data in palette]
+        previous_texture = exporter.assets.open(path.join(exporter.PATH_PROPERTIES, 'previous_block.png')
+                                                ).resize((scale, scale), resample=Image.NEAREST)
+
+        renderer = LayerRenderer(textures, {}, exporter.get_grid_template(dimension, scale, grid_size),
+                                 previous_texture, resource_path(exporter.PATH_FONTS), dimension,
+                                 {'right': 0, 'left': 0, 'top': 0, 'bottom': 0}, scale, grid_size, 'right',
+                                 self.air_state)
+        self.renderers[key] = renderer
+        if len(self.renderers) > self.MAX_SCALES:
+            self.renderers.popitem(last=False)
+        return renderer
+
+    def render(self, axis: str, i_layer: int, size: tuple[int, int]) -> Image.Image:
+        """
+        Draw a layer with the biggest block size fitting an area, without legend
+        Args:
+            axis (): 'x', 'y' or 'z'
+            i_layer (): index of the layer
+            size (): (width, height) of the area
+
+        Returns:
+            layer image, at most as big as the area unless one pixel by block is already bigger
+        """
+        layout = self.get_layout(axis)
+        length_i, length_j = layout.shape[1:]
+        step = max(1, min((size[0] - 1) // length_i, (size[1] - 1) // length_j))
+        grid_size = 1 if step > MIN_GRID_SCALE else 0
+
+        renderer = self._get_renderer_(axis, step - grid_size, grid_size)
+        previous_layer = layout[i_layer - 1] if i_layer > 0 else None
+        return Image.fromarray(renderer.draw_blocks(layout[i_layer], previous_layer), 'RGBA')
@@ -0,0 +1,143 @@
+# -------------------------------------------------------------------------------
+# Name:        profiler
+# Purpose:     measure time and memory of each stage of an export
+# -------------------------------------------------------------------------------
+
+import json
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def get_max_rss() -> int | None:
+    """
+    Get the highest resident memory of the process
+    Returns:
+        bytes, None if the platform cannot tell
+    """
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Profiler:
+    """
+    Accumulate wall time, number of calls and peak traced memory by stage name
+    Memory is only measured when trace_memory is set, as tracing slows everything down.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.start = perf_counter()
+
+        self._own_tracing = False
+        self._peaks = []
+
+    def start_tracing(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracing = True
+
+    def stop_tracing(self):
+        if self._own_tracing:
+            tracemalloc.stop()
+            self._own_tracing = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_own_tracing'] = False
+        state['_peaks'] = []
+        return state
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measure a block of code, stages can be nested
+        Args:
+            name (): stage name, measures of the same name are added
+        """
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # the running outer stage keeps the peak reached so far
+            current_peak = tracemalloc.get_traced_memory()[1]
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], current_peak)
+            self._peaks.append(0)
+            tracemalloc.reset_peak()
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start
+
+            peak = 0
+            if tracing:
+                peak = max(tracemalloc.get_traced_memory()[1], self._peaks.pop())
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                tracemalloc.reset_peak()
+
+            self.add(name, duration, 1, peak)
+
+    def add(self, name: str, duration: float, calls: int = 1, peak_memory: int = 0):
+        stage = self.stages.setdefault(name, {'calls': 0, 'time': 0.0, 'peak_memory': 0})
+        stage['calls'] += calls
+        stage['time'] += duration
+        stage['peak_memory'] = max(stage['peak_memory'], peak_memory)
+
+    def merge(self, stages: dict):
+        """
+        Add measures made elsewhere, like in a worker process
+        Args:
+            stages (): stages attribute of another profiler
+        """
+        for name, stage in stages.items():
+            self.add(name, stage['time'], stage['calls'], stage['peak_memory'])
+
+    def to_dict(self) -> dict:
+        return {
+            'total_time': perf_counter() - self.start,
+            'max_rss': get_max_rss(),
+            'trace_memory': self.trace_memory,
+            'stages': self.stages
+        }
+
+    def save(self, filepath: str, **extra):
+        """
+        Write the profile as JSON
+        Args:
+            filepath (): path of the .json file
+            **extra (): other values to save, like the export settings
+        """
+        profile = self.to_dict()
+        profile.update(extra)
+        with open(filepath, 'w') as file:
+            json.dump(profile, file, indent=1)
+
+    def summary(self) -> str:
+        """
+        Get a readable text of the stages
+        Returns:
+            one line by stage
+        """
+        lines = []
+        for name, stage in self.stages.items():
+            line = f"{name}: {stage['time']:.3f} s"
+            if stage['calls'] > 1:
+                line += f" ({stage['calls']} x {stage['time'] / stage['calls'] * 1000:.1f} ms)"
+            if stage['peak_memory']:
+                line += f" - peak {stage['peak_memory'] / 2 ** 20:.1f} MB"
+            lines.append(line)
+        lines.append(f'total: {perf_counter() - self.start:.3f} s')
+        return '\n'.join(lines)
@@ -0,0 +1,1096 @@
+# -------------------------------------------------------------------------------
+# Name:        render
+# Purpose:     draw the layers of a structure, in the current process or in workers
+# -------------------------------------------------------------------------------
+
+import hashlib
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from math import ceil
+from multiprocessing import Pool
+from os import path, remove, replace, link, getpid, makedirs, walk
+from queue import Queue
+from threading import Thread, get_ident
+from time import perf_counter
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from encoding import LayerEncoder
+from profiler import Profiler
+
+# layer images waiting to be saved, bounds the memory of the render / encode pipeline
+PIPELINE_DEPTH = 2
+# layers sent to a worker at once
+MAX_RANGE_LAYERS = 16
+# folder of the tiles shared by empty areas of tiled layers
+BLANK_TILES_DIRECTORY = 'blank_tiles'
+# color of the layer images behind blocks
+BACKGROUND_COLOR = (127, 127, 127, 255)
+# layers with less occupied cells than this part only draw those cells
+SPARSE_RATIO = 0.25
+# occupied cells drawn at once by the sparse path
+SPARSE_CHUNK = 4096
+
+DZI_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{image_format}" Overlap="0" TileSize="{tile_size}">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+'''
+
+
+def alpha_paste(background: np.ndarray, foreground: np.ndarray) -> np.ndarray:
+    """
+    Paste RGBA pixels over others using their own alpha as mask, with the exact rounding of Pillow's
+    Image.paste(foreground, mask=foreground), so both can be mixed without changing the output
+    Args:
+        background (): uint8 array (..., 4)
+        foreground (): uint8 array (..., 4), broadcastable to background
+
+    Returns:
+        new uint8 array
+    """
+    mask = foreground[..., 3:4].astype(np.uint32)
+    tmp = background.astype(np.uint32) * (255 - mask) + foreground.astype(np.uint32) * mask + 128
+    return (((tmp >> 8) + tmp) >> 8).astype(np.uint8)
+
+
+# color of the legend names
+TEXT_COLOR = (255, 255, 255, 255)
+
+
+@lru_cache(maxsize=None)
+def get_font(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    Load a font once by process, shared by every export and renderer
+    Args:
+        font_path (): path to a TrueType or OpenType font
+        size (): font size in pixel
+
+    Returns:
+        font
+    """
+    return ImageFont.truetype(font_path, size)
+
+
+@lru_cache(maxsize=4096)
+def get_text_sprite(font_path: str, size: int, text: str) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Rasterize a text once, to blit it instead of drawing it again
+    Args:
+        font_path (): path to the font
+        size (): font size in pixel
+        text (): text to draw
+
+    Returns:
+        L mask of the text, same pixels as ImageDraw.text
+        offset of the mask from the text position
+    """
+    font = get_font(font_path, size)
+    core, offset = font.getmask2(text, 'L')
+    # drawn in a mask of its own size, the mask is copied as is
+    mask = Image.new('L', core.size)
+    ImageDraw.Draw(mask).text((-offset[0], -offset[1]), text, fill=255, font=font)
+    return mask, offset
+
+
+def get_legend_entry_box(font_path: str, scale: int, name: str) -> tuple[int, int, int, int]:
+    """
+    Measure a legend entry: a scale x scale texture, then its name after 1.5 blocks
+    Args:
+        font_path (): path to the legend font
+        scale (): block size in pixel, the font is half of it
+        name (): block name
+
+    Returns:
+        (left, top, right, bottom) of the entry relative to its position
+    """
+    mask, (left, top) = get_text_sprite(font_path, scale // 2, name)
+    space = int(scale * 1.5)
+    return (min(0, space + left), min(0, top),
+            max(scale, space + left + mask.size[0]), max(scale, top + mask.size[1]))
+
+
+def get_legend_margin(font_path: str, scale: int, grid_size: int, legend_position: str, legends) -> int:
+    """
+    Measure the margin needed by the legend, as placed by LayerRenderer.get_legend_boxes
+    Args:
+        font_path (): path to the legend font
+        scale (): block size in pixel
+        grid_size (): grid line width in pixel
+        legend_position (): 'right', 'left', 'top' or 'bottom'
+        legends (): block names of the legend of each layer
+
+    Returns:
+        margin size in pixel, half a block is kept around the entries
+    """
+    legends = [legend for legend in legends if legend]
+    if not legends:
+        return 0
+
+    if legend_position in ['right', 'left']:
+        right = max(get_legend_entry_box(font_path, scale, name)[2] for legend in legends for name in legend)
+        return scale // 2 + right + scale // 2
+
+    count = max(len(legend) for legend in legends)
+    boxes = [get_legend_entry_box(font_path, scale, name) for legend in legends for name in legend]
+    rows = (count - 1) * (scale + grid_size)
+    if legend_position == 'bottom':
+        return scale // 2 + rows + max(box[3] for box in boxes) + scale // 2
+    # the first entry is placed a block and a half above the grid, the next ones upward
+    return scale + scale // 2 + rows - min(box[1] for box in boxes) + scale // 2
+
+
+def write_file(data, filepath: str, profiler: Profiler = None):
+    """
+    Write a file through a temporary file, so a hard link to the old file is never written into
+    Args:
+        data (): bytes like content
+        filepath (): final path
+        profiler (): measures the 'write' stage
+    """
+    if profiler is None:
+        profiler = Profiler()
+
+    with profiler.stage('write'):
+        temp_path = f'{filepath}.{getpid()}.{get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        replace(temp_path, filepath)
+
+
+def encode_image(img: Image.Image, encoder: LayerEncoder = None, profiler: Profiler = None) -> memoryview:
+    """
+    Encode an image
+    Args:
+        img (): image to encode
+        encoder (): file settings, RGBA PNG if None
+        profiler (): measures the 'encode' stage
+
+    Returns:
+        encoded bytes
+    """
+    if encoder is None:
+        encoder = LayerEncoder()
+    if profiler is None:
+        profiler = Profiler()
+
+    with profiler.stage('encode'):
+        return encoder.encode(img)
+
+
+def save_layer(img: Image.Image, layer_path: str, profiler: Profiler = None, encoder: LayerEncoder = None):
+    """
+    Save a layer image through a temporary file, so a hard link to the old file is never written into
+    Args:
+        img (): image to save
+        layer_path (): final path
+        profiler (): measures 'encode' and 'write' stages
+        encoder (): file settings, RGBA PNG if None
+    """
+    write_file(encode_image(img, encoder, profiler), layer_path, profiler)
+
+
+def get_tiles_directory(layer_path: str) -> str:
+    """
+    Get the folder of the tiles of a deep zoom layer
+    Args:
+        layer_path (): path of the .dzi file
+
+    Returns:
+        '<name>_files' folder next to it
+    """
+    return path.splitext(layer_path)[0] + '_files'
+
+
+def copy_layer(source_path: str, layer_path: str, mode: str = 'link'):
+    """
+    Emit a layer identical to an already saved one, with its tiles for a deep zoom layer
+    Args:
+        source_path (): image of the identical layer
+        layer_path (): path of the duplicated layer
+        mode (): 'link' for a hard link (copy if the file system refuses), 'copy', or 'reference' to only
+                 delete an outdated file, the manifest then points to the source
+    """
+    if path.exists(layer_path):
+        remove(layer_path)
+
+    if path.splitext(layer_path)[1].lower() == '.dzi':
+        source_tiles = get_tiles_directory(source_path)
+        tiles = get_tiles_directory(layer_path)
+        if path.isdir(tiles):
+            shutil.rmtree(tiles)
+
+        if mode != 'reference':
+            for root, _, files in walk(source_tiles):
+                directory = path.join(tiles, path.relpath(root, source_tiles))
+                makedirs(directory, exist_ok=True)
+                for filename in files:
+                    copy_layer(path.join(root, filename), path.join(directory, filename), mode)
+
+    if mode == 'link':
+        try:
+            link(source_path, layer_path)
+            return
+        except OSError:
+            pass
+    if mode != 'reference':
+        shutil.copyfile(source_path, layer_path)
+
+
+class LayerWriter:
+    """
+    Encode and save layer images in background threads while the next layers are drawn
+    Encoders release the GIL, so drawing and the threads overlap. The queue is bounded: drawing waits when
+    PIPELINE_DEPTH images by thread are already waiting.
+    """
+
+    def __init__(self, encoder: LayerEncoder = None, threads: int = 1, depth: int = PIPELINE_DEPTH):
+        self.encoder = encoder
+        self.queue = Queue(maxsize=depth * max(1, threads))
+        # memory is only traced from the drawing thread
+        self.profilers = []
+        self.error = None
+
+        self.threads = []
+        for _ in range(max(1, threads)):
+            profiler = Profiler()
+            thread = Thread(target=self._run_, args=(profiler,), daemon=True)
+            thread.start()
+            self.profilers.append(profiler)
+            self.threads.append(thread)
+
+    def _run_(self, profiler: Profiler):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    content, filepath = item
+                    if isinstance(content, Image.Image):
+                        save_layer(content, filepath, profiler, self.encoder)
+                    else:
+                        write_file(content, filepath, profiler)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def put(self, content: Image.Image | bytes, filepath: str):
+        """
+        Queue an image to save, or bytes to write
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((content, filepath))
+
+    def flush(self):
+        """
+        Wait for every queued image to be saved
+        """
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Wait for every image to be saved and stop the threads
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def merge_stages(self, profiler: Profiler):
+        for thread_profiler in self.profilers:
+            profiler.merge(thread_profiler.stages)
+
+
+class LayerRenderer:
+    """
+    Everything needed to draw a layer image, only holds picklable data so it can be sent to worker processes
+    """
+
+    def __init__(self, textures, legend_textures, grid_img, previous_texture, font_path,
+                 dimension, margins, scale, grid_size, legend_position, air_state, tile_size=0,
+                 encoder=None, encode_threads=1):
+        """
+        Args:
+            textures (): resized texture of each palette state
+            legend_textures (): resized base texture of each block name
+            grid_img (): grid template, drawn over the block area, None for tiled layers
+            previous_texture (): texture drawn over blocks where the previous layer is not air
+            font_path (): path to the legend font
+            dimension (): size of the layer image
+            margins (): dict of 'right', 'left', 'top' and 'bottom' space around the grid
+            scale (): block size in pixel
+            grid_size (): grid thickness in pixel
+            legend_position (): 'right', 'left', 'top' or 'bottom'
+            air_state (): palette index of air, -1 if none
+            tile_size (): size of the deep zoom tiles, 0 to save each layer as a single image
+            encoder (): LayerEncoder of the images, RGBA PNG if None
+            encode_threads (): threads encoding images while the next ones are drawn
+        """
+        self.textures = textures
+        self.legend_textures = legend_textures
+        self.grid_img = grid_img
+        self.previous_texture = previous_texture
+        self.font_path = font_path
+        self.dimension = dimension
+        self.margins = margins
+        self.scale = scale
+        self.grid_size = grid_size
+        self.legend_position = legend_position
+        self.air_state = air_state
+        self.tile_size = tile_size
+        self.encoder = encoder if encoder is not None else LayerEncoder()
+        self.encode_threads = encode_threads
+
+        self.grid_dimension = (dimension[0] - margins['left'] - margins['right'],
+                               dimension[1] - margins['top'] - margins['bottom'])
+        self.font = None
+        self.background, self.cells = self._prepare_arrays_()
+        # air cells look like the background, drawing them can be skipped
+        self.air_blank = (self.air_state >= 0 and self.background is not None
+                          and bool(np.all(self.cells[self.air_state] == BACKGROUND_COLOR)))
+        # blank tile file of each tile key, see render_tiles
+        self.blank_tiles = {}
+        # encoded image of a layer without block, see get_empty_layer
+        self.empty_layer = None
+
+    def _prepare_arrays_(self):
+        """
+        Precompute the pixels shared by every layer
+        Returns:
+            RGBA array of an empty layer (background + grid), None for tiled layers
+            stacked cells of each state, over the background, then the same with the previous block overlay
+        """
+        background = None
+        if self.grid_img is not None:
+            empty_img = Image.new('RGBA', self.dimension, BACKGROUND_COLOR)
+            empty_img.paste(self.grid_img, (self.margins['left'], self.margins['top']), mask=self.grid_img)
+            background = np.asarray(empty_img)
+
+        cell = np.array(BACKGROUND_COLOR, dtype=np.uint8)
+        cells = np.empty((2 * len(self.textures), self.scale, self.scale, 4), dtype=np.uint8)
+        if len(self.textures) > 0:
+            textures = np.stack([np.asarray(texture.convert('RGBA')) for texture in self.textures])
+            cells[:len(self.textures)] = alpha_paste(cell, textures)
+            cells[len(self.textures):] = alpha_paste(cells[:len(self.textures)],
+                                                     np.asarray(self.previous_texture.convert('RGBA')))
+
+        return background, cells
+
+    def __getstate__(self):
+        # fonts cannot be pickled, each process loads its own
+        state = self.__dict__.copy()
+        state['font'] = None
+        state['empty_layer'] = None
+        return state
+
+    def get_font(self):
+        if self.font is None:
+            self.font = get_font(self.font_path, self.scale // 2)
+        return self.font
+
+    def get_pixels(self) -> np.ndarray:
+        """
+        Pixels of the cells and legend textures, the colors of layers except the background and grid
+        Returns:
+            (n, 4) uint8 array, colors repeat as often as in their texture
+        """
+        background = np.array(BACKGROUND_COLOR, dtype=np.uint8)
+        pixels = [self.cells.reshape(-1, 4)]
+        for texture in self.legend_textures.values():
+            pixels.append(alpha_paste(background, np.asarray(texture.convert('RGBA'))).reshape(-1, 4))
+        return np.concatenate(pixels)
+
+    @staticmethod
+    def get_base_colors(text_shades: int = 16) -> np.ndarray:
+        """
+        Background, grid and some shades of the white legend text over the background
+        Args:
+            text_shades (): number of text shades
+
+        Returns:
+            (n, 4) uint8 array
+        """
+        text = np.full((text_shades, 4), 255, dtype=np.uint8)
+        text[:, 3] = np.linspace(0, 255, text_shades).round()
+        shades = alpha_paste(np.array((127, 127, 127, 255), dtype=np.uint8), text)
+        return np.concatenate((np.array([(127, 127, 127, 255), (0, 0, 0, 255)], dtype=np.uint8), shades))
+
+    def get_cell_indices(self, layer, previous_layer) -> np.ndarray:
+        """
+        Get the index in the stack of cells of each block of a layer
+        Args:
+            layer (): 2D array of palette indices
+            previous_layer (): 2D array of the layer before, None for the first one
+
+        Returns:
+            2D array of indices
+        """
+        indices = np.asarray(layer, dtype=np.intp)
+        if previous_layer is not None:
+            # cells over a block use the second half of the stack
+            indices = indices + len(self.textures) * (np.asarray(previous_layer) != self.air_state)
+        return indices
+
+    def draw_blocks(self, layer, previous_layer) -> np.ndarray:
+        """
+        Draw the grid and blocks of a layer in one gather of precomputed cells
+        Sparse layers only draw their occupied cells, air is already the background.
+        Args:
+            layer (): 2D array of palette indices
+            previous_layer (): 2D array of the layer before, None for the first one
+
+        Returns:
+            RGBA array of the layer without legend
+        """
+        canvas = self.background.copy()
+        indices = self.get_cell_indices(layer, previous_layer)
+
+        length_j, length_i = indices.shape[1], indices.shape[0]
+        step = self.scale + self.grid_size
+        top = self.margins['top'] + self.grid_size
+        left = self.margins['left'] + self.grid_size
+
+        # each cell is followed by a grid line, so the block area splits in (step x step) squares
+        area = canvas[top:top + length_j * step, left:left + length_i * step].reshape(length_j, step, length_i, step, 4)
+
+        if self.air_blank:
+            # air over air keeps the first half index, so it is the only blank cell
+            i, j = np.nonzero(indices != self.air_state)
+            if len(i) < SPARSE_RATIO * indices.size:
+                # scatter of the occupied cells only, by chunks so the gathered cells stay small
+                for start in range(0, len(i), SPARSE_CHUNK):
+                    chunk_i, chunk_j = i[start:start + SPARSE_CHUNK], j[start:start + SPARSE_CHUNK]
+                    area[length_j - 1 - chunk_j, :self.scale, chunk_i, :self.scale] = self.cells[indices[chunk_i, chunk_j]]
+                return canvas
+
+        # one row of cells at a time, so the gathered tiles stay small; j goes up while image rows go down
+        for row, j in enumerate(range(length_j - 1, -1, -1)):
+            area[row, :self.scale, :, :self.scale] = self.cells[indices[:, j]].transpose(1, 0, 2, 3)
+
+        return canvas
+
+    def is_empty_layer(self, layer, previous_layer, legend) -> bool:
+        """
+        Check if a layer is drawn as the empty layer: only air, over air or nothing, without legend
+        Args:
+            layer (): 2D array of palette indices
+            previous_layer (): 2D array of the layer before, None for the first one
+            legend (): block names to show in the legend
+
+        Returns:
+            True if get_empty_layer can be saved instead of drawing the layer
+        """
+        if self.air_state < 0 or legend:
+            return False
+        if not np.all(np.asarray(layer) == self.air_state):
+            return False
+        return previous_layer is None or bool(np.all(np.asarray(previous_layer) == self.air_state))
+
+    def get_empty_layer(self, shape, profiler: Profiler = None) -> memoryview:
+        """
+        Encoded image of a layer of air, drawn and encoded once then shared by every empty layer
+        Args:
+            shape (): shape of the 2D layers
+            profiler (): gets the 'render' and 'encode' stages of the first call
+
+        Returns:
+            file content
+        """
+        if self.empty_layer is None:
+            if profiler is None:
+                profiler = Profiler()
+            with profiler.stage('render'):
+                img = self.render(np.full(shape, self.air_state, dtype=np.intp), None, [])
+            self.empty_layer = encode_image(img, self.encoder, profiler)
+        return self.empty_layer
+
+    def _get_axis_cells_(self, start: int, stop: int, origin: int, length: int):
+        """
+        Locate pixels of one image axis in the grid
+        Args:
+            start (): first pixel
+            stop (): pixel after the last one
+            origin (): first pixel of the grid
+            length (): number of cells on this axis
+
+        Returns:
+            mask of grid line pixels
+            mask of cell pixels
+            cell of each pixel
+            position of each pixel in its cell
+        """
+        step = self.scale + self.grid_size
+        pixels = np.arange(start, stop) - origin
+        inside = (pixels >= 0) & (pixels < length * step + self.grid_size)
+        offsets = pixels % step - self.grid_size
+        return inside & (offsets < 0), inside & (offsets >= 0), pixels // step, offsets
+
+    def draw_region(self, indices, box) -> np.ndarray:
+        """
+        Draw the grid and blocks of a part of a layer, same pixels as the crop of draw_blocks
+        Args:
+            indices (): cell indices of the layer, see get_cell_indices
+            box (): (left, top, right, bottom) in layer image pixels
+
+        Returns:
+            RGBA array of the region without legend
+        """
+        x0, y0, x1, y1 = box
+        region = np.empty((y1 - y0, x1 - x0, 4), dtype=np.uint8)
+        region[:] = (127, 127, 127, 255)
+
+        scale = self.scale
+        grid_size = self.grid_size
+        step = scale + grid_size
+        length_i, length_j = indices.shape
+        top = self.margins['top']
+        left = self.margins['left']
+
+        # part of the grid in the region, lines first then cells over them
+        grid_x0, grid_x1 = max(x0, left), min(x1, left + self.grid_dimension[0])
+        grid_y0, grid_y1 = max(y0, top), min(y1, top + self.grid_dimension[1])
+        if grid_x0 >= grid_x1 or grid_y0 >= grid_y1:
+            return region
+        region[grid_y0 - y0:grid_y1 - y0, grid_x0 - x0:grid_x1 - x0] = (0, 0, 0, 255)
+
+        i0 = max(0, (grid_x0 - left - grid_size) // step)
+        i1 = min(length_i, (grid_x1 - left - grid_size - 1) // step + 1)
+        row0 = max(0, (grid_y0 - top - grid_size) // step)
+        row1 = min(length_j, (grid_y1 - top - grid_size - 1) // step + 1)
+        if i0 >= i1:
+            return region
+
+        # each cell is followed by a grid line, like in draw_blocks
+        strip_x = left + grid_size + i0 * step
+        x_start, x_stop = max(grid_x0, strip_x), min(grid_x1, strip_x + (i1 - i0) * step)
+        for row in range(row0, row1):
+            cell_y = top + grid_size + row * step
+            y_start, y_stop = max(grid_y0, cell_y), min(grid_y1, cell_y + scale)
+            if y_start >= y_stop:
+                continue
+
+            # j goes up while image rows go down
+            cells = self.cells[indices[i0:i1, length_j - 1 - row], y_start - cell_y:y_stop - cell_y]
+            strip = np.empty((y_stop - y_start, i1 - i0, step, 4), dtype=np.uint8)
+            strip[:, :, scale:] = (0, 0, 0, 255)
+            strip[:, :, :scale] = cells.transpose(1, 0, 2, 3)
+            strip = strip.reshape(y_stop - y_start, (i1 - i0) * step, 4)
+            region[y_start - y0:y_stop - y0, x_start - x0:x_stop - x0] = strip[:, x_start - strip_x:x_stop - strip_x]
+
+        return region
+
+    def is_air_region(self, layer, previous_layer, box) -> bool:
+        """
+        Check if a part of a layer only shows air, without previous blocks under it
+        Args:
+            layer (): 2D array of palette indices
+            previous_layer (): 2D array of the layer before, None for the first one
+            box (): (left, top, right, bottom) in layer image pixels
+
+        Returns:
+            True if it would be drawn the same in any layer
+        """
+        length_i, length_j = np.shape(layer)
+        _, row_cells, rows, _ = self._get_axis_cells_(box[1], box[3], self.margins['top'], length_j)
+        _, column_cells, columns, _ = self._get_axis_cells_(box[0], box[2], self.margins['left'], length_i)
+        if not row_cells.any() or not column_cells.any():
+            return True
+
+        rows = rows[row_cells]
+        columns = columns[column_cells]
+        # j goes up while image rows go down
+        cells = (slice(columns[0], columns[-1] + 1), slice(length_j - 1 - rows[-1], length_j - rows[0]))
+        if not np.all(np.asarray(layer)[cells] == self.air_state):
+            return False
+        return previous_layer is None or bool(np.all(np.asarray(previous_layer)[cells] == self.air_state))
+
+    def get_legend_boxes(self, legend) -> list[tuple[str, int, int, tuple[int, int, int, int]]]:
+        """
+        Place the legend of a layer
+        Args:
+            legend (): block names to show in the legend
+
+        Returns:
+            list of (name, x, y, box covering the texture and the text)
+        """
+        scale = self.scale
+        grid_size = self.grid_size
+        margins = self.margins
+
+        positions = []
+        if self.legend_position in ['right', 'left']:
+            x = scale // 2
+            y = margins['top']
+            if self.legend_position == 'right':
+                x += self.dimension[0] - margins['right']
+
+            for name in legend:
+                positions.append((name, x, y))
+                y += scale + grid_size
+        else:
+            sign = 1
+
+            x = margins['left']
+            if self.legend_position == 'bottom':
+                y = margins['top'] + self.grid_dimension[1] + (scale // 2)
+            else:
+                y = margins['top'] - scale - (scale // 2)
+                sign = -1
+
+            for name in legend:
+                positions.append((name, x, y))
+                y += ((scale + grid_size) * sign)
+
+        boxes = []
+        for name, x, y in positions:
+            left, top, right, bottom = get_legend_entry_box(self.font_path, scale, name)
+            boxes.append((name, x, y, (x + left, y + top, x + right, y + bottom)))
+        return boxes
+
+    def draw_legend(self, img, legend_boxes, origin=(0, 0)):
+        """
+        Draw legend entries on an image
+        Args:
+            img (): whole layer image, or a tile of it
+            legend_boxes (): entries given by get_legend_boxes
+            origin (): position of the image in the layer
+        """
+        space = int(self.scale * 1.5)
+        for name, x, y, _ in legend_boxes:
+            x -= origin[0]
+            y -= origin[1]
+            texture = self.legend_textures[name]
+            img.paste(texture, (x, y), mask=texture)
+            # same pixels as ImageDraw.text, without laying out the text again
+            text, (left, top) = get_text_sprite(self.font_path, self.scale // 2, name)
+            img.paste(TEXT_COLOR, (x + space + left, y + top), mask=text)
+
+    def render(self, layer, previous_layer, legend) -> Image.Image:
+        """
+        Draw one layer
+        Args:
+            layer (): 2D array of palette indices
+            previous_layer (): 2D array of the layer before, None for the first one
+            legend (): block names to show in the legend
+
+        Returns:
+            layer image
+        """
+        layer_img = Image.fromarray(self.draw_blocks(layer, previous_layer), 'RGBA')
+        self.draw_legend(layer_img, self.get_legend_boxes(legend))
+        return layer_img
+
+    def render_materials(self, count: dict) -> Image.Image:
+        """
+        Draw the material list: texture, name and quantity of each block, in columns as high as the layers
+        Args:
+            count (): number of each block name
+
+        Returns:
+            material list image
+        """
+        scale = self.scale
+        font = self.get_font()
+        space = int(scale * 1.5)
+        row_height = scale + self.grid_size
+
+        lines = [(name, f'{name}: {number} ({number // 64} x 64 + {number % 64})') for name, number in count.items()]
+        rows = max(1, (self.dimension[1] - 2 * scale) // row_height - 1)
+        columns = max(1, ceil(len(lines) / rows))
+        column_width = space + ceil(max((font.getlength(text) for _, text in lines), default=0)) + scale
+
+        img = Image.new('RGBA', (scale + columns * column_width, max(self.dimension[1], 2 * scale + row_height)),
+                        (127, 127, 127, 255))
+        draw = ImageDraw.Draw(img)
+        draw.text((scale, scale), 'Materials', font=font)
+        for i, (name, text) in enumerate(lines):
+            x = scale + (i // rows) * column_width
+            y = scale + (i % rows + 1) * row_height
+            texture = self.legend_textures.get(name)
+            if texture is not None:
+                img.paste(texture, (x, y), mask=texture)
+            draw.text((x + space, y), text, font=font)
+        return img
+
+    def _save_blank_tile_(self, key, img: Image.Image, directory: str, profiler: Profiler) -> str:
+        data = encode_image(img, self.encoder, profiler)
+        blank_path = path.join(directory, hashlib.sha1(data).hexdigest() + self.encoder.extension)
+        if not path.exists(blank_path):
+            write_file(data, blank_path, profiler)
+        self.blank_tiles[key] = blank_path
+        return blank_path
+
+    def render_tiles(self, layer, previous_layer, legend, layer_path, writer: LayerWriter, profiler: Profiler):
+        """
+        Draw one layer as a deep zoom image (.dzi file and a folder of tiles by level)
+        Tiles are drawn one by one, lower levels are reduced from their 4 sub tiles as soon as those are done,
+        so only a few tiles by level are in memory. Tiles with only air link to a shared blank tile.
+        Args:
+            layer (): 2D array of palette indices
+            previous_layer (): 2D array of the layer before, None for the first one
+            legend (): block names to show in the legend
+            layer_path (): path of the .dzi file
+            writer (): saves the tiles
+            profiler (): measures 'render' and 'pyramid' stages
+        """
+        tile_size = self.tile_size
+
+        # level 0 is a single pixel, each level doubles the previous one
+        sizes = [tuple(self.dimension)]
+        while sizes[-1] != (1, 1):
+            sizes.append(((sizes[-1][0] + 1) // 2, (sizes[-1][1] + 1) // 2))
+        sizes.reverse()
+        max_level = len(sizes) - 1
+
+        tiles_directory = get_tiles_directory(layer_path)
+        if path.isdir(tiles_directory):
+            shutil.rmtree(tiles_directory)
+        for level in range(len(sizes)):
+            makedirs(path.join(tiles_directory, str(level)))
+        blank_directory = path.join(path.dirname(layer_path), BLANK_TILES_DIRECTORY)
+        makedirs(blank_directory, exist_ok=True)
+
+        legend_boxes = self.get_legend_boxes(legend)
+        indices = self.get_cell_indices(layer, previous_layer)
+
+        def build(level, column, row):
+            """
+            Returns:
+                tile image, None if it is blank
+                key of the blank tile, None if it is not blank
+            """
+            width, height = sizes[level]
+            box = (column * tile_size, row * tile_size,
+                   min((column + 1) * tile_size, width), min((row + 1) * tile_size, height))
+            tile_path = path.join(tiles_directory, str(level), f'{column}_{row}{self.encoder.extension}')
+
+            if level == max_level:
+                with profiler.stage('render'):
+                    boxes = [entry for entry in legend_boxes if entry[3][0] < box[2] and entry[3][2] > box[0]
+                             and entry[3][1] < box[3] and entry[3][3] > box[1]]
+                    # an air tile looks the same in every layer
+                    key = ('tile', box)
+                    blank = not boxes and self.is_air_region(layer, previous_layer, box)
+                    if blank and key in self.blank_tiles:
+                        copy_layer(self.blank_tiles[key], tile_path)
+                        return None, key
+
+                    tile_img = Image.fromarray(self.draw_region(indices, box), 'RGBA')
+                    if boxes:
+                        self.draw_legend(tile_img, boxes, box[:2])
+            else:
+                children = []
+                for child_row in (2 * row, 2 * row + 1):
+                    for child_column in (2 * column, 2 * column + 1):
+                        if child_column * tile_size < sizes[level + 1][0] and child_row * tile_size < sizes[level + 1][1]:
+                            children.append((child_column - 2 * column, child_row - 2 * row,
+                                             *build(level + 1, child_column, child_row)))
+
+                with profiler.stage('pyramid'):
+                    blank = all(child_key is not None for *_, child_key in children)
+                    key = ('reduce',) + tuple(child_key for *_, child_key in children)
+                    if blank and key in self.blank_tiles:
+                        copy_layer(self.blank_tiles[key], tile_path)
+                        return None, key
+
+                    canvas = Image.new('RGBA', (min(2 * box[2], sizes[level + 1][0]) - 2 * box[0],
+                                                min(2 * box[3], sizes[level + 1][1]) - 2 * box[1]))
+                    for dx, dy, child_img, child_key in children:
+                        if child_img is None:
+                            with Image.open(self.blank_tiles[child_key]) as blank_img:
+                                child_img = blank_img.copy()
+                        canvas.paste(child_img, (dx * tile_size, dy * tile_size))
+                    tile_img = canvas.reduce(2)
+
+            if blank:
+                with profiler.stage('blank tiles'):
+                    copy_layer(self._save_blank_tile_(key, tile_img, blank_directory, profiler), tile_path)
+                return None, key
+
+            writer.put(tile_img, tile_path)
+            return tile_img, None
+
+        build(0, 0, 0)
+
+        # written last, an existing .dzi means every tile is saved
+        writer.flush()
+        write_file(DZI_TEMPLATE.format(image_format=self.encoder.image_format, tile_size=tile_size,
+                                       width=self.dimension[0], height=self.dimension[1]).encode('utf-8'),
+                   layer_path, profiler)
+
+    def render_range(self, layers, previous_layer, legends, paths, profiler: Profiler = None, callback=None,
+                     cancel=None):
+        """
+        Draw and save consecutive layers, saving overlaps the drawing of the next layers
+        Args:
+            layers (): iterable of the 2D layers to draw, only one is needed at a time
+            previous_layer (): layer before the first one, None if there is none
+            legends (): legend of each layer
+            paths (): image path of each layer
+            profiler (): measures 'render', 'encode' and 'write' stages
+            callback (): called with 1 after each layer is drawn
+            cancel (): Event stopping the drawing after the current layer when set
+
+        Returns:
+            number of layers saved
+        """
+        if profiler is None:
+            profiler = Profiler()
+
+        done = 0
+        writer = LayerWriter(self.encoder, self.encode_threads)
+        try:
+            for layer, legend, layer_path in zip(layers, legends, paths):
+                if cancel is not None and cancel.is_set():
+                    break
+
+                if self.tile_size:
+                    self.render_tiles(layer, previous_layer, legend, layer_path, writer, profiler)
+                elif self.is_empty_layer(layer, previous_layer, legend):
+                    writer.put(self.get_empty_layer(np.shape(layer), profiler), layer_path)
+                else:
+                    with profiler.stage('render'):
+                        layer_img = self.render(layer, previous_layer, legend)
+                    writer.put(layer_img, layer_path)
+                previous_layer = layer
+                done += 1
+
+                if callback is not None:
+                    callback(1)
+        finally:
+            writer.close()
+            writer.merge_stages(profiler)
+
+        return done
+
+
+# region workers
+
+_worker_renderer = None
+_worker_trace_memory = False
+_worker_page_encoder = None
+_worker_cancel = None
+
+
+def _init_worker_(renderer, trace_memory, page_encoder=None, cancel=None):
+    global _worker_renderer, _worker_trace_memory, _worker_page_encoder, _worker_cancel
+    _worker_renderer = renderer
+    _worker_trace_memory = trace_memory
+    _worker_page_encoder = page_encoder
+    _worker_cancel = cancel
+
+
+def _render_range_(layers, previous_layer, legends, paths):
+    profiler = Profiler(_worker_trace_memory)
+    profiler.start_tracing()
+    done = _worker_renderer.render_range(layers, previous_layer, legends, paths, profiler, cancel=_worker_cancel)
+    profiler.stop_tracing()
+    return done, profiler.stages
+
+
+def _render_pages_(layers, previous_layer, legends):
+    profiler = Profiler(_worker_trace_memory)
+    profiler.start_tracing()
+    pages = []
+    for layer, legend in zip(layers, legends):
+        with profiler.stage('render'):
+            layer_img = _worker_renderer.render(layer, previous_layer, legend)
+        with profiler.stage('encode'):
+            pages.append(_worker_page_encoder.encode(layer_img))
+        previous_layer = layer
+    profiler.stop_tracing()
+    return pages, profiler.stages
+
+
+def _encode_page_(page_encoder, img):
+    start = perf_counter()
+    page = page_encoder.encode(img)
+    return page, perf_counter() - start
+
+
+def split_ranges(length: int, parts: int) -> list[tuple[int, int]]:
+    """
+    Split range(length) in contiguous and disjoint ranges
+    Args:
+        length (): number of elements
+        parts (): maximum number of ranges
+
+    Returns:
+        list of (start, stop)
+    """
+    parts = max(1, min(parts, length))
+    bounds = [length * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
+
+
+def get_runs(indices: list[int]) -> list[tuple[int, int]]:
+    """
+    Group sorted indices in runs of consecutive values
+    Args:
+        indices (): sorted list of int
+
+    Returns:
+        list of (start, stop)
+    """
+    runs = []
+    for index in indices:
+        if runs and runs[-1][1] == index:
+            runs[-1] = (runs[-1][0], index + 1)
+        else:
+            runs.append((index, index + 1))
+    return runs
+
+
+def get_worker_ranges(length: int, workers: int, todo: list[int] = None) -> list[tuple[int, int]]:
+    """
+    Split the layers to draw in ranges sent to workers
+    More ranges than workers so progress is reported regularly, small enough to bound the memory.
+    Args:
+        length (): number of layers
+        workers (): number of processes
+        todo (): sorted indices of the layers to draw, all if None
+
+    Returns:
+        list of (start, stop)
+    """
+    runs = [(0, length)] if todo is None else get_runs(todo)
+    total = sum(stop - start for start, stop in runs)
+
+    ranges = []
+    for start, stop in runs:
+        parts = max(1, round(workers * 4 * (stop - start) / total), -(-(stop - start) // MAX_RANGE_LAYERS))
+        ranges += [(start + a, start + b) for a, b in split_ranges(stop - start, parts)]
+    return ranges
+
+
+def render_parallel(renderer, layout, legends, paths, workers, callback=None, todo=None, profiler=None, cancel=None):
+    """
+    Draw and save layers with a pool of processes, each one receiving the renderer once
+    Args:
+        renderer (): LayerRenderer to use
+        layout (): 3D array or SparseLayout of palette indices, first axis being the layers
+        legends (): legend of each layer
+        paths (): image path of each layer
+        workers (): number of processes
+        callback (): called in this process with the number of layers done, after each range
+        todo (): sorted indices of the layers to draw, all if None
+        profiler (): receives the stages measured by the workers, their times are added together
+        cancel (): multiprocessing Event, workers stop after their current layer when set
+    """
+    ranges = get_worker_ranges(len(layout), workers, todo)
+
+    def collect(result):
+        done, stages = result.get()
+        if profiler is not None:
+            profiler.merge(stages)
+        if callback is not None:
+            callback(done)
+
+    trace_memory = profiler is not None and profiler.trace_memory
+    with Pool(workers, initializer=_init_worker_, initargs=(renderer, trace_memory, None, cancel)) as pool:
+        # layers are only sliced when a worker is about to need them
+        pending = []
+        for start, stop in ranges:
+            if cancel is not None and cancel.is_set():
+                break
+            if len(pending) >= 2 * workers:
+                collect(pending.pop(0))
+
+            previous_layer = layout[start - 1] if start > 0 else None
+            pending.append(pool.apply_async(_render_range_, (layout[start:stop], previous_layer,
+                                                             legends[start:stop], paths[start:stop])))
+
+        for result in pending:
+            collect(result)
+
+
+def render_pages(renderer, layout, legends, page_encoder, todo, profiler=None):
+    """
+    Draw layers in this process and encode them as container pages, in threads while the next layers are drawn
+    Args:
+        renderer (): LayerRenderer to use
+        layout (): 3D array or SparseLayout of palette indices, first axis being the layers
+        legends (): legend of each layer
+        page_encoder (): containers.PageEncoder of the pages
+        todo (): sorted indices of the layers to draw
+        profiler (): measures 'render' and 'encode' stages
+
+    Returns:
+        iterator of the page of each layer of todo, in order
+    """
+    if profiler is None:
+        profiler = Profiler()
+
+    threads = max(1, renderer.encode_threads)
+    pending = deque()
+
+    def collect():
+        page, duration = pending.popleft().result()
+        profiler.add('encode', duration)
+        return page
+
+    with ThreadPoolExecutor(threads) as executor:
+        for start, stop in get_runs(todo):
+            previous_layer = layout[start - 1] if start > 0 else None
+            for i_layer in range(start, stop):
+                layer = layout[i_layer]
+                with profiler.stage('render'):
+                    layer_img = renderer.render(layer, previous_layer, legends[i_layer])
+                # bounded like LayerWriter, drawing waits for the encoders
+                if len(pending) >= PIPELINE_DEPTH * threads:
+                    yield collect()
+                pending.append(executor.submit(_encode_page_, page_encoder, layer_img))
+                previous_layer = layer
+
+        while pending:
+            yield collect()
+
+
+def render_pages_parallel(renderer, layout, legends, page_encoder, todo, workers, profiler=None):
+    """
+    Draw layers and encode them as container pages with a pool of processes, pages come back in order
+    Args:
+        renderer (): LayerRenderer to use
+        layout (): 3D array or SparseLayout of palette indices, first axis being the layers
+        legends (): legend of each layer
+        page_encoder (): containers.PageEncoder of the pages
+        todo (): sorted indices of the layers to draw
+        workers (): number of processes
+        profiler (): receives the stages measured by the workers, their times are added together
+
+    Returns:
+        iterator of the page of each layer of todo, in order
+    """
+    ranges = get_worker_ranges(len(layout), workers, todo)
+    trace_memory = profiler is not None and profiler.trace_memory
+    with Pool(workers, initializer=_init_worker_, initargs=(renderer, trace_memory, page_encoder)) as pool:
+        # only a few ranges of encoded pages wait to be written
+        pending = deque()
+        for start, stop in ranges:
+            if len(pending) >= 2 * workers:
+                yield from _collect_pages_(pending.popleft(), profiler)
+
+            previous_layer = layout[start - 1] if start > 0 else None
+            pending.append(pool.apply_async(_render_pages_, (layout[start:stop], previous_layer, legends[start:stop])))
+
+        while pending:
+            yield from _collect_pages_(pending.popleft(), profiler)
+
+
+def _collect_pages_(result, profiler):
+    pages, stages = result.get()
+    if profiler is not None:
+        profiler.merge(stages)
+    return pages
+
+# endregion workers
@@ -0,0 +1,18 @@
+# -------------------------------------------------------------------------------
+# Name:        resources
+# Purpose:     locate the files shipped with the application, without importing the export pipeline
+# -------------------------------------------------------------------------------
+
+import sys
+from os import path
+
+
+def resource_path(relative):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = path.abspath(".")
+
+    return path.join(base_path, relative)
@@ -0,0 +1,256 @@
+# -------------------------------------------------------------------------------
+# Name:        structure_formats
+# Purpose:     load Sponge schematics (.schem) and Litematica files (.litematic)
+# -------------------------------------------------------------------------------
+
+from os import path
+
+import numpy as np
+
+from nbt_reader import read_nbt, read_structure
+
+STRUCTURE_EXTENSIONS = ('.nbt', '.schem', '.litematic')
+# blocks drawn and counted as nothing
+AIR_BLOCKS = ('air', 'cave_air', 'void_air')
+
+
+def minecraft_clean_base(value: str) -> str:
+    """
+    Clean a minecraft index name from the '#minecraft:' if present
+    Args:
+        value (): the string to evaluate
+
+    Returns:
+        clean string
+    """
+    index = value.find('minecraft:')
+
+    if index == 0:
+        return value[10::]
+    elif index == 1 and value[0] == '#':
+        return '#' + value[11::]
+
+    return value
+
+
+def get_air_states(palette: list[dict[str: dict | str]]) -> list[int]:
+    """
+    Get the palette indices of every kind of air
+    Args:
+        palette (): palette of a structure
+
+    Returns:
+        sorted indices, 'air' first if present
+    """
+    states = [i for i, block_data in enumerate(palette) if minecraft_clean_base(block_data['Name']) in AIR_BLOCKS]
+    return sorted(states, key=lambda i: minecraft_clean_base(palette[i]['Name']) != 'air')
+
+
+def get_fill_state(palette: list[dict[str: dict | str]], air_states: list[int] = None) -> int:
+    """
+    Get the state of the cells without block
+    Args:
+        palette (): palette of a structure
+        air_states (): result of get_air_states, computed if None
+
+    Returns:
+        the first air state, else the state past the palette, drawn and counted like air
+    """
+    if air_states is None:
+        air_states = get_air_states(palette)
+    return air_states[0] if air_states else len(palette)
+
+
+def parse_block_state(state: str) -> dict[str: dict | str]:
+    """
+    Transform a block state string to a palette entry
+    Args:
+        state (): 'minecraft:oak_stairs[facing=east,half=bottom]' like string
+
+    Returns:
+        {'Name': str, 'Properties': dict}, without 'Properties' if there is none
+    """
+    index = state.find('[')
+    if index == -1:
+        return {'Name': state}
+
+    properties = {}
+    for prop in state[index + 1:-1].split(','):
+        if prop:
+            key, _, value = prop.partition('=')
+            properties[key.strip()] = value.strip()
+    return {'Name': state[:index], 'Properties': properties}
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """
+    Decode a byte array of unsigned LEB128 varints
+    Args:
+        data (): byte array
+
+    Returns:
+        int64 array of values
+    """
+    data = data.view(np.uint8)
+    if len(data) == 0 or data.max() < 0x80:
+        return data.astype(np.int64)
+
+    ends = (data & 0x80) == 0
+    if not ends[-1]:
+        raise ValueError('Truncated varint data')
+
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    lengths = np.diff(np.concatenate((starts, [len(data)])))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, lengths))
+
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+
+def unpack_bits(longs: np.ndarray, bits: int, count: int) -> np.ndarray:
+    """
+    Read values packed in a long array, a value can span two longs (Litematica layout)
+    Args:
+        longs (): int64 array
+        bits (): bits per value
+        count (): number of values
+
+    Returns:
+        int64 array of values
+    """
+    longs = longs.view(np.uint64)
+    mask = np.uint64((1 << bits) - 1)
+
+    start = np.arange(count, dtype=np.uint64) * np.uint64(bits)
+    index = (start >> np.uint64(6)).astype(np.intp)
+    offset = start & np.uint64(63)
+
+    values = longs[index] >> offset
+
+    # values crossing a long boundary get their high bits from the next long
+    spanning = offset + np.uint64(bits) > np.uint64(64)
+    if spanning.any():
+        high = longs[index[spanning] + 1] << (np.uint64(64) - offset[spanning])
+        values[spanning] |= high
+
+    return (values & mask).astype(np.int64)
+
+
+def read_sponge_schematic(filepath: str) -> dict:
+    """
+    Read a Sponge schematic (.schem) of version 1, 2 or 3
+    Args:
+        filepath (): relative or absolut path to the .schem file
+
+    Returns:
+        dict like nbt_reader.read_structure, with a dense 'indices' array (x, y, z) instead of positions and states
+    """
+    root = read_nbt(filepath)
+    if 'Schematic' in root:  # version 3 wraps everything
+        root = root['Schematic']
+
+    width, height, length = (root[k] & 0xFFFF for k in ('Width', 'Height', 'Length'))
+    if 'Blocks' in root:
+        palette_tag = root['Blocks']['Palette']
+        block_data = root['Blocks']['Data']
+        block_entities = root['Blocks'].get('BlockEntities', [])
+    else:
+        palette_tag = root['Palette']
+        block_data = root['BlockData']
+        block_entities = root.get('BlockEntities', root.get('TileEntities', []))
+
+    palette = [None] * (max(palette_tag.values()) + 1 if palette_tag else 0)
+    for state, index in palette_tag.items():
+        palette[index] = parse_block_state(state)
+    for index in range(len(palette)):
+        if palette[index] is None:
+            palette[index] = {'Name': 'minecraft:air'}
+
+    states = decode_varints(block_data)
+    if len(states) != width * height * length:
+        raise ValueError(f'{filepath} has {len(states)} blocks instead of {width * height * length}')
+
+    # data is ordered by y, then z, then x
+    indices = states.reshape(height, length, width).transpose(2, 0, 1)
+
+    return {'size': (width, height, length), 'indices': indices, 'palette': palette,
+            'block_entities': block_entities, 'entities': root.get('Entities', [])}
+
+
+def _get_region_box_(region: dict) -> tuple[np.ndarray, np.ndarray]:
+    position = np.array([region['Position'][k] for k in 'xyz'])
+    size = np.array([region['Size'][k] for k in 'xyz'])
+
+    # a negative size goes toward negative coordinates from the position
+    end = position + size - np.sign(size)
+    return np.minimum(position, end), np.abs(size)
+
+
+def read_litematic(filepath: str) -> dict:
+    """
+    Read a Litematica schematic, all regions are merged in one volume
+    Args:
+        filepath (): relative or absolut path to the .litematic file
+
+    Returns:
+        dict like nbt_reader.read_structure, with a dense 'indices' array (x, y, z) instead of positions and states
+    """
+    root = read_nbt(filepath)
+    regions = list(root['Regions'].values())
+    if not regions:
+        raise ValueError(f'{filepath} has no region')
+
+    boxes = [_get_region_box_(region) for region in regions]
+    origin = np.min([box[0] for box in boxes], axis=0)
+    size = np.max([box[0] + box[1] for box in boxes], axis=0) - origin
+
+    # merged palette, cells outside every region are air
+    palette = [{'Name': 'minecraft:air'}]
+    keys = {('minecraft:air', ()): 0}
+    indices = np.zeros(tuple(size), dtype=np.int64)
+    block_entities = []
+    entities = []
+
+    for region, (corner, region_size) in zip(regions, boxes):
+        mapping = []
+        for block_data in region['BlockStatePalette']:
+            key = (block_data['Name'], tuple(sorted(block_data.get('Properties', {}).items())))
+            if key not in keys:
+                keys[key] = len(palette)
+                palette.append(block_data)
+            mapping.append(keys[key])
+
+        count = int(np.prod(region_size))
+        bits = max(2, (len(mapping) - 1).bit_length())
+        states = np.array(mapping, dtype=np.int64)[unpack_bits(region['BlockStates'], bits, count)]
+
+        # data is ordered by y, then z, then x
+        x, y, z = corner - origin
+        width, height, length = region_size
+        region_indices = states.reshape(height, length, width).transpose(2, 0, 1)
+        air = region_indices == 0
+        target = indices[x:x + width, y:y + height, z:z + length]
+        target[~air] = region_indices[~air]
+
+        block_entities += region.get('TileEntities', [])
+        entities += region.get('Entities', [])
+
+    return {'size': tuple(int(i) for i in size), 'indices': indices, 'palette': palette,
+            'block_entities': block_entities, 'entities': entities}
+
+
+def load_structure(filepath: str, block_entities: bool = False) -> dict:
+    """
+    Read any supported structure file, chosen by extension
+    Args:
+        filepath (): relative or absolut path to a .nbt, .schem or .litematic file
+        block_entities (): read the block entities of .nbt files, other formats always have them
+
+    Returns:
+        dict like nbt_reader.read_structure, see Volume.from_structure
+    """
+    extension = path.splitext(filepath)[1].lower()
+    if extension == '.schem':
+        return read_sponge_schematic(filepath)
+    elif extension == '.litematic':
+        return read_litematic(filepath)
+    return read_structure(filepath, block_entities=block_entities)
@@ -0,0 +1,33 @@
+# -------------------------------------------------------------------------------
+# Name:        conftest
+# Purpose:     shared fixtures of the tests, run from the repository like the application
+# -------------------------------------------------------------------------------
+
+import sys
+from os import path
+
+import pytest
+
+REPOSITORY = path.dirname(path.dirname(path.abspath(__file__)))
+if REPOSITORY not in sys.path:
+    sys.path.insert(0, REPOSITORY)
+
+# used when the bundled font is not in the checkout
+FALLBACK_FONTS = ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 'C:/Windows/Fonts/arial.ttf',
+                  '/Library/Fonts/Arial.ttf')
+
+
+@pytest.fixture(autouse=True)
+def repository_directory(monkeypatch):
+    # assets are relative to the repository
+    monkeypatch.chdir(REPOSITORY)
+
+
+@pytest.fixture
+def font_path():
+    from export import Exporter
+
+    for font in (Exporter.PATH_FONTS,) + FALLBACK_FONTS:
+        if path.exists(font):
+            return font
+    pytest.skip('no font to draw the legend')
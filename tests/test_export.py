@@ -0,0 +1,81 @@
+import shutil
+import tracemalloc
+from os import path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from asset_index import AssetIndex
+from conftest import REPOSITORY
+from export import Exporter, ExportSettings
+from texture_cache import TextureCache
+
+
+def test_missing_textures_with_warm_cache(tmp_path, font_path):
+    settings = ExportSettings(block_size=16, create_missing=True)
+    structure_path = tmp_path / 'cod.nbt'
+    shutil.copy(path.join(REPOSITORY, 'examples', 'cod.nbt'), structure_path)
+    cache = TextureCache(str(tmp_path / 'cache'))
+
+    results = []
+    for run in ('cold', 'warm'):
+        # a new exporter has no texture in memory, the second one only reads the disk cache
+        exporter = Exporter(settings, cache)
+        exporter.PATH_FONTS = font_path
+        results.append(exporter.export(str(structure_path), directory=str(tmp_path / run)))
+
+    cold, warm = results
+    assert cold['missing']
+    assert warm['missing'] == cold['missing']
+    assert path.exists(path.join(warm['directory'], 'cod_missing.txt'))
+
+
+def test_failed_export_stops_tracing(tmp_path):
+    structure_path = tmp_path / 'corrupt.nbt'
+    structure_path.write_bytes(b'not a structure')
+    exporter = Exporter(ExportSettings(create_profile=True), TextureCache(str(tmp_path / 'cache')))
+
+    with pytest.raises(Exception):
+        exporter.export(str(structure_path))
+    assert not tracemalloc.is_tracing()
+
+
+def test_edited_texture_redraws_layers(tmp_path, font_path):
+    # textures copied, so one can be edited
+    for directory in ('blocks', 'properties'):
+        shutil.copytree(path.join(REPOSITORY, 'assets', directory), tmp_path / directory)
+    structure_path = tmp_path / 'cod.nbt'
+    shutil.copy(path.join(REPOSITORY, 'examples', 'cod.nbt'), structure_path)
+
+    def export():
+        exporter = Exporter(ExportSettings(block_size=16), TextureCache(str(tmp_path / 'cache')),
+                            assets=AssetIndex(str(tmp_path / 'index.json')))
+        exporter.PATH_BLOCKS = str(tmp_path / 'blocks')
+        exporter.PATH_PROPERTIES = str(tmp_path / 'properties')
+        exporter.PATH_FONTS = font_path
+        return exporter.export(str(structure_path), directory=str(tmp_path / 'out'))
+
+    export()
+    assert export()['layers_drawn'] == 0
+
+    Image.new('RGBA', (16, 16), (255, 0, 0, 255)).save(tmp_path / 'blocks' / 'white_terracotta.png')
+    assert export()['layers_drawn'] > 0
+
+
+def test_structure_without_air(tmp_path, font_path):
+    # one stone block in a 3 x 1 x 3 structure, the other cells have no block
+    without_air = {'size': (3, 1, 3), 'palette': [{'Name': 'minecraft:stone'}],
+                   'positions': np.array([[1, 0, 1]], dtype=np.int32), 'states': np.array([0])}
+    with_air = dict(without_air, palette=[{'Name': 'minecraft:stone'}, {'Name': 'minecraft:air'}])
+    exporter = Exporter(ExportSettings(block_size=16, create_data=True), TextureCache(str(tmp_path / 'cache')))
+    exporter.PATH_FONTS = font_path
+
+    result = exporter.export_structure(without_air, 'without_air', str(tmp_path))
+    reference = exporter.export_structure(with_air, 'with_air', str(tmp_path))
+
+    assert result['count'] == {'stone': 1}
+    # cells without block are drawn like air
+    for layer_path, reference_path in zip(result['paths'], reference['paths']):
+        with Image.open(layer_path) as img, Image.open(reference_path) as reference_img:
+            assert (np.asarray(img) == np.asarray(reference_img)).all()
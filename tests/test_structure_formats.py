@@ -0,0 +1,149 @@
+import gzip
+import struct
+
+import numpy as np
+
+from structure_formats import decode_varints, unpack_bits, load_structure
+
+# region NBT writer, enough for the fixtures below
+
+
+def _string_(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return struct.pack('>H', len(data)) + data
+
+
+def _payload_(tag: int, value) -> bytes:
+    if tag == 2:
+        return struct.pack('>h', value)
+    if tag == 3:
+        return struct.pack('>i', value)
+    if tag == 7:
+        return struct.pack('>i', len(value)) + bytes(value)
+    if tag == 8:
+        return _string_(value)
+    if tag == 9:
+        item_tag, items = value
+        return struct.pack('>bi', item_tag, len(items)) + b''.join(_payload_(item_tag, item) for item in items)
+    if tag == 10:
+        return b''.join(bytes([t]) + _string_(k) + _payload_(t, v) for k, (t, v) in value.items()) + b'\0'
+    if tag == 12:
+        return struct.pack('>i', len(value)) + np.asarray(value, dtype='>i8').tobytes()
+    raise ValueError(tag)
+
+
+def write_nbt(filepath, root: dict):
+    with open(filepath, 'wb') as file:
+        file.write(gzip.compress(b'\x0a' + _string_('') + _payload_(10, root)))
+
+# endregion
+
+# region naive encoders
+
+
+def encode_varint(value: int) -> list[int]:
+    data = []
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return data
+
+
+def pack_bits(values, bits: int) -> list[int]:
+    longs = [0] * ((len(values) * bits + 63) // 64)
+    for i, value in enumerate(values):
+        for bit in range(bits):
+            if value >> bit & 1:
+                longs[(i * bits + bit) // 64] |= 1 << ((i * bits + bit) % 64)
+    # signed, as stored in NBT
+    return [long - (1 << 64) if long >= 1 << 63 else long for long in longs]
+
+# endregion
+
+
+def test_decode_varints():
+    rng = np.random.default_rng(0)
+    values = np.concatenate((rng.integers(0, 1 << 7, 100), rng.integers(0, 1 << 21, 100),
+                             rng.integers(0, 1 << 35, 100), [0, 127, 128, 16383, 16384]))
+    rng.shuffle(values)
+    data = np.array([byte for value in values for byte in encode_varint(int(value))], dtype=np.uint8)
+
+    assert (decode_varints(data) == values).all()
+    # single byte values only
+    assert (decode_varints(np.array([0, 5, 127], dtype=np.uint8)) == [0, 5, 127]).all()
+
+
+def test_unpack_bits():
+    rng = np.random.default_rng(0)
+    # most sizes do not divide 64, values then span two longs
+    for bits in (2, 3, 5, 7, 12, 13, 31, 32, 33, 63):
+        values = rng.integers(0, 1 << bits, 200, dtype=np.uint64).astype(np.int64)
+        longs = np.array(pack_bits([int(value) for value in values], bits), dtype=np.int64)
+
+        assert (unpack_bits(longs, bits, len(values)) == values).all(), bits
+
+
+def _get_state_(block: dict) -> str:
+    if 'Properties' in block:
+        return block['Name'] + '[' + ','.join(f'{k}={v}' for k, v in block['Properties'].items()) + ']'
+    return block['Name']
+
+
+def _get_blocks_(indices, palette) -> np.ndarray:
+    # states by name, palettes of two readers are not ordered alike
+    return np.array([_get_state_(palette[i]) for i in indices.ravel()]).reshape(indices.shape)
+
+
+def test_read_sponge_schematic(tmp_path):
+    # more than 128 states, indices need two byte varints
+    palette = [{'Name': 'minecraft:air'}] + [{'Name': f'minecraft:block_{i}'} for i in range(199)] + \
+              [{'Name': 'minecraft:oak_stairs', 'Properties': {'facing': 'east', 'half': 'top'}}]
+    rng = np.random.default_rng(0)
+    width, height, length = 4, 3, 5
+    indices = rng.integers(0, len(palette), (width, height, length))
+
+    data = [byte for value in indices.transpose(1, 2, 0).ravel() for byte in encode_varint(int(value))]
+    blocks = {'Palette': (10, {_get_state_(block): (3, i) for i, block in enumerate(palette)}), 'Data': (7, data)}
+    write_nbt(tmp_path / 'test.schem', {'Schematic': (10, {
+        'Version': (3, 3), 'Width': (2, width), 'Height': (2, height), 'Length': (2, length), 'Blocks': (10, blocks)
+    })})
+
+    structure = load_structure(str(tmp_path / 'test.schem'))
+    assert structure['size'] == (width, height, length)
+    assert (_get_blocks_(structure['indices'], structure['palette']) == _get_blocks_(indices, palette)).all()
+
+
+def _region_(indices, palette, position, size) -> tuple[int, dict]:
+    bits = max(2, (len(palette) - 1).bit_length())
+    return 10, {
+        'Position': (10, {k: (3, v) for k, v in zip('xyz', position)}),
+        'Size': (10, {k: (3, v) for k, v in zip('xyz', size)}),
+        'BlockStatePalette': (9, (10, [{'Name': (8, block['Name'])} for block in palette])),
+        'BlockStates': (12, pack_bits([int(value) for value in indices.transpose(1, 2, 0).ravel()], bits))
+    }
+
+
+def test_read_litematic(tmp_path):
+    rng = np.random.default_rng(0)
+    # 5 states, 3 bits by value
+    first_palette = [{'Name': 'minecraft:air'}] + [{'Name': f'minecraft:block_{i}'} for i in range(4)]
+    first = rng.integers(0, len(first_palette), (3, 4, 5))
+    # 10 states, 4 bits by value, shares block_0 to block_3 with the first region
+    second_palette = [{'Name': 'minecraft:air'}] + [{'Name': f'minecraft:block_{i}'} for i in range(9)]
+    second = rng.integers(0, len(second_palette), (2, 4, 5))
+
+    # the second region is next to the first one on x, given from its far corner with a negative size
+    write_nbt(tmp_path / 'test.litematic', {'Version': (3, 6), 'Regions': (10, {
+        'first': _region_(first, first_palette, (10, 5, 0), (3, 4, 5)),
+        'second': _region_(second, second_palette, (14, 8, 4), (-2, -4, -5))
+    })})
+
+    structure = load_structure(str(tmp_path / 'test.litematic'))
+    assert structure['size'] == (5, 4, 5)
+    blocks = _get_blocks_(structure['indices'], structure['palette'])
+    assert (blocks[:3] == _get_blocks_(first, first_palette)).all()
+    assert (blocks[3:] == _get_blocks_(second, second_palette)).all()
@@ -0,0 +1,17 @@
+from os import path
+
+from export import ExportSettings
+from texture_cache import TextureCache
+from watch import ExportPool
+
+
+def test_same_output_key(tmp_path):
+    pool = ExportPool(ExportSettings(), 1, str(tmp_path / 'out'), str(tmp_path / 'in'),
+                      TextureCache(str(tmp_path / 'cache')))
+    try:
+        house = pool.get_output_key(path.join(tmp_path, 'in', 'house.nbt'))
+        # both are exported to out/house/house_layer_N.png
+        assert pool.get_output_key(path.join(tmp_path, 'in', 'house.schem')) == house
+        assert pool.get_output_key(path.join(tmp_path, 'in', 'sub', 'house.schem')) != house
+    finally:
+        pool.close()
@@ -0,0 +1,117 @@
+# -------------------------------------------------------------------------------
+# Name:        texture_cache
+# Purpose:     keep resized and composited textures on disk between runs
+# -------------------------------------------------------------------------------
+
+import hashlib
+from os import path, makedirs, environ, replace, getpid, stat
+from threading import get_ident
+
+import PIL
+from PIL import Image
+
+from asset_index import AssetIndex
+
+
+def get_cache_directory() -> str:
+    """
+    Get the user cache directory of the application
+    Returns:
+        absolute path, not created
+    """
+    base = environ.get('LOCALAPPDATA') or environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache')
+    return path.join(base, 'Minecraft2Layout', 'textures')
+
+
+class TextureCache:
+    """
+    Disk cache of ready to draw RGBA textures
+    Entries are keyed by texture name (with properties), scale, resampling and the content of every source file,
+    so editing a texture in assets makes its old entries unreachable.
+    """
+    VERSION = 1
+
+    def __init__(self, directory: str = None):
+        if directory is None:
+            directory = get_cache_directory()
+        self.directory = path.join(directory, f'v{self.VERSION}')
+        self.hashes = {}
+
+    def get_signature(self, sources: list[str], assets: AssetIndex = None) -> list[str]:
+        """
+        Identify the content of source files
+        Content is hashed rather than using paths and dates, as a PyInstaller build extracts
+        its assets to a new temporary folder each run. Hashes are kept while the file is unchanged.
+        Args:
+            sources (): paths of the files used to build a texture
+            assets (): index giving the hashes of the indexed files without reading them
+
+        Returns:
+            list of hashes
+        """
+        signature = []
+        for source in sources:
+            source_hash = assets.get_hash(source) if assets is not None else None
+            if source_hash is not None:
+                signature.append(source_hash)
+                continue
+
+            source_stat = stat(source)
+            state = (path.abspath(source), source_stat.st_mtime_ns, source_stat.st_size)
+
+            if state not in self.hashes:
+                with open(source, 'rb') as file:
+                    self.hashes[state] = hashlib.sha1(file.read()).hexdigest()
+            signature.append(self.hashes[state])
+        return signature
+
+    def get_entry_path(self, name: str, sources: list[str], scale: int, resample, assets: AssetIndex = None) -> str:
+        """
+        Get the cache file of a texture
+        Args:
+            name (): texture name, including its properties
+            sources (): paths of the files used to build the texture
+            scale (): size of the texture in pixel
+            resample (): resampling filter used to resize, None for Pillow default
+            assets (): see get_signature
+
+        Returns:
+            path of the cache file, it may not exist
+        """
+        key = repr((self.VERSION, PIL.__version__, name, scale, resample, self.get_signature(sources, assets)))
+        return path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.png')
+
+    @staticmethod
+    def load(entry_path: str) -> Image.Image | None:
+        """
+        Read a cache file
+        Args:
+            entry_path (): path given by get_entry_path
+
+        Returns:
+            texture, None if not cached
+        """
+        if not path.exists(entry_path):
+            return None
+
+        try:
+            with Image.open(entry_path) as img:
+                img.load()
+        except OSError:
+            return None
+        return img
+
+    def save(self, entry_path: str, img: Image.Image):
+        """
+        Write a cache file, other processes never see a partial file
+        Args:
+            entry_path (): path given by get_entry_path
+            img (): texture to cache
+        """
+        if not path.exists(self.directory):
+            makedirs(self.directory, exist_ok=True)
+
+        # threads of a process can write the same entry, see watch.ExportPool
+        temp_path = f'{entry_path}.{getpid()}.{get_ident()}.tmp'
+        img.save(temp_path, format='PNG')
+        replace(temp_path, entry_path)
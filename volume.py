@@ -0,0 +1,213 @@
+# -------------------------------------------------------------------------------
+# Name:        volume
+# Purpose:     compact numpy storage of a structure's palette indices
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+# axes of the structure used as (layer, row, column) for each layout direction
+AXIS_ORDERS = {
+    'x': (0, 2, 1),
+    'y': (1, 2, 0),
+    'z': (2, 0, 1)
+}
+
+
+class Volume:
+    """
+    3D array of palette indices, indexed as [x][y][z] like the structure positions
+    """
+
+    def __init__(self, indices: np.ndarray, palette: list[dict[str: dict | str]]):
+        self.indices = indices
+        self.palette = palette
+
+    @property
+    def size(self) -> tuple[int, int, int]:
+        return self.indices.shape
+
+    @staticmethod
+    def get_dtype(palette_length: int) -> np.dtype:
+        """
+        Get the smallest unsigned type able to store every index of a palette, and the state past it
+        Args:
+            palette_length (): number of states in the palette
+
+        Returns:
+            numpy dtype
+        """
+        if palette_length <= np.iinfo(np.uint16).max:
+            return np.dtype(np.uint16)
+        return np.dtype(np.uint32)
+
+    @classmethod
+    def from_arrays(cls, size, positions: np.ndarray, states: np.ndarray, palette, fill: int = 0) -> 'Volume':
+        """
+        Create a volume from already decoded positions and states
+        Args:
+            size (): size of the structure (x, y, z)
+            positions (): (n, 3) array of block positions
+            states (): (n,) array of palette indices
+            palette (): palette of the structure
+            fill (): state used for cells without block
+
+        Returns:
+            Volume
+        """
+        indices = np.full(tuple(size), fill, dtype=cls.get_dtype(len(palette)))
+        if len(states) > 0:
+            indices[positions[:, 0], positions[:, 1], positions[:, 2]] = states
+
+        return cls(indices, palette)
+
+    @classmethod
+    def from_structure(cls, structure: dict, fill: int = 0) -> 'Volume':
+        """
+        Create a volume from a loaded structure file
+        Args:
+            structure (): dict with 'size' and 'palette', then either dense 'indices' or 'positions' and 'states'
+            fill (): state used for cells without block, only for positions and states
+
+        Returns:
+            Volume
+        """
+        palette = structure['palette']
+        if 'indices' in structure:
+            return cls(np.asarray(structure['indices']).astype(cls.get_dtype(len(palette))), palette)
+
+        return cls.from_arrays(structure['size'], structure['positions'], structure['states'], palette, fill)
+
+    def oriented(self, axis_order: tuple[int, int, int]) -> np.ndarray:
+        """
+        Get the indices with axes reordered for a layout direction, no data is copied
+        Args:
+            axis_order (): axes of the structure used as (layer, row, column)
+
+        Returns:
+            numpy view of the indices
+        """
+        return self.indices.transpose(axis_order)
+
+
+class SparseLayout:
+    """
+    Layers of a structure built on demand from its blocks, sorted once by layer
+    Each block costs 6 bytes instead of 2 bytes by cell for a dense volume, so it is smaller for structures
+    mostly made of air, and no layer exists in memory until it is asked for.
+    """
+
+    def __init__(self, size, positions: np.ndarray, states: np.ndarray, palette_length: int,
+                 axis_order: tuple[int, int, int], fill: int = 0, air_states=()):
+        """
+        Args:
+            size (): size of the structure (x, y, z)
+            positions (): (n, 3) array of block positions
+            states (): (n,) array of palette indices
+            palette_length (): number of states in the palette
+            axis_order (): axes of the structure used as (layer, row, column)
+            fill (): state used for cells without block
+            air_states (): states replaced by fill
+        """
+        self.shape = tuple(int(size[axis]) for axis in axis_order)
+        self.dtype = Volume.get_dtype(palette_length)
+        self.fill = fill
+
+        # stable, so the last block of a position still wins like in a dense volume
+        order = np.argsort(positions[:, axis_order[0]], kind='stable')
+        position_dtype = Volume.get_dtype(max(self.shape[1:]))
+        self.rows = positions[order, axis_order[1]].astype(position_dtype)
+        self.columns = positions[order, axis_order[2]].astype(position_dtype)
+        self.states = merge_states(states[order].astype(self.dtype), palette_length, air_states, fill)
+        self.bounds = np.searchsorted(positions[order, axis_order[0]], np.arange(self.shape[0] + 1)).tolist()
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def get_layer(self, i_layer: int) -> np.ndarray:
+        layer = np.full(self.shape[1:], self.fill, dtype=self.dtype)
+        start, stop = self.bounds[i_layer], self.bounds[i_layer + 1]
+        layer[self.rows[start:stop], self.columns[start:stop]] = self.states[start:stop]
+        return layer
+
+    def __getitem__(self, key) -> np.ndarray:
+        if isinstance(key, slice):
+            layers = [self.get_layer(i_layer) for i_layer in range(*key.indices(len(self)))]
+            return np.stack(layers) if layers else np.zeros((0,) + self.shape[1:], dtype=self.dtype)
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('layer index out of range')
+        return self.get_layer(key)
+
+    def __iter__(self):
+        for i_layer in range(len(self)):
+            yield self.get_layer(i_layer)
+
+
+def merge_states(indices: np.ndarray, palette_length: int, states, target: int) -> np.ndarray:
+    """
+    Replace some states by another one, in place
+    Args:
+        indices (): array of palette indices
+        palette_length (): number of states in the palette
+        states (): states to replace
+        target (): state replacing them
+
+    Returns:
+        indices
+    """
+    if len(states) == 0:
+        return indices
+
+    lookup = np.arange(palette_length, dtype=indices.dtype)
+    lookup[list(states)] = target
+    # clip mode writes straight into indices instead of a temporary buffer
+    return np.take(lookup, indices, out=indices, mode='clip')
+
+
+def get_layout(structure: dict, axis_order: tuple[int, int, int], fill: int = 0,
+               air_states=()) -> np.ndarray | SparseLayout:
+    """
+    Get the layers of a loaded structure, sparse when it has few blocks for its size
+    Args:
+        structure (): see Volume.from_structure
+        axis_order (): axes of the structure used as (layer, row, column)
+        fill (): state used for cells without block
+        air_states (): states replaced by fill, so every kind of air is a single state
+
+    Returns:
+        3D array or SparseLayout, both indexed as [layer][row][column]
+    """
+    palette_length = len(structure['palette'])
+    if 'indices' not in structure and 3 * len(structure['states']) < np.prod(structure['size'], dtype=np.int64):
+        return SparseLayout(structure['size'], structure['positions'], structure['states'],
+                            palette_length, axis_order, fill, air_states)
+
+    # the volume is a copy, merged in place; the layout direction is only a view on it
+    volume = Volume.from_structure(structure, fill)
+    merge_states(volume.indices, palette_length, air_states, fill)
+    return volume.oriented(axis_order)
+
+
+def count_layer(layer: np.ndarray, palette_length: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Histogram of the states of a layer
+    Args:
+        layer (): 2D array of palette indices
+        palette_length (): number of states in the palette
+
+    Returns:
+        (palette_length,) array of counts
+        states present in the layer, sorted by first appearance
+    """
+    flat = np.ravel(layer)
+    counts = np.bincount(flat, minlength=palette_length)
+
+    states = np.flatnonzero(counts)
+    if len(states) > 1:
+        # unique values are sorted, like states
+        _, first = np.unique(flat, return_index=True)
+        states = states[np.argsort(first, kind='stable')]
+
+    return counts, states
@@ -0,0 +1,332 @@
+# -------------------------------------------------------------------------------
+# Name:        watch
+# Purpose:     headless mode exporting the structure files of a folder again each time they are saved
+# -------------------------------------------------------------------------------
+
+import argparse
+import json
+import signal
+import sys
+from collections import OrderedDict
+from multiprocessing import freeze_support
+from os import path, scandir, walk, chdir, cpu_count, makedirs
+from threading import Thread, Condition, Event
+from time import perf_counter
+
+from structure_formats import STRUCTURE_EXTENSIONS
+from export import Exporter, ExportSettings, ExportCancelled
+from texture_cache import TextureCache
+
+# seconds a file must stay unchanged before it is exported, a structure is often written in several steps
+DEBOUNCE = 2.0
+# seconds between two scans of the folder
+POLL_INTERVAL = 1.0
+
+
+def scan(directory: str, recursive: bool = False, extensions=STRUCTURE_EXTENSIONS) -> dict[str, tuple[int, int]]:
+    """
+    Get the state of the structure files of a folder
+    Args:
+        directory (): folder to scan
+        recursive (): scan sub folders too
+        extensions (): extensions of the files to watch
+
+    Returns:
+        dict of file path: (modification time in ns, size)
+    """
+    states = {}
+    folders = [root for root, _, _ in walk(directory)] if recursive else [directory]
+    for folder in folders:
+        try:
+            with scandir(folder) as entries:
+                for entry in entries:
+                    if path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                        entry_stat = entry.stat()
+                        states[entry.path] = (entry_stat.st_mtime_ns, entry_stat.st_size)
+        except OSError:
+            continue  # removed while scanning
+    return states
+
+
+class FolderWatcher:
+    """
+    Find the structure files which were added or modified, once they stopped changing
+    """
+
+    def __init__(self, directory: str, recursive: bool = False, debounce: float = DEBOUNCE,
+                 extensions=STRUCTURE_EXTENSIONS, existing: bool = False):
+        """
+        Args:
+            directory (): watched folder
+            recursive (): watch sub folders too
+            debounce (): seconds a file must keep the same size and date to be ready
+            extensions (): extensions of the files to watch
+            existing (): files already in the folder are ready too, else only later changes are
+        """
+        self.directory = directory
+        self.recursive = recursive
+        self.debounce = debounce
+        self.extensions = extensions
+        # state of each file when it was last given by poll
+        self.known = {} if existing else scan(directory, recursive, extensions)
+        # changed files: (state, time it was first seen)
+        self.changing = {}
+
+    def poll(self, now: float = None) -> list[str]:
+        """
+        Scan the folder once
+        Args:
+            now (): perf_counter time of the scan, the current one if None
+
+        Returns:
+            paths of the files that changed and stayed unchanged for the debounce delay, each change is given once
+        """
+        if now is None:
+            now = perf_counter()
+
+        states = scan(self.directory, self.recursive, self.extensions)
+        for filepath in set(self.known) - set(states):
+            del self.known[filepath]
+        for filepath in set(self.changing) - set(states):
+            del self.changing[filepath]
+
+        ready = []
+        for filepath, state in states.items():
+            if self.known.get(filepath) == state:
+                self.changing.pop(filepath, None)
+                continue
+
+            if filepath not in self.changing or self.changing[filepath][0] != state:
+                # still being written, the delay starts again
+                self.changing[filepath] = (state, now)
+            elif now - self.changing[filepath][1] >= self.debounce:
+                del self.changing[filepath]
+                self.known[filepath] = state
+                ready.append(filepath)
+        return sorted(ready)
+
+
+class ExportPool:
+    """
+    Fixed number of export threads, each keeping its own Exporter so textures stay loaded between exports
+    A file waits once in the queue however often it is submitted. Files with the same output, such as house.nbt and
+    house.schem, are never exported by two threads at once.
+    """
+
+    def __init__(self, settings: ExportSettings, jobs: int = 1, output: str = None, root: str = None,
+                 texture_cache: TextureCache = None, callback=None, font_path: str = None):
+        """
+        Args:
+            settings (): options of every export
+            jobs (): number of files exported at the same time
+            output (): folder of the exports, next to each structure if None
+            root (): watched folder, sub folders are kept in output
+            texture_cache (): disk cache of textures, the user cache directory if None
+            callback (): called from the export threads with the file path, the export result and the
+                         exception, one of them being None
+            font_path (): legend font, the one of the exporter if None
+        """
+        self.settings = settings
+        self.output = output
+        self.root = root
+        self.callback = callback
+
+        self.condition = Condition()
+        # files waiting, in submission order
+        self.pending = OrderedDict()
+        # outputs being written, see get_output_key
+        self.running = set()
+        self.stopping = False
+
+        texture_cache = texture_cache if texture_cache is not None else TextureCache()
+        # the texture index is read once, every exporter shares it
+        assets = Exporter.load_assets()
+        self.exporters = [Exporter(settings, texture_cache, assets=assets) for _ in range(max(1, jobs))]
+        if font_path is not None:
+            for exporter in self.exporters:
+                exporter.PATH_FONTS = font_path
+        self.threads = [Thread(target=self._run_, args=(exporter,), daemon=True) for exporter in self.exporters]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, filepath: str):
+        """
+        Queue a file to export, nothing is done when it is already waiting
+        """
+        with self.condition:
+            if filepath not in self.pending:
+                self.pending[filepath] = None
+                self.condition.notify()
+
+    def get_directory(self, filepath: str) -> str:
+        """
+        Folder of the export of a file
+        Args:
+            filepath (): structure file path
+
+        Returns:
+            output folder, with the sub folders of the file in the watched folder
+        """
+        if self.output is None:
+            return path.dirname(filepath)
+        if self.root is None:
+            return self.output
+        return path.normpath(path.join(self.output, path.relpath(path.dirname(filepath), self.root)))
+
+    def get_output_key(self, filepath: str) -> str:
+        """
+        Identify the files written by the export of a file
+        Args:
+            filepath (): structure file path
+
+        Returns:
+            output folder joined with the prefix of the created files
+        """
+        return path.normcase(path.join(self.get_directory(filepath), path.splitext(path.basename(filepath))[0]))
+
+    def _next_(self) -> str | None:
+        # file of the queue whose output is not being written, waits for one; None once closed
+        with self.condition:
+            while True:
+                if self.stopping:
+                    return None
+                for filepath in self.pending:
+                    output_key = self.get_output_key(filepath)
+                    if output_key not in self.running:
+                        del self.pending[filepath]
+                        self.running.add(output_key)
+                        return filepath
+                self.condition.wait()
+
+    def _run_(self, exporter: Exporter):
+        while True:
+            filepath = self._next_()
+            if filepath is None:
+                return
+
+            result, error = None, None
+            try:
+                directory = self.get_directory(filepath)
+                if not path.isdir(directory):
+                    makedirs(directory, exist_ok=True)
+                result = exporter.export(filepath, directory=directory)
+            except Exception as e:
+                error = e
+            finally:
+                with self.condition:
+                    self.running.discard(self.get_output_key(filepath))
+                    # a file with the same output may wait for this export to end
+                    self.condition.notify_all()
+
+            if self.callback is not None:
+                self.callback(filepath, result, error)
+
+    def is_idle(self) -> bool:
+        with self.condition:
+            return not self.pending and not self.running
+
+    def close(self, cancel: bool = False):
+        """
+        Stop the threads, waiting files are dropped
+        Args:
+            cancel (): stop the running exports after the layers being drawn, else wait for them
+        """
+        with self.condition:
+            self.stopping = True
+            self.pending.clear()
+            self.condition.notify_all()
+        if cancel:
+            for exporter in self.exporters:
+                exporter.cancel()
+        for thread in self.threads:
+            thread.join()
+
+
+def watch(directory: str, pool: ExportPool, watcher: FolderWatcher = None, poll_interval: float = POLL_INTERVAL,
+          stop: Event = None):
+    """
+    Export the files of a folder as they change, until stop is set
+    Args:
+        directory (): watched folder
+        pool (): pool running the exports
+        watcher (): finds the changed files, a non recursive FolderWatcher of directory if None
+        poll_interval (): seconds between two scans
+        stop (): Event ending the watch, runs until interrupted if None
+    """
+    if watcher is None:
+        watcher = FolderWatcher(directory)
+    if stop is None:
+        stop = Event()
+
+    while not stop.is_set():
+        for filepath in watcher.poll():
+            pool.submit(filepath)
+        stop.wait(poll_interval)
+
+
+def _print_result_(filepath, result, error):
+    name = path.basename(filepath)
+    if isinstance(error, ExportCancelled):
+        print(f'{name}: cancelled', flush=True)
+    elif error is not None:
+        print(f'{name}: failed, {error}', flush=True)
+    else:
+        line = f"{name}: {len(result['paths'])} files in {result['directory']}"
+        if result['missing']:
+            line += f", {len(result['missing'])} missing textures"
+        print(line, flush=True)
+
+
+def _interrupt_(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Export the structures of a folder each time they are saved')
+    parser.add_argument('directory', help='folder to watch')
+    parser.add_argument('-o', '--output', help='folder of the exports, next to each structure by default')
+    parser.add_argument('-r', '--recursive', action='store_true', help='watch sub folders too')
+    parser.add_argument('-a', '--all', action='store_true', help='export the files already in the folder first')
+    parser.add_argument('-j', '--jobs', type=int, default=max(1, (cpu_count() or 1) // 2),
+                        help='files exported at the same time')
+    parser.add_argument('-d', '--debounce', type=float, default=DEBOUNCE,
+                        help='seconds a file must stay unchanged before its export')
+    parser.add_argument('-i', '--interval', type=float, default=POLL_INTERVAL, help='seconds between two scans')
+    parser.add_argument('-s', '--settings', help='JSON file of export settings, see export.ExportSettings')
+    parser.add_argument('--cache', help='folder of the texture cache, the user cache directory by default')
+    parser.add_argument('--font', help='legend font, for checkouts without the bundled one')
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.settings:
+        with open(args.settings, 'r') as file:
+            settings = json.load(file)
+    try:
+        settings = ExportSettings(**settings)
+    except TypeError as e:
+        parser.error(str(e))
+
+    directory = path.abspath(args.directory)
+    if not path.isdir(directory):
+        parser.error(f'{args.directory} is not a folder')
+    output, cache, font = (path.abspath(p) if p else p for p in (args.output, args.cache, args.font))
+    # assets are relative to the repository
+    chdir(path.dirname(path.abspath(__file__)))
+
+    pool = ExportPool(settings, args.jobs, output, directory, TextureCache(cache), _print_result_, font)
+    watcher = FolderWatcher(directory, args.recursive, args.debounce, existing=args.all)
+    print(f'Watching {directory}, {args.jobs} jobs, Ctrl+C to stop', flush=True)
+    # a service manager stops the watch like Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt_)
+    try:
+        watch(directory, pool, watcher, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close(cancel=True)
+    return 0
+
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(main())